@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+import overpass
+import streetnames
+from streetnames import normalize_streetname, normalize_streetname_reference, normalize_many
+
+# Benchmark and correctness oracle for the street name normalization and
+# matching. Every optimized function is compared with a reference (the
+# original normalize_streetname and linear matching of the tags) on the
+# corpus, throughputs are reported in names per second and can be compared
+# with a baseline saved by an earlier run.
+
+SURNAMES = ["Renner", "Körner", "Schärf", "Kreisky", "Figl", "Raab", "Wildgans", "Grillparzer", "Stifter", "Mozart", "Haydn",
+    "Schubert", "Strauß", "Lehár", "Waldmüller", "Klimt", "Schiele", "Loos", "Kaplan", "Gföhler", "Weiß", "Groß", "Hölzl",
+    "Jägermayr", "Oberndorfer", "Meißl", "Ebner-Eschenbach", "Hammer-Purgstall"]
+WORDS = ["Haupt", "Bahnhof", "Kirchen", "Schul", "Mühl", "Wiesen", "Wald", "Berg", "Feld", "Garten", "Linden", "Birken",
+    "Au", "Dorf", "Markt", "Schloss", "Brunnen", "Flur", "Steinbruch", "Weingarten", "Äcker", "Öd", "Grün", "Süd", "Nord"]
+POSTFIXES = ["straße", "str.", "gasse", "g.", "weg", "platz", "allee", "ring", "zeile", "steig", "siedlung", "gürtel"]
+PLACES = ["Sankt Peter im Feld", "St. Martin am Ybbsfelde", "Neudorf bei Staatz", "Weißenbach an der Triesting",
+    "Maria Enzersdorf", "Bad Vöslau", "Groß-Siegharts", "Klein Pöchlarn", "Oberwölbling", "Unterach am Attersee"]
+TITLES = list(streetnames.ABBREVIATIONS.keys()) + list(streetnames.ABBREVIATIONS.values())
+THRESHOLD = 0.2
+
+def generate_corpus(count, seed=1):
+    """Returns count BEV like street names and an OSM variant of each
+    (other spelling of abbreviations, dashes and postfix)"""
+    rand = random.Random(seed)
+    bev_names = []
+    osm_names = []
+    for i in range(count):
+        kind = rand.random()
+        if kind < 0.4:
+            name = "%s%s" % (rand.choice(WORDS), rand.choice(POSTFIXES))
+        elif kind < 0.8:
+            parts = [rand.choice(streetnames.NAMES), rand.choice(SURNAMES)]
+            if rand.random() < 0.5:
+                parts.insert(0, rand.choice(TITLES))
+            name = "%s-%s" % ("-".join(parts), rand.choice(POSTFIXES).capitalize())
+        elif kind < 0.9:
+            name = rand.choice(PLACES)
+        else:
+            name = "%s %s" % (rand.choice(["Am", "An der", "Zur", "Im", "Auf der"]), rand.choice(WORDS) + rand.choice(["", "e", "en"]))
+        bev_names.append(name)
+        osm_names.append(_get_variant(name, rand))
+    return bev_names, osm_names
+
+def _get_variant(name, rand):
+    for short, long in [("str.", "straße"), ("Str.", "Straße"), ("g.", "gasse"), ("St.", "Sankt"), ("Dr.", "Doktor"),
+            ("Bgm.", "Bürgermeister")]:
+        if short in name and rand.random() < 0.7:
+            name = name.replace(short, long)
+    if rand.random() < 0.3:
+        name = name.replace("-", " ")
+    if rand.random() < 0.1:
+        name = name.upper()
+    return name
+
+def read_corpus(filename):
+    """Reads street names from a text file (one per line) or the STRASSE
+    table of a BEV database (.sqlite)"""
+    if filename.endswith(".sqlite"):
+        con = sqlite3.connect(filename)
+        names = [row[0] for row in con.execute("SELECT STRASSENNAME FROM STRASSE;")]
+        con.close()
+        return names
+    with open(filename, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _normalize(function, name, **kwargs):
+    try:
+        return function(name, **kwargs)
+    except ValueError:
+        return None
+
+def check_normalization(names):
+    """Compares normalize_streetname with the reference for all option
+    combinations, returns the differences"""
+    differences = []
+    for kwargs in ({}, {"ignore_street_postfix": True}, {"expand_abbreviations": False}):
+        for name in names:
+            expected = _normalize(normalize_streetname_reference, name, **kwargs)
+            if _normalize(normalize_streetname, name, **kwargs) != expected:
+                differences.append((name, kwargs, expected, _normalize(normalize_streetname, name, **kwargs)))
+    expected = [_normalize(normalize_streetname_reference, name) for name in names]
+    if normalize_many(names) != expected:
+        differences.append(("normalize_many", {}, None, None))
+    return differences
+
+def _get_ways(osm_names, bev_names, rand):
+    ways = []
+    for i, name in enumerate(osm_names):
+        tags = {"highway": "residential", "name": name}
+        if rand.random() < 0.2:
+            tags["alt_name"] = bev_names[i]
+        if rand.random() < 0.1:
+            tags["place"] = "hamlet"
+        ways.append(overpass.Element("way", i, tags=tags))
+    return ways
+
+def _match_streets_reference(ways, name, ignore_street_postfix=False):
+    matches = []
+    normalized_streetname = normalize_streetname_reference(name, ignore_street_postfix=ignore_street_postfix)
+    for way in ways:
+        for tag in overpass.STREET_NAME_TAGS:
+            if tag in way.tags and _normalize(normalize_streetname_reference, way.tags[tag], ignore_street_postfix=ignore_street_postfix) == normalized_streetname:
+                matches.append(way)
+    return matches
+
+def _place_exists_reference(places, name, ignore_postfix=False):
+    if ignore_postfix:
+        name = overpass._strip_place_postfix(name)
+    normalized_name = _normalize(normalize_streetname_reference, name)
+    for place in places:
+        for tag in overpass.PLACE_NAME_TAGS:
+            if tag in place.tags:
+                found_name = place.tags[tag]
+                if ignore_postfix:
+                    found_name = overpass._strip_place_postfix(found_name)
+                if normalized_name is not None and _normalize(normalize_streetname_reference, found_name) == normalized_name:
+                    return True
+    return False
+
+def check_matching(ways, names):
+    """Compares NameIndex with linear matching of the reference, returns
+    the differences"""
+    differences = []
+    index = overpass.NameIndex(ways)
+    for name in names:
+        for ignore_postfix in (False, True):
+            try:
+                found = [way.id for way in index.find_streets(name, ignore_postfix)]
+            except ValueError:
+                found = None
+            try:
+                expected = [way.id for way in _match_streets_reference(ways, name, ignore_postfix)]
+            except ValueError:
+                expected = None
+            if found != expected:
+                differences.append(("streets", name, ignore_postfix))
+            if (len(index.find_places(name, ignore_postfix)) > 0) != _place_exists_reference(ways, name, ignore_postfix):
+                differences.append(("places", name, ignore_postfix))
+    return differences
+
+def measure(function, count, repeat=3):
+    """Returns the best throughput (count / second) of repeat runs"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return count / max(best, 1e-9)
+
+def run_benchmarks(bev_names, osm_names, repeat=3):
+    """Returns {benchmark: names per second}"""
+    results = {}
+    uncached = lambda name: streetnames._normalize_streetname.__wrapped__(name, True, False)
+    results["normalize reference"] = measure(lambda: [_normalize(normalize_streetname_reference, n) for n in bev_names], len(bev_names), repeat)
+    results["normalize uncached"] = measure(lambda: [_normalize(uncached, n) for n in bev_names], len(bev_names), repeat)
+    def cold():
+        normalize_streetname.cache_clear()
+        [_normalize(normalize_streetname, n) for n in bev_names]
+    results["normalize cold cache"] = measure(cold, len(bev_names), repeat)
+    results["normalize warm cache"] = measure(lambda: [_normalize(normalize_streetname, n) for n in bev_names], len(bev_names), repeat)
+    results["normalize_many warm cache"] = measure(lambda: normalize_many(bev_names), len(bev_names), repeat)
+    # rename detection (bev_history.get_renamed_streets): minor changes are ignored
+    pairs = list(zip(bev_names, osm_names))
+    results["rename detection reference"] = measure(lambda: [_normalize(normalize_streetname_reference, a) != _normalize(normalize_streetname_reference, b) for a, b in pairs], len(pairs), repeat)
+    results["rename detection"] = measure(lambda: [_normalize(normalize_streetname, a) != _normalize(normalize_streetname, b) for a, b in pairs], len(pairs), repeat)
+    # matching of street names against the ways of one query result
+    ways = _get_ways(osm_names[:2000], bev_names[:2000], random.Random(2))
+    queries = bev_names[:200]
+    def match_reference():
+        for name in queries:
+            try:
+                _match_streets_reference(ways, name)
+            except ValueError:
+                pass
+    def match_index():
+        index = overpass.NameIndex(ways)
+        for name in queries:
+            try:
+                index.find_streets(name)
+            except ValueError:
+                pass
+    results["street matching reference"] = measure(match_reference, len(queries), 1)
+    results["street matching NameIndex"] = measure(match_index, len(queries), repeat)
+    return results
+
+def compare_with_baseline(results, baseline, threshold=THRESHOLD):
+    """Returns the benchmarks, which are more than threshold slower than the baseline"""
+    regressions = []
+    for benchmark, throughput in results.items():
+        if benchmark in baseline and throughput < baseline[benchmark] * (1 - threshold):
+            regressions.append(benchmark)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="street names (text file with one name per line or BEV database) instead of the generated corpus", dest="corpus")
+    parser.add_argument("--count", type=int, default=20000, help="size of the generated corpus", dest="count")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark (the best one is reported)", dest="repeat")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE", dest="save_baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with a baseline written by --save-baseline", dest="baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="relative slowdown reported as regression", dest="threshold")
+    ARGS = parser.parse_args()
+    bev_names, osm_names = generate_corpus(ARGS.count)
+    if ARGS.corpus:
+        bev_names = read_corpus(ARGS.corpus)
+        rand = random.Random(1)
+        osm_names = [_get_variant(name, rand) for name in bev_names]
+    print("corpus: %d names (%d distinct)" % (len(bev_names), len(set(bev_names))))
+
+    differences = check_normalization(bev_names + osm_names)
+    for name, kwargs, expected, found in differences[:10]:
+        print("normalization differs: %r %s expected %r, got %r" % (name, kwargs, expected, found))
+    print("normalization: %d differences to the reference" % len(differences))
+    ways = _get_ways(osm_names[:1000], bev_names[:1000], random.Random(2))
+    matching_differences = check_matching(ways, bev_names[:300])
+    for difference in matching_differences[:10]:
+        print("matching differs: %s %r (ignore postfix: %s)" % difference)
+    print("matching: %d differences to the reference" % len(matching_differences))
+
+    results = run_benchmarks(bev_names, osm_names, ARGS.repeat)
+    baseline = {}
+    if ARGS.baseline:
+        with open(ARGS.baseline) as f:
+            baseline = json.load(f)
+    print("\n%-30s %14s %10s" % ("benchmark", "names/s", "baseline"))
+    for benchmark, throughput in results.items():
+        relative = ""
+        if benchmark in baseline:
+            relative = "%+.0f%%" % ((throughput / baseline[benchmark] - 1) * 100)
+        print("%-30s %14.0f %10s" % (benchmark, throughput, relative))
+    cache_info = normalize_streetname.cache_info()
+    print("\nnormalize_streetname cache: %d hits, %d misses, %d of %d entries used" % (cache_info.hits, cache_info.misses, cache_info.currsize, cache_info.maxsize))
+    if ARGS.save_baseline:
+        with open(ARGS.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    regressions = compare_with_baseline(results, baseline, ARGS.threshold)
+    for benchmark in regressions:
+        print("regression: %s is more than %d%% slower than the baseline" % (benchmark, ARGS.threshold * 100))
+    if differences or matching_differences or regressions:
+        sys.exit(1)
@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import argparse
+import atexit
+import collections
+import concurrent.futures
 import csv
+import hashlib
+import io
+import itertools
+import multiprocessing
 import os.path
 import sqlite3
 import projection
-import requests
+import bev_download
 import overpass
 import sys
+import time
 import zipfile
 from progressbar import ProgressBar
 
@@ -16,9 +25,140 @@ class SearchStatus:
     NOT_FOUND = 0
     FOUND = 1
     UNDER_CONSTRUCTION = 2
+    # not found, but a street with a similar name
+    SIMILAR_NAME = 3
 
-def import_db(key_date):
-    csv_files = ["STRASSE.csv", "GEMEINDE.csv", "ADRESSE.csv", "GEBAEUDE.csv", "ORTSCHAFT.csv"]
+CSV_FILES = ["STRASSE.csv", "GEMEINDE.csv", "ADRESSE.csv", "GEBAEUDE.csv", "ORTSCHAFT.csv"]
+BATCH_SIZE = 10000
+# maximum age (seconds) of cached overpass responses used when searching
+# objects again, which weren't found before (OSM may have changed since)
+RECHECK_CACHE_MAX_AGE = 3600
+
+# column types of the optional typed schema, all other columns are TEXT
+COLUMN_TYPES = {
+    "GKZ": "INTEGER",
+    "OKZ": "INTEGER",
+    "SKZ": "INTEGER",
+    "ADRCD": "INTEGER",
+    "SUBCD": "INTEGER",
+    "PLZ": "INTEGER",
+    "EPSG": "INTEGER",
+    "RW": "REAL",
+    "HW": "REAL",
+    "LAT": "REAL",
+    "LON": "REAL",
+    "FOUND": "INTEGER",
+    "IST_MEHRDEUTIG": "INTEGER DEFAULT 0"
+}
+
+# natural keys of the typed schema
+PRIMARY_KEYS = {
+    "GEMEINDE": ["GKZ"],
+    "ORTSCHAFT": ["OKZ"],
+    "STRASSE": ["SKZ"],
+    "ADRESSE": ["ADRCD"],
+    "GEBAEUDE": ["ADRCD", "SUBCD"]
+}
+
+# tables with short rows, which are stored in their primary key b-tree
+WITHOUT_ROWID_TABLES = ["GEMEINDE", "ORTSCHAFT", "STRASSE"]
+
+# (name, table, columns)
+INDEXES = [
+    ("ADRESSE_SKZ", "ADRESSE", "SKZ"),
+    ("ADRESSE_GKZ", "ADRESSE", "GKZ"),
+    ("ADRESSE_OKZ", "ADRESSE", "OKZ"),
+    ("GEBAEUDE_ADRCD", "GEBAEUDE", "ADRCD"),
+    ("STRASSE_SKZ", "STRASSE", "SKZ"),
+    ("STRASSE_GKZ_STRASSENNAME", "STRASSE", "GKZ, STRASSENNAME"),
+    ("STRASSE_FOUND", "STRASSE", "FOUND"),
+    ("ORTSCHAFT_OKZ", "ORTSCHAFT", "OKZ"),
+    ("ORTSCHAFT_GKZ", "ORTSCHAFT", "GKZ"),
+    ("GEMEINDE_GKZ", "GEMEINDE", "GKZ")
+]
+
+# materialized address counts and bounding boxes per street, locality and
+# municipality (name, key columns), the HNR_ columns only consider addresses
+# with a house number. Streets are grouped by SKZ and OKZ, as the search for
+# streets ignores addresses in localities named like the street itself.
+EXTENT_TABLES = [
+    ("STRASSE_EXTENT", ["SKZ", "OKZ"]),
+    ("ORTSCHAFT_EXTENT", ["OKZ"]),
+    ("GEMEINDE_EXTENT", ["GKZ"])
+]
+
+# representative queries of search_osm_objects and umap.py (name, sql)
+BENCHMARK_QUERIES = [
+    ("gemeinde extents", """SELECT GEMEINDE.GKZ, MIN(LAT), MIN(LON), MAX(LAT), MAX(LON)
+        FROM GEMEINDE JOIN ADRESSE ON ADRESSE.GKZ = GEMEINDE.GKZ GROUP BY GEMEINDE.GKZ"""),
+    ("ortschaft extents", """SELECT ORTSCHAFT.OKZ, MIN(LAT), MIN(LON), MAX(LAT), MAX(LON)
+        FROM ORTSCHAFT JOIN ADRESSE ON ADRESSE.OKZ = ORTSCHAFT.OKZ GROUP BY ORTSCHAFT.OKZ"""),
+    ("strasse extents", """SELECT STRASSE.SKZ, COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON)
+        FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ
+        JOIN ORTSCHAFT ON ORTSCHAFT.OKZ = ADRESSE.OKZ
+        WHERE STRASSE.STRASSENNAME != ORTSCHAFT.ORTSNAME GROUP BY STRASSE.SKZ"""),
+    ("missing streets", """SELECT STRASSE.SKZ, COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON)
+        FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = ADRESSE.GKZ
+        WHERE STRASSE.FOUND == 0 AND ADRESSE.HAUSNRZAHL1 != "" GROUP BY STRASSE.SKZ"""),
+    ("ambiguous streetnames", """SELECT S1.SKZ FROM STRASSE S1, STRASSE S2
+        WHERE S1.GKZ == S2.GKZ AND S1.STRASSENNAME == S2.STRASSENNAME AND S1.SKZ != S2.SKZ"""),
+    ("street bounds", "SELECT RW, HW, EPSG FROM ADRESSE WHERE SKZ == (SELECT MAX(SKZ) FROM STRASSE)")
+]
+
+def import_db(key_date, extract=False, workers=1, typed=False):
+    """Imports the BEV csv files of the given key date into a new sqlite
+    database. By default the csv files are streamed directly from the zip
+    archive, if extract is set (or the extracted directory already exists)
+    they are read from the extracted directory instead.
+    With workers > 1 (or None for one per cpu core) parsing and reprojection
+    is done by a pool of worker processes.
+    If typed is set, the tables are created with the typed schema (see
+    get_create_table_sql)."""
+    directory = _prepare_archive(key_date, extract)
+    print("populating database")
+    con = _connect_for_import("%s.sqlite" % directory)
+    _import_tables(con, directory, workers, typed)
+    _finish_import(con, typed)
+    con.close()
+
+def import_db_incremental(key_date, previous_key_date, workers=1):
+    """Imports the BEV data of key_date based on the (already imported)
+    snapshot of previous_key_date: only coordinates of new rows or rows with
+    changed RW/HW/EPSG are reprojected, the FOUND status of unchanged
+    streets, localities and municipalities (same row and same address
+    extent) is copied, so search_osm_objects only checks the changed ones.
+    Inserted, deleted and changed rows (by natural key and content hash) are
+    written to the table CHANGELOG (TABLE_NAME, KEY, CHANGE)."""
+    previous_con = get_db_conn(previous_key_date)
+    typed = _is_typed(previous_con)
+    previous_con.close()
+    directory = _prepare_archive(key_date, False)
+    print("populating database")
+    con = _connect_for_import("%s.sqlite" % directory)
+    _import_tables(con, directory, workers, typed, reproject=False)
+    con.create_function("ROW_HASH", -1, _row_hash)
+    con.execute("ATTACH DATABASE ? AS previous;", (get_db_filename(previous_key_date),))
+    cur = con.cursor()
+    cur.execute("CREATE TABLE CHANGELOG (TABLE_NAME TEXT, KEY TEXT, CHANGE TEXT);")
+    for csv_file in CSV_FILES:
+        table = csv_file[:-4]
+        print("comparing %s" % table)
+        _compare_table(cur, table)
+    con.commit()
+    for table in ("ADRESSE", "GEBAEUDE"):
+        _reproject_missing(con, table)
+    _finish_import(con, typed)
+    for table, extent_table in (("STRASSE", "STRASSE_EXTENT"), ("ORTSCHAFT", "ORTSCHAFT_EXTENT"), ("GEMEINDE", "GEMEINDE_EXTENT")):
+        _copy_found_status(con, table, extent_table)
+    con.commit()
+    for row in con.execute("SELECT TABLE_NAME, CHANGE, COUNT(*) FROM CHANGELOG GROUP BY TABLE_NAME, CHANGE;"):
+        print("  %s: %s %s" % row)
+    con.execute("DETACH DATABASE previous;")
+    con.close()
+
+def _prepare_archive(key_date, extract):
+    """Downloads (and optionally extracts) the archive of the given key date
+    if necessary and returns the base name used for archive and directory"""
     if key_date:
         directory = "Adresse_Relationale_Tabellen-Stichtagsdaten_%s" % key_date
     else:
@@ -26,186 +166,559 @@ def import_db(key_date):
     if not os.path.exists(directory):
         if not os.path.exists("%s.zip" % directory):
             key_date = download_data(key_date)
-        with zipfile.ZipFile('%s.zip' % directory, 'r') as myzip:
-            for csv_file in csv_files:
-                print("extracting %s" % csv_file)
-                myzip.extract(csv_file, directory)
-    print("populating database")
-    con = sqlite3.connect("%s.sqlite" % directory)
+        if extract:
+            with zipfile.ZipFile('%s.zip' % directory, 'r') as myzip:
+                for csv_file in CSV_FILES:
+                    print("extracting %s" % csv_file)
+                    myzip.extract(csv_file, directory)
+    return directory
+
+def _connect_for_import(db_filename):
+    con = sqlite3.connect(db_filename)
+    # import-time settings only, none of them is persisted in the database file
+    con.execute("PRAGMA journal_mode = MEMORY;")
+    con.execute("PRAGMA synchronous = OFF;")
+    con.execute("PRAGMA cache_size = -200000;")
+    con.execute("PRAGMA temp_store = MEMORY;")
+    return con
+
+def _import_tables(con, directory, workers, typed, reproject=True):
+    if workers is None:
+        workers = os.cpu_count()
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+    try:
+        if os.path.exists(directory):
+            for csv_file in CSV_FILES:
+                csv_path = os.path.join(directory, csv_file)
+                with open(csv_path, 'rb') as csv_stream:
+                    _import_csv(con, csv_file[:-4], csv_stream, os.path.getsize(csv_path), pool, workers, typed, reproject)
+        else:
+            with zipfile.ZipFile('%s.zip' % directory, 'r') as myzip:
+                for csv_file in CSV_FILES:
+                    zip_info = myzip.getinfo(csv_file)
+                    with myzip.open(zip_info) as csv_stream:
+                        _import_csv(con, csv_file[:-4], csv_stream, zip_info.file_size, pool, workers, typed, reproject)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _finish_import(con, typed):
+    print("creating indexes")
+    create_indexes(con)
+    print("creating extent tables")
+    create_extent_tables(con)
+    cur = con.cursor()
+    print("adding flag for ambiguous streetnames")
+    cur.execute("ALTER TABLE STRASSE ADD COLUMN IST_MEHRDEUTIG %s" % (COLUMN_TYPES["IST_MEHRDEUTIG"] if typed else "BOOLEAN DEFAULT 0"))
+    cur.execute("UPDATE STRASSE SET IST_MEHRDEUTIG=1 WHERE SKZ IN (SELECT S1. SKZ FROM STRASSE S1, STRASSE S2 WHERE S1.GKZ == S2.GKZ AND S1.STRASSENNAME == S2.STRASSENNAME AND S1.SKZ != S2.SKZ)")
+    con.commit()
+
+def _is_typed(db_con):
+    return [row[2] for row in db_con.execute("PRAGMA table_info(STRASSE);") if row[1] == "SKZ"] == ["INTEGER"]
+
+def _row_hash(*values):
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+def _get_content_columns(cur, schema, table):
+    return [row[1] for row in cur.execute("PRAGMA %s.table_info(%s);" % (schema, table)) if row[1] not in ("FOUND", "LAT", "LON", "IST_MEHRDEUTIG")]
+
+def _compare_table(cur, table):
+    """Creates the temporary tables new_<table> and previous_<table> with
+    natural key and content hash of every row and logs the differences"""
+    keys = PRIMARY_KEYS[table]
+    columns = _get_content_columns(cur, "main", table)
+    previous_columns = _get_content_columns(cur, "previous", table)
+    # columns missing in the previous snapshot are compared as NULL
+    previous_values = [column if column in previous_columns else "NULL" for column in columns]
+    extra_columns = ""
+    if table in ("ADRESSE", "GEBAEUDE"):
+        extra_columns = ", RW, HW, EPSG, LAT, LON"
+    elif table in ("STRASSE", "ORTSCHAFT", "GEMEINDE"):
+        extra_columns = ", FOUND"
+    cur.execute("CREATE TEMP TABLE new_%s AS SELECT %s, ROW_HASH(%s) AS HASH FROM main.%s;" % (table, ", ".join(keys), ", ".join(columns), table))
+    cur.execute("CREATE TEMP TABLE previous_%s AS SELECT %s, ROW_HASH(%s) AS HASH%s FROM previous.%s;" % (table, ", ".join(keys), ", ".join(previous_values), extra_columns, table))
+    cur.execute("CREATE INDEX temp.new_%s_key ON new_%s (%s);" % (table, table, ", ".join(keys)))
+    cur.execute("CREATE INDEX temp.previous_%s_key ON previous_%s (%s);" % (table, table, ", ".join(keys)))
+    key_text = " || '/' || ".join("n.%s" % key for key in keys)
+    join = " AND ".join("p.%s = n.%s" % (key, key) for key in keys)
+    cur.execute("""INSERT INTO CHANGELOG SELECT ?, %s, 'INSERT' FROM temp.new_%s n
+        WHERE NOT EXISTS (SELECT 1 FROM temp.previous_%s p WHERE %s);""" % (key_text, table, table, join), (table,))
+    cur.execute("""INSERT INTO CHANGELOG SELECT ?, %s, 'DELETE' FROM temp.previous_%s n
+        WHERE NOT EXISTS (SELECT 1 FROM temp.new_%s p WHERE %s);""" % (key_text, table, table, join), (table,))
+    cur.execute("""INSERT INTO CHANGELOG SELECT ?, %s, 'UPDATE' FROM temp.new_%s n
+        JOIN temp.previous_%s p ON %s WHERE p.HASH != n.HASH;""" % (key_text, table, table, join), (table,))
+    if table in ("ADRESSE", "GEBAEUDE"):
+        # take over the coordinates of rows with unchanged location
+        cur.execute("""UPDATE main.%s SET LAT = p.LAT, LON = p.LON FROM temp.previous_%s p
+            WHERE %s AND p.RW IS main.%s.RW AND p.HW IS main.%s.HW AND p.EPSG IS main.%s.EPSG;""" % (
+                table, table, " AND ".join("p.%s = main.%s.%s" % (key, table, key) for key in keys), table, table, table))
+
+def _reproject_missing(con, table):
+    """Reprojects the coordinates of all rows without LAT/LON"""
+    rows = con.execute("SELECT rowid, RW, HW, EPSG FROM %s WHERE LAT IS NULL;" % table).fetchall()
+    with ProgressBar("reproject %d changed locations of %s" % (len(rows), table)) as pb:
+        for i in range(0, len(rows), BATCH_SIZE):
+            batch = rows[i:i+BATCH_SIZE]
+            coordinates = projection.reproject_batch([row[3] for row in batch], [(row[1], row[2]) for row in batch])
+            con.executemany("UPDATE %s SET LAT = ?, LON = ? WHERE rowid = ?;" % table,
+                [(lat, lon, row[0]) for row, (lon, lat) in zip(batch, coordinates)])
+            pb.update(float(i + len(batch)) / len(rows) * 100)
+    con.commit()
+
+def _copy_found_status(con, table, extent_table):
+    """Copies the FOUND status of the previous snapshot for all rows, whose
+    content and address extent didn't change"""
+    key = PRIMARY_KEYS[table][0]
+    extent_sql = "SELECT %s, SUM(ADR_COUNT), MIN(MIN_LAT), MIN(MIN_LON), MAX(MAX_LAT), MAX(MAX_LON) FROM %%s.%s GROUP BY %s;" % (key, extent_table, key)
+    new_extents = {row[0]: row[1:] for row in con.execute(extent_sql % "main")}
+    if _has_table(con, extent_table, "previous"):
+        previous_extents = {row[0]: row[1:] for row in con.execute(extent_sql % "previous")}
+    else:
+        previous_extents = {}
+    unchanged = con.execute("""SELECT n.%s, p.FOUND FROM temp.new_%s n JOIN temp.previous_%s p ON p.%s = n.%s
+        WHERE p.HASH = n.HASH AND p.FOUND IS NOT NULL;""" % (key, table, table, key, key)).fetchall()
+    con.executemany("UPDATE %s SET FOUND = ? WHERE %s = ?;" % (table, key),
+        [(found, k) for k, found in unchanged if new_extents.get(k) == previous_extents.get(k)])
+
+def _import_csv(con, table, csv_stream, size, pool=None, workers=1, typed=False, reproject=True):
+    """Bulk loads a BEV csv file (given as binary stream of `size` bytes) into
+    a new table using batched inserts within a single transaction. If a
+    multiprocessing pool is given, the batches are parsed and reprojected by
+    its worker processes, while this process writes them in their original
+    order. Without reproject LAT/LON are left empty."""
     cur = con.cursor()
-    for csv_file in csv_files:
-        csv_path = os.path.join(directory, csv_file)
-        num_rows = sum(1 for row in open(csv_path, 'r'))
-        with ProgressBar("import %s" % csv_file) as pb:
-            reader = csv.DictReader(open(csv_path, 'r', encoding='UTF-8-sig'), delimiter=';', quotechar='"')
-            table = csv_file[:-4]
-            fieldnames = reader.fieldnames
+    with ProgressBar("import %s.csv" % table) as pb:
+        text_stream = io.TextIOWrapper(csv_stream, encoding='UTF-8-sig')
+        fieldnames = next(csv.reader([text_stream.readline()], delimiter=';', quotechar='"'))
+        num_fields = len(fieldnames)
+        has_location = table in ("ADRESSE", "GEBAEUDE")
 
+        if typed:
+            cur.execute(get_create_table_sql(table, fieldnames + ["FOUND"] + (["LAT", "LON"] if has_location else [])))
+        else:
             # don't mind possible sql-injections in this case
             cur.execute("CREATE TABLE %s (%s);" % (table, ",".join(fieldnames)))
             cur.execute("ALTER TABLE %s ADD FOUND BOOLEAN;" % table)
-            fieldnames.append("FOUND")
-            if table in ("ADRESSE", "GEBAEUDE"):
+            if has_location:
                 cur.execute("ALTER TABLE %s ADD LAT Decimal(9,6);" % table)
                 cur.execute("ALTER TABLE %s ADD LON Decimal(9,6);" % table)
-                fieldnames.extend(["LAT", "LON"])
-            placeholder = ",".join("?"*len(fieldnames))
-            for i, row in enumerate(reader):
-                current_percentage = float(i) / num_rows * 100
-                pb.update(current_percentage)
-                if table in ("ADRESSE", "GEBAEUDE"):
-                    if row["RW"] == "" or row["HW"] == "":
-                        continue # ignore entries without location data
-                    (row["LON"], row["LAT"]) = projection.reproject(row["EPSG"], (row["RW"], row["HW"]))
-                cur.execute("INSERT INTO %s VALUES (%s);" % (table, placeholder), list(row.values()))
-    print("adding flag for ambiguous streetnames")
-    cur.execute("ALTER TABLE STRASSE ADD COLUMN IST_MEHRDEUTIG BOOLEAN DEFAULT 0")
-    cur.execute("UPDATE STRASSE SET IST_MEHRDEUTIG=1 WHERE SKZ IN (SELECT S1. SKZ FROM STRASSE S1, STRASSE S2 WHERE S1.GKZ == S2.GKZ AND S1.STRASSENNAME == S2.STRASSENNAME AND S1.SKZ != S2.SKZ)")
+        if has_location:
+            location_indices = (fieldnames.index("RW"), fieldnames.index("HW"), fieldnames.index("EPSG"))
+        else:
+            location_indices = None
+        sql = "INSERT INTO %s VALUES (%s);" % (table, ",".join("?" * (num_fields + (3 if has_location else 1))))
+        batches = ((lines, num_fields, location_indices, reproject) for lines in _read_batches(text_stream))
+        if pool is None:
+            results = (_prepare_batch(*batch) for batch in batches)
+        else:
+            results = _map_ordered(pool, _prepare_batch, batches, workers * 2)
+        for rows in results:
+            cur.executemany(sql, rows)
+            pb.update(float(csv_stream.tell()) / size * 100)
     con.commit()
-    con.close()
 
-def download_data(key_date=None):
-    """This function downloads the address data from BEV and displays its terms
-    of usage"""
+def _read_batches(text_stream):
+    """Splits a csv text stream into lists of (at least BATCH_SIZE) lines
+    without splitting records with quoted line breaks"""
+    lines = []
+    quotes = 0
+    for line in text_stream:
+        lines.append(line)
+        quotes += line.count('"')
+        # an odd number of quotes means, that we are within a quoted field
+        if len(lines) >= BATCH_SIZE and quotes % 2 == 0:
+            yield lines
+            lines = []
+            quotes = 0
+    if lines:
+        yield lines
 
-    if key_date:
-        address_data_url = "http://www.bev.gv.at/pls/portal/docs/PAGE/BEV_PORTAL_CONTENT_ALLGEMEIN/0200_PRODUKTE/UNENTGELTLICHE_PRODUKTE_DES_BEV/ARCHIV/Adresse_Relationale_Tabellen-Stichtagsdaten_%s.zip" % key_date
+def _map_ordered(pool, function, arguments, max_pending):
+    """Like pool.imap, but with at most max_pending tasks submitted at once,
+    so the input isn't read faster than the results are consumed"""
+    pending = collections.deque()
+    for args in arguments:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def _prepare_batch(lines, num_fields, location_indices, reproject=True):
+    """Parses a batch of csv lines into rows ready for insertion, i.e. with
+    FOUND (and LAT/LON, reprojected as a batch, if location_indices
+    (rw, hw, epsg) are given) appended to every row"""
+    rows = []
+    for row in csv.reader(lines, delimiter=';', quotechar='"'):
+        if not row:
+            continue
+        if len(row) < num_fields:
+            row.extend([None] * (num_fields - len(row)))
+        if location_indices and (row[location_indices[0]] == "" or row[location_indices[1]] == ""):
+            continue # ignore entries without location data
+        rows.append(row)
+    if location_indices and not reproject:
+        for row in rows:
+            row.extend((None, None, None))
+    elif location_indices:
+        rw_index, hw_index, epsg_index = location_indices
+        coordinates = projection.reproject_batch([row[epsg_index] for row in rows], [(row[rw_index], row[hw_index]) for row in rows])
+        for row, (lon, lat) in zip(rows, coordinates):
+            row.extend((None, lat, lon))
     else:
-        address_data_url = "http://www.bev.gv.at/pls/portal/docs/PAGE/BEV_PORTAL_CONTENT_ALLGEMEIN/0200_PRODUKTE/UNENTGELTLICHE_PRODUKTE_DES_BEV/Adresse_Relationale_Tabellen-Stichtagsdaten.zip"
-    response = requests.get(address_data_url, stream=True)
-    if not response.ok:
-        print("Download for key date %s failed" % key_date)
+        for row in rows:
+            row.append(None)
+    return rows
+
+def download_data(key_date=None):
+    """This function downloads the address data from BEV (or takes it from the
+    archive cache, see bev_download) and links it into the working
+    directory"""
+    try:
+        archive_key_date, archive = bev_download.download_archive(key_date, required_files=CSV_FILES)
+    except bev_download.DownloadError as e:
+        print("Download for key date %s failed: %s" % (key_date, e))
         sys.exit(1)
-    with open(address_data_url.split('/')[-1], 'wb') as handle, ProgressBar("downloading address data from BEV") as pb:
-        for i, data in enumerate(response.iter_content(chunk_size=1000000)):
-            handle.write(data)
-            current_percentage = i * 1.3
-            pb.update(current_percentage)
+    filename = 'Adresse_Relationale_Tabellen-Stichtagsdaten_%s.zip' % archive_key_date
+    if not os.path.lexists(filename):
+        os.symlink(archive, filename)
     if not key_date:
-        z = zipfile.ZipFile('Adresse_Relationale_Tabellen-Stichtagsdaten.zip', 'r')
-        for f in z.infolist():
-            if f.filename == 'ADRESSE.csv':
-                key_date = "%02d%02d%d" % tuple(reversed(f.date_time[:3]))
-                break
-        os.rename('Adresse_Relationale_Tabellen-Stichtagsdaten.zip', 'Adresse_Relationale_Tabellen-Stichtagsdaten_%s.zip' % key_date)
-        os.symlink('Adresse_Relationale_Tabellen-Stichtagsdaten_%s.zip' % key_date, 'Adresse_Relationale_Tabellen-Stichtagsdaten.zip')
-    return key_date
-
-def search_osm_objects(db_con, update_not_found_objects=False, gkz_like='%'):
+        if os.path.islink('Adresse_Relationale_Tabellen-Stichtagsdaten.zip'):
+            os.remove('Adresse_Relationale_Tabellen-Stichtagsdaten.zip')
+        os.symlink(filename, 'Adresse_Relationale_Tabellen-Stichtagsdaten.zip')
+    return archive_key_date
+
+def search_osm_objects(db_con, update_not_found_objects=False, gkz_like='%', prefetch=False, workers=1):
+    """Checks which municipalities, localities and streets exist in OSM and
+    updates their FOUND status. With prefetch all highways and places of a
+    municipality are downloaded at once (see overpass.AreaIndex) instead of
+    sending queries for every locality and street. Streets which aren't
+    found, but have a similar name in OSM, are marked as near-misses
+    (SearchStatus.SIMILAR_NAME). With workers > 1 up to
+    workers localities/streets are checked concurrently.
+    With update_not_found_objects only cached overpass responses of the
+    last RECHECK_CACHE_MAX_AGE seconds are used (during this call)."""
     overpass.use_local_overpass(True)
+    if workers > 1:
+        overpass.set_max_concurrent_queries(workers)
+    max_age = overpass.CACHE_MAX_AGE
+    if update_not_found_objects:
+        overpass.set_use_cache(overpass.USE_CACHE, min(max_age, RECHECK_CACHE_MAX_AGE))
+    try:
+        _search_osm_objects(db_con, update_not_found_objects, gkz_like, prefetch, workers)
+    finally:
+        if update_not_found_objects:
+            overpass.set_use_cache(overpass.USE_CACHE, max_age)
+
+def _search_osm_objects(db_con, update_not_found_objects, gkz_like, prefetch, workers):
     select_cursor = db_con.cursor()
     update_cursor = db_con.cursor()
     gkz_like = (gkz_like,)
 
-    query = """SELECT GEMEINDE.GKZ, GEMEINDENAME, MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-        FROM GEMEINDE JOIN ADRESSE ON ADRESSE.GKZ = GEMEINDE.GKZ WHERE GEMEINDE.FOUND IS NULL %s AND GEMEINDE.GKZ LIKE ?
-        GROUP BY GEMEINDE.GKZ, GEMEINDENAME ORDER BY GEMEINDENAME""" % (" OR GEMEINDE.FOUND == 0 " if update_not_found_objects else "")
-    for row in select_cursor.execute(query, gkz_like):
-
-        gkz, gemeindename, min_lat, min_lon, max_lat, max_lon = row
-        found = overpass.admin_boundary_exists(min_lat, min_lon, max_lat, max_lon, gemeindename)
-        update_cursor.execute("UPDATE GEMEINDE SET FOUND = ? WHERE GEMEINDE.GKZ=?;", (found, gkz))
+    query = """SELECT GEMEINDE.GKZ, GEMEINDENAME, MIN_LAT, MIN_LON, MAX_LAT, MAX_LON 
+        FROM GEMEINDE JOIN GEMEINDE_EXTENT ON GEMEINDE_EXTENT.GKZ = GEMEINDE.GKZ WHERE GEMEINDE.FOUND IS NULL %s AND GEMEINDE.GKZ LIKE ?
+        ORDER BY GEMEINDENAME""" % (" OR GEMEINDE.FOUND == 0 " if update_not_found_objects else "")
+    rows = select_cursor.execute(query, gkz_like).fetchall()
+    for start in range(0, len(rows), overpass.QUERY_BATCH_SIZE):
+        batch = rows[start:start+overpass.QUERY_BATCH_SIZE]
+        found = overpass.admin_boundaries_exist([row[2:] + row[1:2] for row in batch])
+        update_cursor.executemany("UPDATE GEMEINDE SET FOUND = ? WHERE GEMEINDE.GKZ=?;", [(f, row[0]) for f, row in zip(found, batch)])
         db_con.commit()
     
     count = select_cursor.execute("""SELECT COUNT(*) FROM ORTSCHAFT 
         WHERE (ORTSCHAFT.FOUND IS NULL %s) AND ORTSCHAFT.GKZ LIKE ?""" % (" OR ORTSCHAFT.FOUND == 0 " if update_not_found_objects else ""), gkz_like).fetchone()[0]
-    i = 0
-    with ProgressBar("suche Ortschaften...") as pb:
-        for row in select_cursor.execute("""SELECT ORTSCHAFT.OKZ, ORTSNAME, MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-            FROM ORTSCHAFT JOIN ADRESSE ON ADRESSE.OKZ = ORTSCHAFT.OKZ WHERE ORTSCHAFT.FOUND IS NULL %s AND ORTSCHAFT.GKZ LIKE ?
-            GROUP BY ORTSCHAFT.OKZ, ORTSNAME ORDER BY ORTSNAME""" % (" OR ORTSCHAFT.FOUND == 0 " if update_not_found_objects else ""), gkz_like):
-
-            i += 1
-            current_percentage = float(i) / count * 100
-            pb.update(current_percentage)
-
-            okz, ortsname, min_lat, min_lon, max_lat, max_lon = row
-            if (ortsname.startswith("Wien") or 
-                ortsname.startswith("Graz") or
-                ortsname.startswith("Klagenfurt")):
-                
-                found = True
-            else:
-                found = overpass.place_exists(min_lat, min_lon, max_lat, max_lon, ortsname, tolerance=0.01, ignore_postfix=True)
-            #print(ortsname, found)
-            update_cursor.execute("UPDATE ORTSCHAFT SET FOUND = ? WHERE ORTSCHAFT.OKZ=?;", (found, okz))
-        db_con.commit()
+    rows = select_cursor.execute("""SELECT ORTSCHAFT.GKZ, ORTSCHAFT.OKZ, ORTSNAME, MIN_LAT, MIN_LON, MAX_LAT, MAX_LON 
+        FROM ORTSCHAFT JOIN ORTSCHAFT_EXTENT ON ORTSCHAFT_EXTENT.OKZ = ORTSCHAFT.OKZ WHERE ORTSCHAFT.FOUND IS NULL %s AND ORTSCHAFT.GKZ LIKE ?
+        ORDER BY %sORTSNAME""" % (" OR ORTSCHAFT.FOUND == 0 " if update_not_found_objects else "", "ORTSCHAFT.GKZ, " if prefetch else ""), gkz_like)
+    _run_checks(update_cursor, _get_check_batches(rows, prefetch), _check_ortschaften,
+        "UPDATE ORTSCHAFT SET FOUND = ? WHERE ORTSCHAFT.OKZ=?;", count, "suche Ortschaften...", workers)
+    db_con.commit()
 
     query = """SELECT COUNT(*) FROM STRASSE 
-        WHERE (STRASSE.FOUND IS NULL %s) AND STRASSE.GKZ LIKE ?""" % (" OR STRASSE.FOUND == 0 " if update_not_found_objects else "")
+        WHERE (STRASSE.FOUND IS NULL %s) AND STRASSE.GKZ LIKE ?""" % (" OR STRASSE.FOUND IN (0, 3) " if update_not_found_objects else "")
     count = select_cursor.execute(query, gkz_like).fetchone()[0]
-    i = 0
-    with ProgressBar("suche Straßen...") as pb:
-        try:
-            for row in select_cursor.execute("""SELECT STRASSE.SKZ, STRASSE.STRASSENNAME, COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-                FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ 
-                JOIN ORTSCHAFT ON ORTSCHAFT.OKZ = ADRESSE.OKZ
-                WHERE (STRASSE.FOUND IS NULL %s) AND STRASSE.GKZ LIKE ? 
-                AND STRASSE.STRASSENNAME != ORTSCHAFT.ORTSNAME
-                GROUP BY STRASSE.SKZ, STRASSE.STRASSENNAME 
-                ORDER BY COUNT(ADRESSE.ADRCD) DESC""" % (" OR STRASSE.FOUND == 0 " if update_not_found_objects else ""), gkz_like):
-
-                i += 1
-                current_percentage = float(i) / count * 100
-                pb.update(current_percentage)
-
-                skz, strassenname, adr_count, min_lat, min_lon, max_lat, max_lon = row
-                streets = overpass.get_streets_by_name(min_lat, min_lon, max_lat, max_lon, strassenname, tolerance=0.01, include_nodes=False)
-                if len(streets) == 0:
-                    if overpass.place_exists(min_lat, min_lon, max_lat, max_lon, strassenname, tolerance=0.01):
-                        found = SearchStatus.FOUND
-                    else:
-                        found = SearchStatus.NOT_FOUND
-                else:
-                    for way in streets:
-                        if way.tags["highway"] == "construction":
-                            found = SearchStatus.UNDER_CONSTRUCTION
-                            break
-                    else:
-                        found = SearchStatus.FOUND
-                update_cursor.execute("UPDATE STRASSE SET FOUND = ? WHERE STRASSE.SKZ=?;", (found, skz))
-        except KeyboardInterrupt:
-            print("abort...")
+    rows = select_cursor.execute("""SELECT STRASSE.GKZ, STRASSE.SKZ, STRASSE.STRASSENNAME, SUM(ADR_COUNT), MIN(MIN_LAT), MIN(MIN_LON), MAX(MAX_LAT), MAX(MAX_LON) 
+        FROM STRASSE JOIN STRASSE_EXTENT ON STRASSE_EXTENT.SKZ = STRASSE.SKZ 
+        JOIN ORTSCHAFT ON ORTSCHAFT.OKZ = STRASSE_EXTENT.OKZ
+        WHERE (STRASSE.FOUND IS NULL %s) AND STRASSE.GKZ LIKE ? 
+        AND STRASSE.STRASSENNAME != ORTSCHAFT.ORTSNAME
+        GROUP BY STRASSE.SKZ, STRASSE.STRASSENNAME 
+        ORDER BY %sSUM(ADR_COUNT) DESC""" % (" OR STRASSE.FOUND IN (0, 3) " if update_not_found_objects else "", "STRASSE.GKZ, " if prefetch else ""), gkz_like)
+    try:
+        _run_checks(update_cursor, _get_check_batches(rows, prefetch), _check_strassen,
+            "UPDATE STRASSE SET FOUND = ? WHERE STRASSE.SKZ=?;", count, "suche Straßen...", workers)
+    except KeyboardInterrupt:
+        print("abort...")
     db_con.commit()
 
-def get_db_conn(key_date=None):
+def _check_ortschaften(rows, area):
+    """Returns (found, okz) for rows of (okz, ortsname, bounds...)"""
+    checks = [row[2:] + row[1:2] for row in rows if not _is_city(row[1])]
+    found = iter(area.places_exist(checks, tolerance=0.01, ignore_postfix=True))
+    return [(True if _is_city(ortsname) else next(found), okz) for okz, ortsname, min_lat, min_lon, max_lat, max_lon in rows]
+
+def _is_city(ortsname):
+    return (ortsname.startswith("Wien") or 
+        ortsname.startswith("Graz") or
+        ortsname.startswith("Klagenfurt"))
+
+def _check_strassen(rows, area):
+    """Returns (found, skz) for rows of (skz, strassenname, adr_count,
+    bounds...). Streets which aren't found are searched as places and then
+    among the streets with similar names."""
+    streets = area.get_streets_by_names([row[3:] + row[1:2] for row in rows], tolerance=0.01, find_similar=True)
+    not_found = [row[3:] + row[1:2] for row, (ways, similar) in zip(rows, streets) if len(ways) == 0]
+    places = iter(area.places_exist(not_found, tolerance=0.01))
+    results = []
+    for row, (ways, similar) in zip(rows, streets):
+        skz = row[0]
+        if len(ways) == 0:
+            if next(places):
+                found = SearchStatus.FOUND
+            elif similar:
+                found = SearchStatus.SIMILAR_NAME
+            else:
+                found = SearchStatus.NOT_FOUND
+        else:
+            for way in ways:
+                if way.tags["highway"] == "construction":
+                    found = SearchStatus.UNDER_CONSTRUCTION
+                    break
+            else:
+                found = SearchStatus.FOUND
+        results.append((found, skz))
+    return results
+
+def _run_checks(update_cursor, rows, check, update_sql, count, message, workers=1):
+    """Runs check(rows, area), which returns a list of (found, key), for all
+    (rows, area) and writes the results with update_sql in batches. With
+    workers > 1 the checks are run by a thread pool with at most 2 * workers
+    pending checks.
+    On KeyboardInterrupt the results of all finished checks are written
+    before the exception is passed on."""
+    results = []
+    def write_results():
+        update_cursor.executemany(update_sql, results)
+        del results[:]
+    with ProgressBar(message) as pb:
+        def add_results(check_results):
+            results.extend(check_results)
+            add_results.done += len(check_results)
+            pb.update(float(add_results.done) / count * 100)
+            if len(results) >= BATCH_SIZE:
+                write_results()
+        add_results.done = 0
+        if workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(workers)
+            pending = set()
+            try:
+                for check_rows, area in rows:
+                    if len(pending) >= 2 * workers:
+                        finished = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+                        for future in finished:
+                            # removed first, so an interrupt can't write the results twice
+                            pending.remove(future)
+                            add_results(future.result())
+                    pending.add(executor.submit(check, check_rows, area))
+                for future in concurrent.futures.as_completed(pending):
+                    pending.remove(future)
+                    add_results(future.result())
+            except KeyboardInterrupt:
+                print("\nwaiting for running queries...")
+                raise
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+                for future in pending:
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        results.extend(future.result())
+                write_results()
+        else:
+            try:
+                for check_rows, area in rows:
+                    add_results(check(check_rows, area))
+            finally:
+                write_results()
+
+def _get_check_batches(rows, prefetch, tolerance=0.01):
+    """Yields (rows without GKZ, area) for rows of (GKZ, key, name, ...,
+    MIN_LAT, MIN_LON, MAX_LAT, MAX_LON). With prefetch area is an
+    overpass.AreaIndex covering all rows of the municipality (rows have to
+    be sorted by GKZ), otherwise the overpass module itself, which checks
+    batches of overpass.QUERY_BATCH_SIZE rows with one query."""
+    if not prefetch:
+        while True:
+            batch = [row[1:] for row in itertools.islice(rows, overpass.QUERY_BATCH_SIZE)]
+            if not batch:
+                return
+            yield batch, overpass
+    for gkz, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        area = overpass.AreaIndex(min(row[-4] for row in group) - tolerance, min(row[-3] for row in group) - tolerance,
+            max(row[-2] for row in group) + tolerance, max(row[-1] for row in group) + tolerance)
+        yield [row[1:] for row in group], area
+
+def get_db_filename(key_date=None):
     if key_date:
-        db_filename = "Adresse_Relationale_Tabellen-Stichtagsdaten_%s.sqlite" % key_date
+        return "Adresse_Relationale_Tabellen-Stichtagsdaten_%s.sqlite" % key_date
     else:
-        db_filename = "Adresse_Relationale_Tabellen-Stichtagsdaten.sqlite"
+        return "Adresse_Relationale_Tabellen-Stichtagsdaten.sqlite"
+
+def get_db_conn(key_date=None, import_workers=1, typed=False):
+    db_filename = get_db_filename(key_date)
     if not os.path.exists(db_filename):
-        import_db(key_date)
-    return sqlite3.connect(db_filename)
+        import_db(key_date, workers=import_workers, typed=typed)
+    con = sqlite3.connect(db_filename)
+    if not _has_table(con, "STRASSE_EXTENT"):
+        # databases imported by older versions
+        print("creating extent tables")
+        create_extent_tables(con)
+    return con
+
+def get_create_table_sql(table, columns):
+    """Returns the CREATE TABLE statement of the typed schema, i.e. integer
+    keys (stored without leading zeros), REAL coordinates and the natural
+    key as primary key (as rowid for ADRESSE, WITHOUT ROWID for the tables
+    with short rows)"""
+    primary_key = PRIMARY_KEYS.get(table)
+    if primary_key and not all(column in columns for column in primary_key):
+        primary_key = None
+    definitions = []
+    for column in columns:
+        definition = "%s %s" % (column, COLUMN_TYPES.get(column, "TEXT"))
+        if primary_key == [column] and COLUMN_TYPES.get(column) == "INTEGER" and table not in WITHOUT_ROWID_TABLES:
+            # alias for the rowid
+            definition += " PRIMARY KEY"
+            primary_key = None
+        definitions.append(definition)
+    if primary_key:
+        definitions.append("PRIMARY KEY (%s)" % ", ".join(primary_key))
+    sql = "CREATE TABLE %s (%s)" % (table, ", ".join(definitions))
+    if primary_key and table in WITHOUT_ROWID_TABLES:
+        sql += " WITHOUT ROWID"
+    return sql + ";"
+
+def _get_primary_key(db_con, table):
+    columns = [row for row in db_con.execute("PRAGMA table_info(%s);" % table) if row[5] > 0]
+    return [row[1] for row in sorted(columns, key=lambda row: row[5])]
+
+def create_indexes(db_con):
+    cur = db_con.cursor()
+    for name, table, columns in INDEXES:
+        index_columns = [column.strip() for column in columns.split(",")]
+        if index_columns == _get_primary_key(db_con, table)[:len(index_columns)]:
+            # already covered by the primary key of the typed schema
+            continue
+        cur.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s);" % (name, table, columns))
+    # collect statistics for the query planner
+    cur.execute("ANALYZE;")
+    db_con.commit()
+
+def create_extent_tables(db_con):
+    cur = db_con.cursor()
+    for table, key_columns in EXTENT_TABLES:
+        keys = ", ".join(key_columns)
+        if "GKZ" in key_columns:
+            gkz_column = ""
+        else:
+            gkz_column = "GKZ, "
+        cur.execute("DROP TABLE IF EXISTS main.%s;" % table)
+        cur.execute("""CREATE TABLE %s (%s, %sADR_COUNT INTEGER, MIN_LAT REAL, MIN_LON REAL, MAX_LAT REAL, MAX_LON REAL,
+            HNR_COUNT INTEGER, HNR_MIN_LAT REAL, HNR_MIN_LON REAL, HNR_MAX_LAT REAL, HNR_MAX_LON REAL,
+            PRIMARY KEY (%s));""" % (table, keys, gkz_column, keys))
+        cur.execute("""INSERT INTO %s SELECT %s, %sCOUNT(ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON),
+            COUNT(CASE WHEN HAUSNRZAHL1 != '' THEN ADRCD END),
+            MIN(CASE WHEN HAUSNRZAHL1 != '' THEN LAT END), MIN(CASE WHEN HAUSNRZAHL1 != '' THEN LON END),
+            MAX(CASE WHEN HAUSNRZAHL1 != '' THEN LAT END), MAX(CASE WHEN HAUSNRZAHL1 != '' THEN LON END)
+            FROM ADRESSE GROUP BY %s;""" % (table, keys, gkz_column.replace("GKZ", "MIN(GKZ)"), keys))
+    db_con.commit()
+
+def _has_table(db_con, table, schema="main"):
+    return db_con.execute("SELECT COUNT(*) FROM %s.sqlite_master WHERE type = 'table' AND name = ?;" % schema, (table,)).fetchone()[0] > 0
+
+def time_queries(db_con):
+    """Runs all BENCHMARK_QUERIES and returns a list of (name, seconds)"""
+    timings = []
+    for name, sql in BENCHMARK_QUERIES:
+        start = time.perf_counter()
+        db_con.execute(sql).fetchall()
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+def migrate_indexes(key_dates=SNAPSHOTS, measure=True):
+    """Adds the indexes created by import_db to already existing snapshot
+    databases and optionally reports the query timings before/after"""
+    for key_date in key_dates:
+        db_filename = get_db_filename(key_date)
+        if not os.path.exists(db_filename):
+            print("%s not found, skipping" % db_filename)
+            continue
+        print(db_filename)
+        con = sqlite3.connect(db_filename)
+        if measure:
+            before = time_queries(con)
+        create_indexes(con)
+        if measure:
+            after = time_queries(con)
+            for (name, seconds_before), (_, seconds_after) in zip(before, after):
+                print("  %-25s %9.3fs -> %9.3fs" % (name, seconds_before, seconds_after))
+        con.close()
+
+def convert_to_typed_schema(db_filename, measure=True):
+    """Converts an existing snapshot database to the typed schema, keeping
+    the FOUND status. The converted database replaces the original file,
+    if measure is set, file size and query timings of both are reported."""
+    typed_filename = "%s.typed" % db_filename
+    if os.path.exists(typed_filename):
+        os.remove(typed_filename)
+    con = sqlite3.connect(typed_filename)
+    con.execute("PRAGMA journal_mode = MEMORY;")
+    con.execute("PRAGMA synchronous = OFF;")
+    con.execute("ATTACH DATABASE ? AS untyped;", (db_filename,))
+    cur = con.cursor()
+    for csv_file in CSV_FILES:
+        table = csv_file[:-4]
+        print("converting %s" % table)
+        columns = [row[1] for row in cur.execute("PRAGMA untyped.table_info(%s);" % table)]
+        cur.execute(get_create_table_sql(table, columns))
+        cur.execute("INSERT INTO main.%s (%s) SELECT %s FROM untyped.%s;" % (table, ",".join(columns), ",".join(columns), table))
+        con.commit()
+    con.execute("DETACH DATABASE untyped;")
+    print("creating indexes")
+    create_indexes(con)
+    print("creating extent tables")
+    create_extent_tables(con)
+    con.execute("VACUUM;")
+    if measure:
+        untyped_con = sqlite3.connect(db_filename)
+        before = time_queries(untyped_con)
+        untyped_con.close()
+        after = time_queries(con)
+        print("  %-25s %10.1fMB -> %10.1fMB" % ("file size", os.path.getsize(db_filename) / 1e6, os.path.getsize(typed_filename) / 1e6))
+        for (name, seconds_before), (_, seconds_after) in zip(before, after):
+            print("  %-25s %9.3fs -> %9.3fs" % (name, seconds_before, seconds_after))
+    con.close()
+    os.replace(typed_filename, db_filename)
 
 def _get_bounds(db_con, sql, parameter):
-    (min_lon, min_lat, max_lon, max_lat) = (None, None, None, None)
     cur = db_con.cursor()
     cur.execute(sql, parameter)
-    for row in cur:
-        lon, lat = row[:-1]
-        if lon == '' or lat == '':
-            continue
-        lon, lat = projection.reproject(row[2], row[:-1])
-        if min_lon is None:
-            min_lon = lon
-            max_lon = lon
-            min_lat = lat
-            max_lat = lat
-        else:            
-            if lon < min_lon:
-                min_lon = lon
-            elif lon > max_lon:
-                max_lon = lon
-            if lat < min_lat:
-                min_lat = lat
-            elif lat > max_lat:
-                max_lat = lat
-    if min_lon is not None:
-        min_lat -= 0.01
-        min_lon -= 0.01
-        max_lat += 0.01
-        max_lon += 0.01
-    return (min_lat, min_lon, max_lat, max_lon)
+    rows = [row for row in cur if row[0] != '' and row[1] != '']
+    if len(rows) == 0:
+        return (None, None, None, None)
+    points_by_crs = {}
+    for rw, hw, epsg in rows:
+        group = points_by_crs.setdefault(str(epsg), ([], []))
+        group[0].append(rw)
+        group[1].append(hw)
+    lons = []
+    lats = []
+    for lon, lat in projection.reproject_grouped(points_by_crs).values():
+        lons.extend(lon)
+        lats.extend(lat)
+    return (min(lats) - 0.01, min(lons) - 0.01, max(lats) + 0.01, max(lons) + 0.01)
 
 
 def get_district_bounds(gkz, db_con):
@@ -229,7 +742,30 @@ def format_key_date(key_date):
     return "%s-%s" % (key_date[-4:], key_date[2:4])
 
 if __name__ == "__main__":
-    search_osm_objects(get_db_conn(), update_not_found_objects=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--create-indexes", action="store_true", help="add missing indexes to the existing snapshot databases (%s)" % ", ".join(SNAPSHOTS), dest="create_indexes")
+    parser.add_argument("--import-incremental", nargs=2, metavar=("KEY_DATE", "PREVIOUS_KEY_DATE"), help="import a snapshot based on the previous one, only reprojecting and searching changed objects", dest="import_incremental")
+    parser.add_argument("--convert-typed", action="store_true", help="convert the existing snapshot databases to the typed schema", dest="convert_typed")
+    parser.add_argument("--prefetch", action="store_true", help="download highways and places once per municipality when searching OSM objects", dest="prefetch")
+    parser.add_argument("--workers", type=int, default=1, help="number of concurrent overpass queries when searching OSM objects", dest="workers")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the overpass response cache (%s)" % overpass.CACHE_DB, dest="no_cache")
+    parser.add_argument("--stats", nargs="?", const="", metavar="FILE", help="print statistics of the overpass queries per query type on exit (and write them to FILE as JSON)", dest="stats")
+    ARGS = parser.parse_args()
+    if ARGS.stats is not None:
+        atexit.register(overpass.report_stats, ARGS.stats)
+    overpass.set_use_cache(not ARGS.no_cache)
+    if ARGS.create_indexes:
+        migrate_indexes()
+    elif ARGS.import_incremental:
+        import_db_incremental(*ARGS.import_incremental)
+    elif ARGS.convert_typed:
+        for key_date in SNAPSHOTS:
+            db_filename = get_db_filename(key_date)
+            if os.path.exists(db_filename):
+                print(db_filename)
+                convert_to_typed_schema(db_filename)
+    else:
+        search_osm_objects(get_db_conn(), update_not_found_objects=True, prefetch=ARGS.prefetch, workers=ARGS.workers)
 
 
 
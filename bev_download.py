@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import time
+import zipfile
+import requests
+from progressbar import ProgressBar
+
+BASE_URL = "http://www.bev.gv.at/pls/portal/docs/PAGE/BEV_PORTAL_CONTENT_ALLGEMEIN/0200_PRODUKTE/UNENTGELTLICHE_PRODUKTE_DES_BEV"
+ARCHIVE_NAME = "Adresse_Relationale_Tabellen-Stichtagsdaten"
+CACHE_DIR = "archive_cache"
+CHUNK_SIZE = 1000000
+MAX_RETRIES = 5
+TIMEOUT = 60
+
+# The cache contains every verified archive once as <sha256>.zip and a file
+# <key date>.sha256 per key date referring to it. Incomplete downloads are
+# kept as <archive name>.part and resumed by the next attempt (with the
+# ETag or Last-Modified of the first response in <archive name>.part.validator,
+# so a changed archive is downloaded completely again).
+
+class DownloadError(Exception):
+    pass
+
+def get_archive_url(key_date=None, base_url=BASE_URL):
+    if key_date:
+        return "%s/ARCHIV/%s_%s.zip" % (base_url, ARCHIVE_NAME, key_date)
+    else:
+        return "%s/%s.zip" % (base_url, ARCHIVE_NAME)
+
+def get_cached_archive(key_date, cache_dir=CACHE_DIR):
+    """Returns the path of the cached archive of the given key date or None"""
+    ref_filename = os.path.join(cache_dir, "%s.sha256" % key_date)
+    if not os.path.exists(ref_filename):
+        return None
+    with open(ref_filename) as ref_file:
+        archive = os.path.join(cache_dir, "%s.zip" % ref_file.read().strip())
+    if os.path.exists(archive):
+        return archive
+    return None
+
+def download_archive(key_date=None, base_url=BASE_URL, cache_dir=CACHE_DIR, required_files=None):
+    """Returns (key_date, path) of the verified archive of the given key date
+    (None for the current one) in the cache, downloading it if necessary.
+    Interrupted downloads are resumed with HTTP range requests."""
+    if key_date:
+        archive = get_cached_archive(key_date, cache_dir)
+        if archive:
+            print("using cached archive %s" % archive)
+            return key_date, archive
+    os.makedirs(cache_dir, exist_ok=True)
+    url = get_archive_url(key_date, base_url)
+    part_filename = os.path.join(cache_dir, "%s.part" % url.split('/')[-1])
+    for attempt in range(MAX_RETRIES):
+        try:
+            _download(url, part_filename)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            print("\ndownload interrupted (%s), retrying" % e)
+            time.sleep(2 ** attempt)
+    else:
+        raise DownloadError("download of %s failed after %d attempts" % (url, MAX_RETRIES))
+    if os.path.exists("%s.validator" % part_filename):
+        os.remove("%s.validator" % part_filename)
+    try:
+        archive_key_date = verify_archive(part_filename, required_files)
+    except (zipfile.BadZipFile, DownloadError):
+        # resuming a corrupt file won't help
+        os.remove(part_filename)
+        raise
+    if not key_date:
+        key_date = archive_key_date
+    return key_date, _add_to_cache(part_filename, key_date, cache_dir)
+
+def _download(url, part_filename):
+    offset = 0
+    if os.path.exists(part_filename):
+        offset = os.path.getsize(part_filename)
+    validator_filename = "%s.validator" % part_filename
+    headers = {}
+    if offset:
+        headers["Range"] = "bytes=%d-" % offset
+        if os.path.exists(validator_filename):
+            with open(validator_filename) as validator_file:
+                headers["If-Range"] = validator_file.read()
+    response = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    if response.status_code == 416:
+        # the partial file is already complete
+        return
+    if not response.ok:
+        raise DownloadError("download of %s failed with status %d" % (url, response.status_code))
+    if response.status_code == 200:
+        # no range support, changed archive or no partial file: start from the beginning
+        offset = 0
+        validator = response.headers.get("ETag", response.headers.get("Last-Modified"))
+        if validator:
+            with open(validator_filename, 'w') as validator_file:
+                validator_file.write(validator)
+        elif os.path.exists(validator_filename):
+            os.remove(validator_filename)
+    total = None
+    if "Content-Length" in response.headers:
+        total = offset + int(response.headers["Content-Length"])
+    if offset:
+        message = "resuming download of %s at %.1f MB" % (url, offset / 1e6)
+    else:
+        message = "downloading %s" % url
+    start = time.perf_counter()
+    received = 0
+    with open(part_filename, 'ab' if offset else 'wb') as handle, ProgressBar(message) as pb:
+        for data in response.iter_content(chunk_size=CHUNK_SIZE):
+            handle.write(data)
+            received += len(data)
+            throughput = "%.2f MB/s" % (received / 1e6 / max(time.perf_counter() - start, 1e-3))
+            if total:
+                pb.update(100.0 * (offset + received) / total, throughput)
+            else:
+                pb.update(0, "%.1f MB, %s" % ((offset + received) / 1e6, throughput))
+    if total and os.path.getsize(part_filename) < total:
+        raise requests.ConnectionError("connection closed after %d of %d bytes" % (os.path.getsize(part_filename), total))
+
+def verify_archive(filename, required_files=None):
+    """Checks the CRC of all files in the archive and returns the key date
+    (date of ADRESSE.csv)"""
+    with zipfile.ZipFile(filename, 'r') as archive:
+        bad_file = archive.testzip()
+        if bad_file is not None:
+            raise DownloadError("CRC check of %s in %s failed" % (bad_file, filename))
+        names = archive.namelist()
+        for required_file in required_files or []:
+            if required_file not in names:
+                raise DownloadError("%s is missing in %s" % (required_file, filename))
+        for f in archive.infolist():
+            if f.filename == 'ADRESSE.csv':
+                return "%02d%02d%d" % tuple(reversed(f.date_time[:3]))
+    return None
+
+def _get_sha256(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+def _add_to_cache(filename, key_date, cache_dir):
+    digest = _get_sha256(filename)
+    archive = os.path.join(cache_dir, "%s.zip" % digest)
+    if os.path.exists(archive):
+        os.remove(filename)
+    else:
+        shutil.move(filename, archive)
+    with open(os.path.join(cache_dir, "%s.sha256" % key_date), 'w') as ref_file:
+        ref_file.write(digest)
+    return archive
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import sqlite3
+import bev_db
+from streetnames import normalize_streetname
+
+HISTORY_DB = "Adresse_Relationale_Tabellen-Historie.sqlite"
+HISTORY_TABLES = ["GEMEINDE", "ORTSCHAFT", "STRASSE", "STRASSE_EXTENT"]
+# large tables, whose history is only built on request
+ADDRESS_HISTORY_TABLES = ["ADRESSE", "GEBAEUDE"]
+# columns of the snapshot databases, which aren't part of the BEV data
+IGNORED_COLUMNS = ["FOUND", "IST_MEHRDEUTIG"]
+
+# Every row of a <TABLE>_HISTORY table is a version of a BEV row (identified
+# by its natural key, see bev_db.PRIMARY_KEYS), which is unchanged in all
+# snapshots from VALID_FROM to VALID_TO (both inclusive, referring to
+# SNAPSHOT.ID). A snapshot only adds rows for new or changed BEV rows, all
+# other rows just get their VALID_TO extended. HISTORY_TABLE contains the
+# last snapshot added to the history of every table, so tables requested
+# later are completed with the snapshots they miss.
+
+def get_history_conn(key_dates=None, tables=HISTORY_TABLES):
+    """Opens the history database and adds the given snapshots (default:
+    bev_db.SNAPSHOTS), which are missing yet, to the history of tables. As
+    versions are only appended, key_dates have to be in chronological order
+    and newer than the snapshots already contained."""
+    if key_dates is None:
+        key_dates = bev_db.SNAPSHOTS
+    con = sqlite3.connect(HISTORY_DB)
+    con.execute("CREATE TABLE IF NOT EXISTS SNAPSHOT (ID INTEGER PRIMARY KEY, KEY_DATE TEXT UNIQUE);")
+    con.execute("CREATE TABLE IF NOT EXISTS HISTORY_TABLE (NAME TEXT PRIMARY KEY, LAST_SNAPSHOT_ID INTEGER);")
+    known = set(row[0] for row in con.execute("SELECT KEY_DATE FROM SNAPSHOT;"))
+    missing = [key_date for key_date in key_dates if key_date not in known]
+    for key_date in missing:
+        if any(key_dates.index(k) > key_dates.index(key_date) for k in known if k in key_dates):
+            raise ValueError("snapshot %s is older than the ones in the history database %s" % (key_date, HISTORY_DB))
+        con.execute("INSERT INTO SNAPSHOT (KEY_DATE) VALUES (?);", (key_date,))
+        known.add(key_date)
+    con.commit()
+    update_history(con, tables)
+    return con
+
+def get_snapshot_id(history_con, key_date):
+    row = history_con.execute("SELECT ID FROM SNAPSHOT WHERE KEY_DATE = ?;", (key_date,)).fetchone()
+    if row is None:
+        raise ValueError("snapshot %s not in history database" % key_date)
+    return row[0]
+
+def update_history(history_con, tables=HISTORY_TABLES):
+    """Adds the snapshots to the history of tables, which it doesn't
+    contain yet. Every snapshot database is attached once for all tables."""
+    cur = history_con.cursor()
+    last_ids = dict((table, _get_last_snapshot_id(cur, table)) for table in tables)
+    for snapshot_id, key_date in cur.execute("SELECT ID, KEY_DATE FROM SNAPSHOT ORDER BY ID;").fetchall():
+        outdated = [table for table in tables if last_ids[table] is None or last_ids[table] < snapshot_id]
+        if not outdated:
+            continue
+        print("adding snapshot %s to history" % key_date)
+        bev_db.get_db_conn(key_date).close()
+        cur.execute("ATTACH DATABASE ? AS snapshot;", (bev_db.get_db_filename(key_date),))
+        for table in outdated:
+            print("  %s" % table)
+            _add_table_snapshot(cur, table, snapshot_id, last_ids[table])
+            last_ids[table] = snapshot_id
+            cur.execute("INSERT OR REPLACE INTO HISTORY_TABLE (NAME, LAST_SNAPSHOT_ID) VALUES (?, ?);", (table, snapshot_id))
+        history_con.commit()
+        cur.execute("DETACH DATABASE snapshot;")
+
+def _get_last_snapshot_id(cur, table):
+    row = cur.execute("SELECT LAST_SNAPSHOT_ID FROM HISTORY_TABLE WHERE NAME = ?;", (table,)).fetchone()
+    if row is not None:
+        return row[0]
+    if cur.execute("PRAGMA main.table_info(%s_HISTORY);" % table).fetchall():
+        # history database created before HISTORY_TABLE
+        return cur.execute("SELECT MAX(VALID_TO) FROM %s_HISTORY;" % table).fetchone()[0]
+    return None
+
+def _get_keys(table):
+    return bev_db.PRIMARY_KEYS.get(table) or dict(bev_db.EXTENT_TABLES)[table]
+
+def _add_table_snapshot(cur, table, snapshot_id, last_id):
+    history_table = "%s_HISTORY" % table
+    keys = _get_keys(table)
+    snapshot_columns = [row for row in cur.execute("PRAGMA snapshot.table_info(%s);" % table) if row[1] not in IGNORED_COLUMNS]
+    columns = [row[1] for row in snapshot_columns]
+    # the extent tables are typed in all snapshots
+    types = dict((row[1], row[2]) for row in snapshot_columns if row[2])
+    history_columns = [row[1] for row in cur.execute("PRAGMA main.table_info(%s);" % history_table)]
+    if not history_columns:
+        cur.execute("CREATE TABLE %s (%s, VALID_FROM INTEGER, VALID_TO INTEGER);" % (history_table, _get_column_definitions(columns, types)))
+        cur.execute("CREATE INDEX %s_KEY ON %s (%s, VALID_TO);" % (history_table, history_table, ", ".join(keys)))
+        cur.execute("CREATE INDEX %s_VALID_FROM ON %s (VALID_FROM);" % (history_table, history_table))
+        history_columns = columns + ["VALID_FROM", "VALID_TO"]
+    for column in columns:
+        if column not in history_columns:
+            # column added by BEV
+            cur.execute("ALTER TABLE %s ADD COLUMN %s;" % (history_table, _get_column_definitions([column], types)))
+    content_columns = [column for column in history_columns if column not in ("VALID_FROM", "VALID_TO")]
+
+    # copy the snapshot with the column types of the history table, so values
+    # of typed and untyped snapshot databases compare equal
+    cur.execute("DROP TABLE IF EXISTS temp.snapshot_rows;")
+    cur.execute("CREATE TEMP TABLE snapshot_rows (%s);" % _get_column_definitions(content_columns, types))
+    cur.execute("INSERT INTO temp.snapshot_rows (%s) SELECT %s FROM snapshot.%s;" % (",".join(columns), ",".join(columns), table))
+    cur.execute("CREATE INDEX temp.snapshot_rows_key ON snapshot_rows (%s);" % ", ".join(keys))
+
+    if last_id is not None:
+        cur.execute("""UPDATE %s SET VALID_TO = ? WHERE VALID_TO = ? AND EXISTS (
+            SELECT 1 FROM temp.snapshot_rows s WHERE %s)""" % (history_table, " AND ".join("s.%s IS %s.%s" % (c, history_table, c) for c in content_columns)),
+            (snapshot_id, last_id))
+    cur.execute("""INSERT INTO %s (%s, VALID_FROM, VALID_TO) SELECT %s, ?, ? FROM temp.snapshot_rows s
+        WHERE NOT EXISTS (SELECT 1 FROM %s h WHERE %s AND h.VALID_TO = ?)""" % (
+            history_table, ",".join(content_columns), ",".join(content_columns),
+            history_table, " AND ".join("h.%s = s.%s" % (key, key) for key in keys)),
+        (snapshot_id, snapshot_id, snapshot_id))
+    cur.execute("DROP TABLE temp.snapshot_rows;")
+
+def _get_column_definitions(columns, types=None):
+    return ", ".join("%s %s" % (column, bev_db.COLUMN_TYPES.get(column, (types or {}).get(column, "TEXT"))) for column in columns)
+
+def get_new_streets(history_con, old_key_date, new_key_date):
+    """Returns the set of SKZ, which exist at new_key_date but not at
+    old_key_date"""
+    old_id = get_snapshot_id(history_con, old_key_date)
+    new_id = get_snapshot_id(history_con, new_key_date)
+    # a version valid at new_id, which started before old_id, was valid at old_id too
+    query = """SELECT n.SKZ FROM STRASSE_HISTORY n
+        WHERE n.VALID_FROM > ? AND n.VALID_FROM <= ? AND n.VALID_TO >= ?
+        AND NOT EXISTS (SELECT 1 FROM STRASSE_HISTORY o WHERE o.SKZ = n.SKZ AND o.VALID_TO >= ? AND o.VALID_FROM <= ?)"""
+    return set(row[0] for row in history_con.execute(query, (old_id, new_id, new_id, old_id, old_id)))
+
+def get_renamed_streets(history_con, key_dates, ignore_minor_changes=True):
+    """Returns a dict {SKZ: [(name, key_date), ...]} of all streets, whose
+    name changed within the snapshots key_dates[0] to key_dates[-1]. The
+    list contains the first name and every change afterwards."""
+    first_id = get_snapshot_id(history_con, key_dates[0])
+    last_id = get_snapshot_id(history_con, key_dates[-1])
+    key_date_by_id = dict(history_con.execute("SELECT ID, KEY_DATE FROM SNAPSHOT;"))
+    query = """SELECT SKZ, STRASSENNAME, VALID_FROM FROM STRASSE_HISTORY
+        WHERE VALID_TO >= ? AND VALID_FROM <= ? AND SKZ IN (
+            SELECT SKZ FROM STRASSE_HISTORY WHERE VALID_TO >= ? AND VALID_FROM <= ?
+            GROUP BY SKZ HAVING COUNT(DISTINCT STRASSENNAME) > 1)
+        ORDER BY SKZ, VALID_FROM"""
+    streets = {}
+    for skz, name, valid_from in history_con.execute(query, (first_id, last_id, first_id, last_id)):
+        key_date = key_date_by_id[max(valid_from, first_id)]
+        if skz in streets:
+            if ignore_minor_changes:
+                if normalize_streetname(streets[skz][-1][0]) != normalize_streetname(name):
+                    streets[skz].append((name, key_date))
+            elif streets[skz][-1][0] != name:
+                streets[skz].append((name, key_date))
+        else:
+            streets[skz] = [(name, key_date)]
+    return {skz: changes for skz, changes in streets.items() if len(changes) > 1}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--addresses", action="store_true", help="also build the history of addresses and buildings (large)", dest="addresses")
+    ARGS = parser.parse_args()
+    get_history_conn(tables=HISTORY_TABLES + (ADDRESS_HISTORY_TABLES if ARGS.addresses else [])).close()
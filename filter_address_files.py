@@ -6,9 +6,13 @@ import sys
 from glob import glob
 import os
 import argparse
+import atexit
+import haversine
 from osm_files import get_boundaries
-from haversine import get_distance, get_cross_track_distance
+from haversine import get_distance
+from spatial_index import PointIndex, SegmentIndex
 import overpass
+import osm_extract
 from streetnames import normalize_streetname
 import re
 import enum
@@ -24,21 +28,40 @@ def filter_address_files(list_of_filenames):
             for housenumber in addresses[alternative]:
                 addresses[street][housenumber].extend(addresses[alternative][housenumber])
             addresses[alternative] = addresses[street]
+    address_index = AddressIndex(addresses)
     overall_count = 0
     filtered_count = 0
     for filename in list_of_filenames:
         if not FILTERED_SUFFIX+".osm" in filename or filename.startswith("NOTES_"):
             print(filename)
-            overall_count_file, filtered_count_file = filter_address_file(filename, addresses)
+            overall_count_file, filtered_count_file = filter_address_file(filename, addresses, address_index)
             overall_count += overall_count_file
             filtered_count += filtered_count_file
     return overall_count, filtered_count
 
+class AddressIndex():
+    """Spatial index of the OSM addresses of addresses[street][housenumber]"""
+    def __init__(self, addresses):
+        unique = {}
+        for housenumbers in addresses.values():
+            for housenumber_addresses in housenumbers.values():
+                for adr in housenumber_addresses:
+                    if adr["lat"] is not None:
+                        unique[id(adr)] = adr
+        self.addresses = list(unique.values())
+        self.index = PointIndex([(adr["lat"], adr["lon"]) for adr in self.addresses])
+
+    def within(self, point, radius, candidates):
+        """Returns [(address, distance)] of the candidates within radius
+        meters of point, the nearest first"""
+        ids = set(id(adr) for adr in candidates)
+        return [(self.addresses[i], distance) for i, distance in self.index.within(point, radius) if id(self.addresses[i]) in ids]
+
 def get_village_from_filename(filename):
     m = re.search("\d+_([^_]+)_", filename)
     return m.group(1)
 
-def filter_address_file(filename, addresses):
+def filter_address_file(filename, addresses, address_index=None):
     tree = ET.parse(filename)
     root = tree.getroot()
     overall_count = 0
@@ -47,7 +70,10 @@ def filter_address_file(filename, addresses):
     bounds = get_boundaries([filename])
     has_local_addresses = None
     streets = None
+    street_index = None
     place_exists = None
+    if address_index is None:
+        address_index = AddressIndex(addresses)
 
     for node in root.findall('node'):
         overall_count += 1
@@ -72,25 +98,27 @@ def filter_address_file(filename, addresses):
                 has_local_addresses = True
             if housenumber in addresses[street]:
                 p1 = (float(node.get("lat")), float(node.get("lon")))
-                for adr in addresses[street][housenumber]:
-                    p2 = (float(adr["lat"]), float(adr["lon"]))
-                    dist = get_distance(p1, p2)
-                    if dist < 150:
-                        if ("city" in adr and adr["city"] != tags["addr:city"] and dist > 50 and 
-                            "".join(c for c in adr["city"].lower() if c.isalnum()) != village):
+                nearby = [(adr, dist) for adr, dist in address_index.within(p1, 150, addresses[street][housenumber]) if dist < 150]
+                for adr, dist in nearby:
+                    if ("city" in adr and adr["city"] != tags["addr:city"] and dist > 50 and 
+                        "".join(c for c in adr["city"].lower() if c.isalnum()) != village):
 
-                            # if city is set and differs (but isn't the village name) use higher threshold
-                            fixme = "ähnliche Adresse in %dm Entfernung (addr:city = '%s' statt '%s')" % (dist, adr["city"], tags["addr:city"])
-                            add_fixme(node, BevFixme.SIMILAR_ADR, fixme)
-                            has_fixme = True
-                            continue
-                        root.remove(node)
-                        filtered = True
-                        filtered_count += 1
-                        break
-                    else:
-                        fixme = "ähnliche Adresse in %dm Entfernung" % dist
-                        has_fixme = add_fixme(node, BevFixme.SIMILAR_ADR, fixme)
+                        # if city is set and differs (but isn't the village name) use higher threshold
+                        fixme = "ähnliche Adresse in %dm Entfernung (addr:city = '%s' statt '%s')" % (dist, adr["city"], tags["addr:city"])
+                        add_fixme(node, BevFixme.SIMILAR_ADR, fixme)
+                        has_fixme = True
+                        continue
+                    root.remove(node)
+                    filtered = True
+                    filtered_count += 1
+                    break
+                if not filtered:
+                    nearby_ids = set(id(adr) for adr, dist in nearby)
+                    for adr in addresses[street][housenumber]:
+                        if id(adr) not in nearby_ids:
+                            dist = get_distance(p1, (float(adr["lat"]), float(adr["lon"])))
+                            fixme = "ähnliche Adresse in %dm Entfernung" % dist
+                            has_fixme = add_fixme(node, BevFixme.SIMILAR_ADR, fixme)
         else:
             if SANITY_CHECKS and has_local_addresses is None:
                 has_local_addresses = len(overpass.get_existing_addresses(*bounds)) > 0
@@ -114,36 +142,12 @@ def filter_address_file(filename, addresses):
                             has_fixme = add_fixme(node, BevFixme.NO_STREET_FOUND)
                     continue
                 else:
-                    # get nearest way
-                    ways, nodes = streets
-                    nearest_way = None
-                    nearest_node = None
-                    min_dist = None
-                    for way in ways:
-                        for i in range(len(way.nodes)):
-                            #calculate distance to every node
-                            p1 = (float(node.get("lat")), float(node.get("lon")))
-                            p2 = (float(way.nodes[i].lat), float(way.nodes[i].lon))
-                            dist = get_distance(p1, p2)
-                            if min_dist is None or dist < min_dist:
-                                min_dist = dist
-                                nearest_node = i
-                                nearest_way = way
-                    nearest_node_tuple = (nearest_way.nodes[nearest_node].lat, nearest_way.nodes[nearest_node].lon)
-                    address_location = (node.get("lat"), node.get("lon"))
-                    if nearest_node > 0:
-                        # check distance to way n-1 -> n
-                        previous_node_tuple = (nearest_way.nodes[nearest_node-1].lat, nearest_way.nodes[nearest_node-1].lon)
-                        dist = get_cross_track_distance(previous_node_tuple, nearest_node_tuple, address_location)
-                        if min_dist is None or dist < min_dist:
-                            min_dist = dist
-                    if nearest_node < len(nearest_way.nodes) - 1:
-                        # check distance to way n -> n+1
-                        next_node_tuple = (nearest_way.nodes[nearest_node+1].lat, nearest_way.nodes[nearest_node+1].lon)
-                        dist = get_cross_track_distance(nearest_node_tuple, next_node_tuple, address_location)
-                        if min_dist is None or dist < min_dist:
-                            min_dist = dist
-                    if min_dist > 150:
+                    # get distance to the nearest way segment
+                    if street_index is None:
+                        street_index = SegmentIndex([[(n.lat, n.lon) for n in way.nodes] for way in streets[0]])
+                    nearest = street_index.nearest((node.get("lat"), node.get("lon")))
+                    min_dist = nearest[1] if nearest is not None else None
+                    if min_dist is not None and min_dist > 150:
                         has_fixme = add_fixme(node, BevFixme.DISTANT_STREET, "Straße weit entfernt (%dm)" % min_dist)
             #if not has_fixme:
                 #if not overpass.is_building_nearby(node.get("lat"), node.get("lon")):
@@ -197,9 +201,20 @@ if __name__ == '__main__':
     parser.add_argument("directory", nargs=1, help="input directory")
     parser.add_argument("--local", action="store_true", help="use local overpass server (URL: %s)" % overpass.LOCAL_OVERPASS_URL, dest="local")
     parser.add_argument("--sanity_checks", action="store_true", help="validate data using various sanity checks", dest="sanity_checks")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the overpass response cache (%s)" % overpass.CACHE_DB, dest="no_cache")
+    parser.add_argument("--extract", help="answer the queries from a local OSM extract (.osm or .osm.pbf) instead of overpass", dest="extract")
+    parser.add_argument("--fast-geometry", action="store_true", help="calculate distances in a local equirectangular projection instead of great circles (see haversine.py for the error bounds)", dest="fast_geometry")
+    parser.add_argument("--stats", nargs="?", const="", metavar="FILE", help="print statistics of the queries per query type on exit (and write them to FILE as JSON)", dest="stats")
     ARGS = parser.parse_args()
+    if ARGS.stats is not None:
+        atexit.register(overpass.report_stats, ARGS.stats)
     SANITY_CHECKS = ARGS.sanity_checks
+    haversine.set_fast_geometry(ARGS.fast_geometry)
     overpass.use_local_overpass(ARGS.local)
+    overpass.set_use_cache(not ARGS.no_cache)
+    if ARGS.extract:
+        osm_extract.open_extract(ARGS.extract)
+        overpass = osm_extract
     if os.path.isdir(ARGS.directory[0]):
         overall_count = 0
         filtered_count = 0
@@ -215,4 +230,6 @@ if __name__ == '__main__':
                 except ZeroDivisionError:
                     pass
         print("\nOverall:\n%d / %d nodes filtered (%d%%)" % (overall_count,filtered_count,(float(overall_count)/filtered_count*100)))
+        if not (ARGS.no_cache or ARGS.extract):
+            print("overpass cache: %d hits, %d misses" % overpass.get_cache_stats())
         
@@ -1,13 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from math import cos, asin, sqrt, sin, atan2, pi, radians, degrees
+from math import cos, acos, asin, sqrt, sin, atan2, pi, radians, degrees, tan, hypot
+try:
+    import numpy
+except ImportError:
+    numpy = None
 # see: https://www.movable-type.co.uk/scripts/latlong.html
+# The get_*s functions compute one point against many with numpy (arrays
+# are returned). numpy is optional, without it they fall back to the scalar
+# functions (lists are returned).
+
+# Fast geometry (see set_fast_geometry and LocalFrame) replaces the great
+# circle calculations by euclidean ones in an equirectangular projection,
+# which is accurate for the short distances of the checks (up to a few km):
+# - get_distance projects at the mean latitude of the points, its relative
+#   error is below FAST_DISTANCE_ERROR for distances up to 10 km
+# - get_cross_track_distance projects at the mean latitude of the points, its
+#   absolute error is below FAST_CROSS_TRACK_ERROR meters if all points are
+#   within FAST_CROSS_TRACK_RADIUS meters of each other
+# - a LocalFrame projects at the latitude of its origin, its relative error
+#   grows with the distance from the origin, see get_max_relative_error
+# All are checked against the great circle calculations in test_haversine.py.
 
 EARTH_RADIUS = 6371000
+DEGREE_LENGTH = EARTH_RADIUS * pi / 180
+FAST_DISTANCE_ERROR = 1e-6
+FAST_CROSS_TRACK_ERROR = 2
+FAST_CROSS_TRACK_RADIUS = 2000
+# default radius (in meters) around the origin of a LocalFrame
+LOCAL_FRAME_RADIUS = 10000
+_fast_geometry = False
+
+def set_fast_geometry(enabled):
+    """Enables the fast geometry for get_distance, get_cross_track_distance,
+    get_distance_to_segment, their numpy versions and everything using them
+    (e.g. projection.get_area_size and the spatial indexes)."""
+    global _fast_geometry
+    _fast_geometry = enabled
 
 def get_distance(point1, point2):
     lat1, lon1 = (float(x) for x in point1)
     lat2, lon2 = (float(x) for x in point2)
+    if _fast_geometry:
+        return hypot(lat2 - lat1, (lon2 - lon1) * cos(radians((lat1 + lat2) / 2))) * DEGREE_LENGTH
     phi1 = radians(lat1)
     phi2 = radians(lat2)
     delta_phi = radians(lat2-lat1)
@@ -28,11 +63,198 @@ def bearing(point1, point2):
     return degrees(atan2(y,x)+360) % 360
 
 def get_cross_track_distance(start, end, point):
+    if _fast_geometry:
+        lat1, lon1 = (float(x) for x in start)
+        lat2, lon2 = (float(x) for x in end)
+        lat3, lon3 = (float(x) for x in point)
+        scale = cos(radians((lat1 + lat2 + lat3) / 3))
+        x2, y2 = (lon2 - lon1) * scale, lat2 - lat1
+        x3, y3 = (lon3 - lon1) * scale, lat3 - lat1
+        length = hypot(x2, y2)
+        if length == 0:
+            return hypot(x3, y3) * DEGREE_LENGTH
+        return abs(x2 * y3 - y2 * x3) / length * DEGREE_LENGTH
     delta_13 = get_distance(start, point) / EARTH_RADIUS
     theta_13 = bearing(start, point)
     theta_12 = bearing(start, end)
     return abs(asin(sin(delta_13) * sin(radians(theta_13 - theta_12))) * EARTH_RADIUS)
 
+def get_distance_to_segment(start, end, point):
+    """Distance of point to the segment start -> end (the cross track
+    distance if the point is beside the segment, otherwise the distance to
+    the nearer end)"""
+    lat, lon = (float(x) for x in point)
+    if _fast_geometry:
+        scale_lon = cos(radians(lat))
+        x1, y1 = (float(start[1]) - lon) * scale_lon, float(start[0]) - lat
+        x2, y2 = (float(end[1]) - lon) * scale_lon, float(end[0]) - lat
+        length = (x2 - x1) ** 2 + (y2 - y1) ** 2
+        t = min(max(-(x1 * (x2 - x1) + y1 * (y2 - y1)) / length, 0), 1) if length > 0 else 0
+        return hypot(x1 + t * (x2 - x1), y1 + t * (y2 - y1)) * DEGREE_LENGTH
+    delta_13 = get_distance(start, point) / EARTH_RADIUS
+    delta_theta = radians(bearing(start, point) - bearing(start, end))
+    if delta_13 == 0 or cos(delta_theta) <= 0:
+        # behind the start
+        return delta_13 * EARTH_RADIUS
+    delta_xt = asin(sin(delta_13) * sin(delta_theta))
+    delta_at = acos(min(cos(delta_13) / cos(delta_xt), 1))
+    if delta_at * EARTH_RADIUS > get_distance(start, end):
+        return get_distance(end, point)
+    return abs(delta_xt) * EARTH_RADIUS
+
+def get_points(points):
+    """Converts a sequence of (lat, lon) for repeated use with the get_*s
+    functions"""
+    if numpy is None:
+        return [(float(lat), float(lon)) for lat, lon in points]
+    return numpy.asarray(points, dtype=float).reshape(-1, 2)
+
+def _get_distances(lat1, lon1, lat2, lon2):
+    if _fast_geometry:
+        return numpy.hypot(lat2 - lat1, (lon2 - lon1) * numpy.cos(numpy.radians((lat1 + lat2) / 2))) * DEGREE_LENGTH
+    phi1 = numpy.radians(lat1)
+    phi2 = numpy.radians(lat2)
+    delta_phi = numpy.radians(lat2-lat1)
+    delta_lambda = numpy.radians(lon2-lon1)
+    a = numpy.sin(delta_phi/2)**2 + numpy.cos(phi1) * numpy.cos(phi2) * numpy.sin(delta_lambda/2)**2
+    a = numpy.clip(a, 0, 1)
+    return EARTH_RADIUS * 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1-a))
+
+def _get_bearings(lat1, lon1, lat2, lon2):
+    phi1 = numpy.radians(lat1)
+    phi2 = numpy.radians(lat2)
+    delta_lambda = numpy.radians(lon2-lon1)
+    y = numpy.sin(delta_lambda) * numpy.cos(phi2)
+    x = numpy.cos(phi1) * numpy.sin(phi2) - numpy.sin(phi1)*numpy.cos(phi2)*numpy.cos(delta_lambda)
+    # same as bearing
+    return numpy.degrees(numpy.arctan2(y,x)+360) % 360
+
+def get_distances(point, points):
+    """Distances of point to every one of points"""
+    if numpy is None:
+        return [get_distance(point, other) for other in points]
+    lat, lon = (float(x) for x in point)
+    points = get_points(points)
+    return _get_distances(lat, lon, points[:,0], points[:,1])
+
+def get_pairwise_distances(points1, points2):
+    """Distances of every one of points1 (rows) to every one of points2
+    (columns)"""
+    if numpy is None:
+        return [get_distances(point, points2) for point in points1]
+    points1 = get_points(points1)
+    points2 = get_points(points2)
+    return _get_distances(points1[:,0,None], points1[:,1,None], points2[None,:,0], points2[None,:,1])
+
+def get_bearings(point, points):
+    """Bearings from point to every one of points"""
+    if numpy is None:
+        return [bearing(point, other) for other in points]
+    lat, lon = (float(x) for x in point)
+    points = get_points(points)
+    return _get_bearings(lat, lon, points[:,0], points[:,1])
+
+def get_cross_track_distances(starts, ends, point):
+    """Cross track distances of point to the lines through starts[i] and
+    ends[i]"""
+    if numpy is None:
+        return [get_cross_track_distance(start, end, point) for start, end in zip(starts, ends)]
+    lat, lon = (float(x) for x in point)
+    starts = get_points(starts)
+    ends = get_points(ends)
+    if _fast_geometry:
+        scale_lon = numpy.cos(numpy.radians((starts[:,0] + ends[:,0] + lat) / 3))
+        x2, y2 = (ends[:,1] - starts[:,1]) * scale_lon, ends[:,0] - starts[:,0]
+        x3, y3 = (lon - starts[:,1]) * scale_lon, lat - starts[:,0]
+        length = numpy.hypot(x2, y2)
+        distances = numpy.abs(x2 * y3 - y2 * x3) / numpy.where(length > 0, length, 1)
+        return numpy.where(length > 0, distances, numpy.hypot(x3, y3)) * DEGREE_LENGTH
+    delta_13 = _get_distances(starts[:,0], starts[:,1], lat, lon) / EARTH_RADIUS
+    theta_13 = _get_bearings(starts[:,0], starts[:,1], lat, lon)
+    theta_12 = _get_bearings(starts[:,0], starts[:,1], ends[:,0], ends[:,1])
+    return numpy.abs(numpy.arcsin(numpy.sin(delta_13) * numpy.sin(numpy.radians(theta_13 - theta_12))) * EARTH_RADIUS)
+
+def get_segment_distances(point, starts, ends):
+    """Distances of point to the segments starts[i] -> ends[i] (see
+    get_distance_to_segment)"""
+    if numpy is None:
+        return [get_distance_to_segment(start, end, point) for start, end in zip(starts, ends)]
+    lat, lon = (float(x) for x in point)
+    starts = get_points(starts)
+    ends = get_points(ends)
+    if _fast_geometry:
+        scale_lon = cos(radians(lat))
+        x1, y1 = (starts[:,1] - lon) * scale_lon, starts[:,0] - lat
+        x2, y2 = (ends[:,1] - lon) * scale_lon, ends[:,0] - lat
+        length = (x2 - x1) ** 2 + (y2 - y1) ** 2
+        t = numpy.clip(-(x1 * (x2 - x1) + y1 * (y2 - y1)) / numpy.where(length > 0, length, 1), 0, 1)
+        return numpy.hypot(x1 + t * (x2 - x1), y1 + t * (y2 - y1)) * DEGREE_LENGTH
+    start_distances = _get_distances(starts[:,0], starts[:,1], lat, lon)
+    delta_13 = start_distances / EARTH_RADIUS
+    delta_theta = numpy.radians(_get_bearings(starts[:,0], starts[:,1], lat, lon) - _get_bearings(starts[:,0], starts[:,1], ends[:,0], ends[:,1]))
+    delta_xt = numpy.arcsin(numpy.sin(delta_13) * numpy.sin(delta_theta))
+    delta_at = numpy.arccos(numpy.minimum(numpy.cos(delta_13) / numpy.cos(delta_xt), 1))
+    distances = numpy.abs(delta_xt) * EARTH_RADIUS
+    distances = numpy.where(delta_at * EARTH_RADIUS > _get_distances(starts[:,0], starts[:,1], ends[:,0], ends[:,1]),
+        _get_distances(ends[:,0], ends[:,1], lat, lon), distances)
+    # behind the start
+    return numpy.where((delta_13 == 0) | (numpy.cos(delta_theta) <= 0), start_distances, distances)
+
+def get_nearest_segment(point, starts, ends):
+    """Returns (index, distance) of the segment starts[i] -> ends[i] nearest
+    to point (the first one if several are equally near) or None if there
+    are no segments"""
+    distances = get_segment_distances(point, starts, ends)
+    if len(distances) == 0:
+        return None
+    if numpy is None:
+        i = min(range(len(distances)), key=distances.__getitem__)
+    else:
+        i = int(numpy.argmin(distances))
+    return i, float(distances[i])
+
+def get_max_relative_error(lat, radius):
+    """Upper bound of the relative distance error of a LocalFrame at
+    latitude lat for points within radius meters of its origin (the error
+    of the longitude scale, with a margin for the higher order terms)"""
+    return 1.1 * tan(abs(radians(lat)) + radius / EARTH_RADIUS) * radius / EARTH_RADIUS
+
+class LocalFrame():
+    """Equirectangular projection to meters around origin (lat, lon) for
+    many checks within one area: after projecting, distances are euclidean
+    and need no trigonometric functions. Points more than max_radius meters
+    from the origin are rejected (ValueError), so the error stays below
+    max_relative_error (None disables the check)."""
+    def __init__(self, origin, max_radius=LOCAL_FRAME_RADIUS):
+        self.lat, self.lon = (float(x) for x in origin)
+        self.scale_lon = cos(radians(self.lat)) * DEGREE_LENGTH
+        self.max_radius = max_radius
+        if max_radius is not None:
+            self.max_relative_error = get_max_relative_error(self.lat, max_radius)
+
+    def project(self, point):
+        """Returns (x, y) in meters east/north of the origin"""
+        x = (float(point[1]) - self.lon) * self.scale_lon
+        y = (float(point[0]) - self.lat) * DEGREE_LENGTH
+        if self.max_radius is not None and x * x + y * y > self.max_radius * self.max_radius:
+            raise ValueError("%s is more than %dm from the origin of the local frame" % (point, self.max_radius))
+        return (x, y)
+
+    def get_distance(self, point1, point2):
+        x1, y1 = self.project(point1)
+        x2, y2 = self.project(point2)
+        return hypot(x2 - x1, y2 - y1)
+
+    def get_cross_track_distance(self, start, end, point):
+        """Distance of point to the line through start and end"""
+        x1, y1 = self.project(start)
+        x2, y2 = self.project(end)
+        x3, y3 = self.project(point)
+        length = hypot(x2 - x1, y2 - y1)
+        if length == 0:
+            return hypot(x3 - x1, y3 - y1)
+        return abs((x2 - x1) * (y3 - y1) - (y2 - y1) * (x3 - x1)) / length
+
 if __name__ == "__main__":
     p1 = (48.0395233, 16.4363301)
     p2 = (48.0404657, 16.4362577)
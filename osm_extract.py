@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+from collections import defaultdict
+import json
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+from math import cos, radians
+import overpass
+from overpass import Element
+from haversine import get_distance
+from progressbar import ProgressBar
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+# Answers the queries of the overpass module from a local .osm or .osm.pbf
+# extract (the latter needs pyosmium). On first use the elements needed
+# for these queries are written to <extract>.index.sqlite, with one R*Tree
+# per kind of element (see KINDS), so that later runs only read the index.
+# Ways match bounds if one of their segments intersects them (as the
+# Overpass bbox filter), relations if the bounding box of their member ways
+# does. Centers are the center of the bounding box (as "out center").
+
+KINDS = {
+    "ADDRESS": lambda tags: "addr:housenumber" in tags,
+    "HIGHWAY": lambda tags: "highway" in tags,
+    "PLACE": lambda tags: "place" in tags,
+    "BUILDING": lambda tags: "building" in tags,
+    "BOUNDARY": lambda tags: tags.get("boundary") == "administrative"
+}
+TYPE_ORDER = {"node": 0, "way": 1, "relation": 2}
+NEARBY_HIGHWAYS = re.compile("residential|unclassified|primary|secondary|tertiary|service")
+# approximate length of a degree of latitude in meters
+DEGREE_LENGTH = 111320
+BATCH_SIZE = 10000
+_extract = None
+
+class Way():
+    """Way of an extract with tags, node records (Element) and center"""
+    __slots__ = ("type", "id", "lat", "lon", "tags", "nodes")
+
+    def __init__(self, id, tags, nodes, lat, lon):
+        self.type = "way"
+        self.id = id
+        self.tags = tags
+        self.nodes = nodes
+        self.lat = lat
+        self.lon = lon
+
+    def __repr__(self):
+        return "<Way %s>" % self.id
+
+class OsmExtract():
+    def __init__(self, filename):
+        self.filename = filename
+        index_filename = "%s.index.sqlite" % filename
+        if not _is_index_current(index_filename, filename):
+            build_index(filename, index_filename)
+        self.con = sqlite3.connect(index_filename, check_same_thread=False)
+
+    def query_bounds(self, kind, minlat, minlon, maxlat, maxlon, types=None):
+        """Returns the elements of the given kind, which intersect the bounds"""
+        bounds = (minlat, minlon, maxlat, maxlon)
+        elements = []
+        for element, geometry in self._query_index(kind, bounds, types):
+            if element.type == "relation" or overpass._intersects(geometry, bounds):
+                elements.append(element)
+        return elements
+
+    def query_around(self, kind, lat, lon, distance, types=None):
+        """Returns the elements of the given kind within distance meters of
+        the point lat/lon"""
+        # bounds of the circle with 10% margin
+        delta_lat = distance * 1.1 / DEGREE_LENGTH
+        delta_lon = distance * 1.1 / (DEGREE_LENGTH * cos(radians(lat)))
+        bounds = (lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon)
+        elements = []
+        for element, geometry in self._query_index(kind, bounds, types):
+            if element.type == "relation":
+                # distance to the nearest point of the bounding box
+                geometry = [(min(max(lat, geometry[0]), geometry[2]), min(max(lon, geometry[1]), geometry[3]))]
+            if _get_distance_to_line(geometry, lat, lon) <= distance:
+                elements.append(element)
+        return elements
+
+    def _query_index(self, kind, bounds, types):
+        """Yields (element, geometry) of all elements, whose bounding box
+        intersects bounds, sorted like the Overpass output"""
+        rows = self.con.execute("""SELECT e.TYPE, e.OSM_ID, e.TAGS, e.LAT, e.LON, e.GEOMETRY, i.MIN_LAT, i.MIN_LON, i.MAX_LAT, i.MAX_LON
+            FROM %s_INDEX i JOIN ELEMENT e ON e.ID = i.ID
+            WHERE i.MAX_LAT >= ? AND i.MIN_LAT <= ? AND i.MAX_LON >= ? AND i.MIN_LON <= ?;""" % kind,
+            (bounds[0], bounds[2], bounds[1], bounds[3])).fetchall()
+        rows.sort(key=lambda row: (TYPE_ORDER[row[0]], row[1]))
+        for element_type, osm_id, tags, lat, lon, geometry, min_lat, min_lon, max_lat, max_lon in rows:
+            if types is not None and element_type not in types:
+                continue
+            tags = json.loads(tags)
+            if element_type == "node":
+                yield Element("node", osm_id, lat, lon, tags), [(lat, lon)]
+            elif element_type == "way":
+                nodes = [Element("node", node_id, node_lat, node_lon, {}) for node_id, node_lat, node_lon in json.loads(geometry)]
+                yield Way(osm_id, tags, nodes, lat, lon), [(node.lat, node.lon) for node in nodes]
+            else:
+                yield Element("relation", osm_id, lat, lon, tags), (min_lat, min_lon, max_lat, max_lon)
+
+def _get_distance_to_line(geometry, lat, lon):
+    """Returns the distance in meters of the point lat/lon to the nearest
+    point or segment of geometry (list of (lat, lon)), using an
+    equirectangular projection around lat/lon"""
+    scale_lon = cos(radians(lat))
+    points = [((p_lon - lon) * scale_lon * DEGREE_LENGTH, (p_lat - lat) * DEGREE_LENGTH) for p_lat, p_lon in geometry]
+    nearest = min(range(len(points)), key=lambda i: points[i][0] ** 2 + points[i][1] ** 2)
+    min_distance = get_distance((lat, lon), geometry[nearest])
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        length = (x2 - x1) ** 2 + (y2 - y1) ** 2
+        if length == 0:
+            continue
+        t = -(x1 * (x2 - x1) + y1 * (y2 - y1)) / length
+        if 0 < t < 1:
+            min_distance = min(min_distance, ((x1 + t * (x2 - x1)) ** 2 + (y1 + t * (y2 - y1)) ** 2) ** 0.5)
+    return min_distance
+
+def _is_index_current(index_filename, filename):
+    if not os.path.exists(index_filename):
+        return False
+    con = sqlite3.connect(index_filename)
+    try:
+        row = con.execute("SELECT VALUE FROM META WHERE KEY = 'SOURCE';").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    con.close()
+    return row is not None and row[0] == _get_source_id(filename)
+
+def _get_source_id(filename):
+    stat = os.stat(filename)
+    return "%d %d" % (stat.st_size, stat.st_mtime)
+
+class _IndexBuilder():
+    """Writes the elements of the KINDS to the index. Coordinates of all
+    nodes and bounds of all ways are kept in a separate build database to
+    resolve way nodes and relation members."""
+    def __init__(self, con):
+        self.con = con
+        self.ways = []
+        self.elements = []
+        self.way_bounds = []
+        self.node_coordinates = []
+
+    def add_node_coordinates(self, node_id, lat, lon):
+        self.node_coordinates.append((node_id, lat, lon))
+        if len(self.node_coordinates) >= BATCH_SIZE:
+            self._flush_node_coordinates()
+
+    def add_node(self, node_id, lat, lon, tags):
+        kinds = _get_kinds(tags)
+        if kinds:
+            self._add_element(kinds, "node", node_id, tags, lat, lon, None, (lat, lon, lat, lon))
+
+    def add_way_refs(self, way_id, refs, tags):
+        """Adds a way, whose node coordinates are taken from the node
+        coordinates added before"""
+        self.ways.append((way_id, refs, tags))
+        if len(self.ways) >= BATCH_SIZE:
+            self._flush_ways()
+
+    def add_way(self, way_id, nodes, tags):
+        """Adds a way with its nodes as (id, lat, lon)"""
+        if not nodes:
+            return
+        bounds = (min(n[1] for n in nodes), min(n[2] for n in nodes), max(n[1] for n in nodes), max(n[2] for n in nodes))
+        self.way_bounds.append((way_id,) + bounds)
+        kinds = _get_kinds(tags)
+        if kinds:
+            self._add_element(kinds, "way", way_id, tags, (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, json.dumps(nodes), bounds)
+        if len(self.way_bounds) >= BATCH_SIZE:
+            self._flush_elements()
+
+    def add_relation(self, relation_id, way_ids, tags):
+        kinds = _get_kinds(tags)
+        if not kinds or not way_ids:
+            return
+        self._flush_elements()
+        bounds = self.con.execute("""SELECT MIN(MIN_LAT), MIN(MIN_LON), MAX(MAX_LAT), MAX(MAX_LON) FROM build.WAY_BOUNDS
+            WHERE ID IN (SELECT value FROM json_each(?));""", (json.dumps(way_ids),)).fetchone()
+        if bounds[0] is not None:
+            self._add_element(kinds, "relation", relation_id, tags, (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, None, bounds)
+
+    def _add_element(self, kinds, element_type, osm_id, tags, lat, lon, geometry, bounds):
+        self.elements.append((kinds, (element_type, osm_id, json.dumps(tags, ensure_ascii=False), lat, lon, geometry), bounds))
+
+    def _flush_node_coordinates(self):
+        self.con.executemany("INSERT OR REPLACE INTO build.NODE_COORDINATES VALUES (?, ?, ?);", self.node_coordinates)
+        self.node_coordinates = []
+
+    def _flush_ways(self):
+        self._flush_node_coordinates()
+        refs = set(ref for way_id, way_refs, tags in self.ways for ref in way_refs)
+        coordinates = {}
+        for node_id, lat, lon in self.con.execute("SELECT ID, LAT, LON FROM build.NODE_COORDINATES WHERE ID IN (SELECT value FROM json_each(?));", (json.dumps(list(refs)),)):
+            coordinates[node_id] = (lat, lon)
+        ways = self.ways
+        self.ways = []
+        for way_id, way_refs, tags in ways:
+            # nodes missing in the extract are skipped
+            self.add_way(way_id, [(ref,) + coordinates[ref] for ref in way_refs if ref in coordinates], tags)
+
+    def _flush_elements(self):
+        if self.ways:
+            self._flush_ways()
+        self.con.executemany("INSERT OR REPLACE INTO build.WAY_BOUNDS VALUES (?, ?, ?, ?, ?);", self.way_bounds)
+        self.way_bounds = []
+        for kinds, row, bounds in self.elements:
+            element_id = self.con.execute("INSERT INTO ELEMENT (TYPE, OSM_ID, TAGS, LAT, LON, GEOMETRY) VALUES (?, ?, ?, ?, ?, ?);", row).lastrowid
+            for kind in kinds:
+                self.con.execute("INSERT INTO %s_INDEX VALUES (?, ?, ?, ?, ?);" % kind, (element_id, bounds[0], bounds[2], bounds[1], bounds[3]))
+        self.elements = []
+
+    def finish(self):
+        self._flush_node_coordinates()
+        self._flush_elements()
+
+def _get_kinds(tags):
+    return [kind for kind, predicate in KINDS.items() if predicate(tags)]
+
+def build_index(filename, index_filename):
+    """Writes the index of the extract filename (.osm or, with pyosmium,
+    any format supported by osmium)"""
+    build_filename = "%s.build" % index_filename
+    for f in (index_filename, build_filename):
+        if os.path.exists(f):
+            os.remove(f)
+    con = sqlite3.connect(index_filename)
+    con.execute("PRAGMA synchronous = OFF;")
+    con.execute("PRAGMA journal_mode = MEMORY;")
+    con.execute("ATTACH DATABASE ? AS build;", (build_filename,))
+    con.execute("PRAGMA build.synchronous = OFF;")
+    con.execute("PRAGMA build.journal_mode = OFF;")
+    con.execute("CREATE TABLE META (KEY TEXT PRIMARY KEY, VALUE TEXT);")
+    con.execute("CREATE TABLE ELEMENT (ID INTEGER PRIMARY KEY, TYPE TEXT, OSM_ID INTEGER, TAGS TEXT, LAT REAL, LON REAL, GEOMETRY TEXT);")
+    for kind in KINDS:
+        con.execute("CREATE VIRTUAL TABLE %s_INDEX USING rtree(ID, MIN_LAT, MAX_LAT, MIN_LON, MAX_LON);" % kind)
+    con.execute("CREATE TABLE build.NODE_COORDINATES (ID INTEGER PRIMARY KEY, LAT REAL, LON REAL);")
+    con.execute("CREATE TABLE build.WAY_BOUNDS (ID INTEGER PRIMARY KEY, MIN_LAT REAL, MIN_LON REAL, MAX_LAT REAL, MAX_LON REAL);")
+    builder = _IndexBuilder(con)
+    if filename.endswith(".osm"):
+        _read_osm_xml(filename, builder)
+    elif osmium is not None:
+        _read_with_osmium(filename, builder)
+    else:
+        con.close()
+        raise ValueError("reading %s requires pyosmium" % filename)
+    builder.finish()
+    con.execute("INSERT INTO META VALUES ('SOURCE', ?);", (_get_source_id(filename),))
+    con.commit()
+    con.execute("DETACH DATABASE build;")
+    con.close()
+    os.remove(build_filename)
+
+def _read_osm_xml(filename, builder):
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f, ProgressBar("indexing %s" % filename) as pb:
+        root = None
+        tags = {}
+        refs = []
+        for event, xml_element in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = xml_element
+                continue
+            if xml_element.tag == "tag":
+                tags[xml_element.get("k")] = xml_element.get("v")
+            elif xml_element.tag == "nd":
+                refs.append(int(xml_element.get("ref")))
+            elif xml_element.tag == "member":
+                if xml_element.get("type") == "way":
+                    refs.append(int(xml_element.get("ref")))
+            elif xml_element.tag in ("node", "way", "relation"):
+                element_id = int(xml_element.get("id"))
+                if xml_element.tag == "node":
+                    lat, lon = float(xml_element.get("lat")), float(xml_element.get("lon"))
+                    builder.add_node_coordinates(element_id, lat, lon)
+                    builder.add_node(element_id, lat, lon, tags)
+                elif xml_element.tag == "way":
+                    builder.add_way_refs(element_id, refs, tags)
+                else:
+                    builder.add_relation(element_id, refs, tags)
+                tags = {}
+                refs = []
+                root.clear()
+                pb.update(100.0 * f.tell() / size)
+
+if osmium is not None:
+    class _OsmiumHandler(osmium.SimpleHandler):
+        def __init__(self, builder):
+            super().__init__()
+            self.builder = builder
+
+        def node(self, n):
+            self.builder.add_node(n.id, n.location.lat, n.location.lon, {tag.k: tag.v for tag in n.tags})
+
+        def way(self, w):
+            nodes = [(n.ref, n.location.lat, n.location.lon) for n in w.nodes if n.location.valid()]
+            self.builder.add_way(w.id, nodes, {tag.k: tag.v for tag in w.tags})
+
+        def relation(self, r):
+            way_ids = [m.ref for m in r.members if m.type == "w"]
+            self.builder.add_relation(r.id, way_ids, {tag.k: tag.v for tag in r.tags})
+
+def _read_with_osmium(filename, builder):
+    print("indexing %s" % filename)
+    # locations=True resolves the node locations of ways
+    _OsmiumHandler(builder).apply_file(filename, locations=True)
+
+def open_extract(filename):
+    """Uses the given extract for all queries of this module"""
+    global _extract
+    _extract = OsmExtract(filename)
+
+@overpass._instrumented
+def get_existing_addresses(minlat, minlon, maxlat, maxlon):
+    return overpass._collect_addresses(_extract.query_bounds("ADDRESS", minlat, minlon, maxlat, maxlon))
+
+@overpass._instrumented
+def get_existing_addresses_around(lat, lon, distance=6.0):
+    return overpass._collect_addresses(_extract.query_around("ADDRESS", float(lat), float(lon), distance))
+
+@overpass._instrumented
+def is_building_nearby(lat, lon, distance=3.0):
+    return len(_extract.query_around("BUILDING", float(lat), float(lon), distance, types=("way", "relation"))) > 0
+
+@overpass._instrumented
+def get_alternative_streetnames(minlat, minlon, maxlat, maxlon, normalize_streetnames = True, add_inverse = False):
+    if normalize_streetnames:
+        normalize = overpass.normalize_streetname
+    else:
+        normalize = lambda x : x
+    alt_names = defaultdict(set)
+    ways = _extract.query_bounds("HIGHWAY", minlat, minlon, maxlat, maxlon, types=("way",))
+    overpass._add_alternative_streetnames(alt_names, [way for way in ways if "alt_name" in way.tags and "name" in way.tags], "alt_name", normalize, add_inverse)
+    overpass._add_alternative_streetnames(alt_names, [way for way in ways if "official_name" in way.tags], "official_name", normalize, add_inverse)
+    return alt_names
+
+@overpass._instrumented
+def get_nearby_streets(lat, lon, distance=100):
+    ways = _extract.query_around("HIGHWAY", float(lat), float(lon), distance, types=("way",))
+    return [way for way in ways if NEARBY_HIGHWAYS.search(way.tags["highway"])]
+
+@overpass._instrumented
+def get_housenumbers_without_streetname(minlat, minlon, maxlat, maxlon):
+    elements = _extract.query_bounds("ADDRESS", minlat, minlon, maxlat, maxlon)
+    return [e for e in elements if "addr:street" not in e.tags and "addr:place" not in e.tags]
+
+@overpass._instrumented
+def admin_boundary_exists(minlat, minlon, maxlat, maxlon, name):
+    boundaries = _extract.query_bounds("BOUNDARY", minlat, minlon, maxlat, maxlon, types=("relation",))
+    return overpass._match_admin_boundary(boundaries, name)
+
+@overpass._instrumented
+def place_exists(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_postfix=False):
+    places = _extract.query_bounds("PLACE", minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+    return overpass._match_place(places, name, ignore_postfix)
+
+@overpass._instrumented
+def streets_exist(minlat, minlon, maxlat, maxlon):
+    return len(_extract.query_bounds("HIGHWAY", minlat, minlon, maxlat, maxlon, types=("way",))) > 0
+
+@overpass._instrumented
+def get_streets_by_name(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_street_postfix=False, include_nodes=True):
+    ways = _extract.query_bounds("HIGHWAY", minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance, types=("way",))
+    streets = overpass._match_streets(ways, name, ignore_street_postfix)
+    if include_nodes:
+        nodes = {}
+        for way in ways:
+            for node in way.nodes:
+                nodes[node.id] = node
+        return (streets, nodes)
+    else:
+        return streets
+
+@overpass._instrumented
+def admin_boundaries_exist(checks):
+    return [admin_boundary_exists(*check) for check in checks]
+
+@overpass._instrumented
+def places_exist(checks, tolerance=0, ignore_postfix=False):
+    return [place_exists(*check, tolerance=tolerance, ignore_postfix=ignore_postfix) for check in checks]
+
+@overpass._instrumented
+def get_streets_by_names(checks, tolerance=0, ignore_street_postfix=False, find_similar=False):
+    results = []
+    for minlat, minlon, maxlat, maxlon, name in checks:
+        ways = _extract.query_bounds("HIGHWAY", minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance, types=("way",))
+        results.append(overpass._match_streets_and_similar(ways, name, ignore_street_postfix, find_similar))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("extract", help="OSM extract (.osm or .osm.pbf), whose index is (re)built")
+    ARGS = parser.parse_args()
+    build_index(ARGS.extract, "%s.index.sqlite" % ARGS.extract)
@@ -1,33 +1,520 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import codecs
+import functools
+import hashlib
+import io
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
 import overpy
-from streetnames import normalize_streetname
+import requests
+from streetnames import normalize_streetname, FuzzyNameIndex
 OVERPASS_URL = None
 LOCAL_OVERPASS_URL = "http://localhost/cgi-bin/overpass-api/interpreter"
+# number of queries sent at the same time (by all threads)
+MAX_CONCURRENT_QUERIES = 2
+# (connect, read) timeout in seconds
+TIMEOUT = (10, 900)
+MAX_RETRIES = 5
+# seconds to wait before the first retry, doubled for every further retry
+RETRY_BACKOFF = 2
+CACHE_DB = "overpass_cache.sqlite"
+# seconds until a cached response expires
+CACHE_TTL = 7 * 24 * 3600
+# maximum size of all cached responses in bytes, the least recently used ones are evicted first
+CACHE_MAX_SIZE = 1000 * 1000 * 1000
+USE_CACHE = True
+# seconds until a cached response isn't used anymore (it's still kept until
+# CACHE_TTL), see set_use_cache
+CACHE_MAX_AGE = CACHE_TTL
+# maximum size of streamed responses, which are added to the cache
+STREAM_CACHE_LIMIT = 100 * 1000 * 1000
+STREET_NAME_TAGS = ("name", "name:de", "alt_name", "official_name", "short_name", "name:left", "name:right")
+ADDRESS_KEYS = ("addr:street", "addr:place", "addr:housenumber", "addr:city", "addr:unit")
+PLACE_NAME_TAGS = ("name", "name:de", "alt_name", "official_name", "short_name", "full_name")
+# number of checks combined into one query by the batch functions
+QUERY_BATCH_SIZE = 100
+# number of query results (with their name indexes) kept in memory
+RESULT_MEMO_SIZE = 16
+# upper bounds (in seconds) of the buckets of the latency histogram
+LATENCY_BUCKETS = (0.1, 0.3, 1, 3, 10, 30, 100)
+_client = None
+_result_memo = OrderedDict()
+_result_memo_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+_query_type = threading.local()
+
+class OverpassCache():
+    """Stores raw Overpass responses in a sqlite database, keyed by endpoint
+    and normalized query text. Responses older than max_age aren't returned,
+    but only removed after ttl."""
+    def __init__(self, filename=CACHE_DB, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE, max_age=None):
+        self.ttl = ttl
+        self.max_age = ttl if max_age is None else min(max_age, ttl)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(filename, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode = WAL;")
+        self.con.execute("PRAGMA synchronous = NORMAL;")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS RESPONSE (KEY TEXT PRIMARY KEY, URL TEXT, QUERY TEXT,
+            CONTENT_TYPE TEXT, CONTENT BLOB, SIZE INTEGER, CREATED REAL, LAST_ACCESS REAL);""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS RESPONSE_LAST_ACCESS ON RESPONSE (LAST_ACCESS);")
+        self.con.execute("DELETE FROM RESPONSE WHERE CREATED < ?;", (time.time() - self.ttl,))
+        self.con.commit()
+        self.size = self.con.execute("SELECT IFNULL(SUM(SIZE), 0) FROM RESPONSE;").fetchone()[0]
+
+    @staticmethod
+    def get_key(url, query):
+        return hashlib.sha1(("%s\n%s" % (url, _normalize_query(query))).encode("utf-8")).hexdigest()
+
+    def get(self, url, query):
+        """Returns (content_type, content) of the cached response or None"""
+        key = self.get_key(url, query)
+        with self.lock:
+            row = self.con.execute("SELECT CONTENT_TYPE, CONTENT, CREATED, SIZE FROM RESPONSE WHERE KEY = ?;", (key,)).fetchone()
+            if row is not None and row[2] < time.time() - self.ttl:
+                self.con.execute("DELETE FROM RESPONSE WHERE KEY = ?;", (key,))
+                self.size -= row[3]
+                row = None
+            elif row is not None and row[2] < time.time() - self.max_age:
+                row = None
+            if row is None:
+                self.misses += 1
+                self.con.commit()
+                return None
+            self.hits += 1
+            self.con.execute("UPDATE RESPONSE SET LAST_ACCESS = ? WHERE KEY = ?;", (time.time(), key))
+            self.con.commit()
+            return row[0], row[1]
+
+    def put(self, url, query, content_type, content):
+        key = self.get_key(url, query)
+        now = time.time()
+        with self.lock:
+            previous = self.con.execute("SELECT SIZE FROM RESPONSE WHERE KEY = ?;", (key,)).fetchone()
+            if previous is not None:
+                self.size -= previous[0]
+            self.con.execute("INSERT OR REPLACE INTO RESPONSE VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                (key, url, query, content_type, content, len(content), now, now))
+            self.size += len(content)
+            if self.size > self.max_size:
+                self._evict()
+            self.con.commit()
+
+    def _evict(self):
+        evicted = []
+        for key, size in self.con.execute("SELECT KEY, SIZE FROM RESPONSE ORDER BY LAST_ACCESS;"):
+            if self.size <= self.max_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.con.executemany("DELETE FROM RESPONSE WHERE KEY = ?;", evicted)
+
+    def clear(self):
+        with self.lock:
+            self.con.execute("DELETE FROM RESPONSE;")
+            self.con.commit()
+            self.size = 0
+
+def _normalize_query(query):
+    """Collapses whitespace outside of quoted strings"""
+    parts = re.findall(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[^"\']+', query.strip())
+    return "".join(part if part[0] in "\"'" else re.sub(r"\s+", " ", part) for part in parts)
+
+class OverpassClient():
+    """Sends Overpass queries over a pooled keep-alive session and parses
+    the response with overpy. At most max_concurrent_queries are sent at
+    the same time, on 429/504 the query is retried with exponential backoff
+    (or the delay given by Retry-After). Responses are taken from and added
+    to cache (an OverpassCache), if given."""
+    def __init__(self, url=None, max_concurrent_queries=MAX_CONCURRENT_QUERIES, timeout=TIMEOUT, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF, cache=None):
+        self.api = overpy.Overpass(url=url)
+        self.cache = cache
+        self.url = self.api.url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.semaphore = threading.BoundedSemaphore(max_concurrent_queries)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_queries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def query(self, query, use_cache=True):
+        if self.cache is not None and use_cache:
+            cached = self.cache.get(self.url, query)
+            if cached is not None:
+                result = self._parse(*cached)
+                _record_response(len(cached[1]), _count_elements(result), cached=True)
+                return result
+        response = self._post(query)
+        content_type = _get_content_type(response)
+        result = self._parse(content_type, response.content)
+        _record_response(len(response.content), _count_elements(result))
+        if self.cache is not None:
+            self.cache.put(self.url, query, content_type, response.content)
+        return result
+
+    def stream(self, query, use_cache=True, keys=None):
+        """Yields the elements of the response as Element records while it
+        is read, only tags with the given keys are kept (default: all).
+        Responses up to STREAM_CACHE_LIMIT bytes are added to the cache."""
+        if self.cache is not None and use_cache:
+            cached = self.cache.get(self.url, query)
+            if cached is not None:
+                elements = 0
+                try:
+                    for element in parse_stream(cached[0], io.BytesIO(cached[1]), keys):
+                        elements += 1
+                        yield element
+                finally:
+                    _record_response(len(cached[1]), elements, cached=True)
+                return
+        response = self._post(query, stream=True)
+        try:
+            content_type = _get_content_type(response)
+            response.raw.decode_content = True
+            stream = _RecordingReader(response.raw, STREAM_CACHE_LIMIT if self.cache is not None else 0)
+            elements = 0
+            with response:
+                try:
+                    for element in parse_stream(content_type, stream, keys):
+                        elements += 1
+                        yield element
+                finally:
+                    _record_response(stream.size, elements)
+        finally:
+            # the body has been read or the response is closed
+            self.semaphore.release()
+        if stream.chunks is not None:
+            self.cache.put(self.url, query, content_type, b"".join(stream.chunks))
+
+    def _post(self, query, stream=False):
+        """Sends the query and returns the response, if it succeeded. A
+        streamed response still holds its slot of max_concurrent_queries, the
+        caller has to release self.semaphore after reading the body."""
+        exceptions = []
+        for retry in range(self.max_retries + 1):
+            self.semaphore.acquire()
+            release = True
+            try:
+                response = self.session.post(self.url, data=query.encode("utf-8"), timeout=self.timeout, stream=stream)
+                if response.status_code == 200:
+                    release = not stream
+                    return response
+                if response.status_code == 400:
+                    msgs = [re.sub("<[^>]*?>", "", msg) for msg in re.findall(r"<p>(<strong\s.*?)</p>", response.text)]
+                    raise overpy.exception.OverpassBadRequest(query, msgs=msgs)
+                if response.status_code == 429:
+                    exceptions.append(overpy.exception.OverpassTooManyRequests())
+                elif response.status_code == 504:
+                    exceptions.append(overpy.exception.OverpassGatewayTimeout())
+                else:
+                    raise overpy.exception.OverpassUnknownHTTPStatusCode(response.status_code)
+                response.close()
+            finally:
+                if release:
+                    self.semaphore.release()
+            if retry < self.max_retries:
+                delay = self.retry_backoff * 2 ** retry
+                if response.headers.get("Retry-After", "").isdigit():
+                    delay = int(response.headers["Retry-After"])
+                time.sleep(delay)
+        raise overpy.exception.MaxRetriesReached(retry_count=self.max_retries + 1, exceptions=exceptions)
+
+    def _parse(self, content_type, content):
+        if content_type == "application/json":
+            return self.api.parse_json(content)
+        if content_type == "application/osm3s+xml":
+            return self.api.parse_xml(content)
+        raise overpy.exception.OverpassUnknownContentType(content_type)
+
+def _get_content_type(response):
+    return response.headers.get("Content-Type", "").split(";")[0].strip()
+
+class _RecordingReader():
+    """File-like wrapper, which counts the bytes read and keeps the data as
+    long as it doesn't exceed limit bytes (chunks is None afterwards)"""
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+        self.chunks = []
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.chunks is not None:
+            if self.size > self.limit:
+                self.chunks = None
+            else:
+                self.chunks.append(data)
+        return data
+
+class Element():
+    """Compact record of an OSM element of a streamed response. lat/lon
+    are the center for ways and relations (out center), tag keys and values
+    are interned."""
+    __slots__ = ("type", "id", "lat", "lon", "tags")
+
+    def __init__(self, type, id, lat=None, lon=None, tags=None):
+        self.type = type
+        self.id = id
+        self.lat = lat
+        self.lon = lon
+        self.tags = tags
+
+    def __repr__(self):
+        return "<Element %s/%s>" % (self.type, self.id)
+
+def parse_stream(content_type, stream, keys=None):
+    if content_type == "application/json":
+        return parse_json_stream(stream, keys)
+    if content_type == "application/osm3s+xml":
+        return parse_xml_stream(stream, keys)
+    raise overpy.exception.OverpassUnknownContentType(content_type)
+
+def _handle_remark(msg):
+    msg = msg.strip()
+    if msg.startswith("runtime error:"):
+        raise overpy.exception.OverpassRuntimeError(msg=msg)
+    elif msg.startswith("runtime remark:"):
+        raise overpy.exception.OverpassRuntimeRemark(msg=msg)
+    raise overpy.exception.OverpassUnknownError(msg=msg)
+
+def _get_tags(items, keys):
+    return {sys.intern(k): sys.intern(v) for k, v in items if keys is None or k in keys}
+
+def parse_xml_stream(stream, keys=None):
+    """Yields an Element for every node, way and relation of an Overpass
+    XML response read from stream"""
+    root = None
+    element = None
+    depth = 0
+    for event, xml_element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = xml_element
+            elif depth == 2 and xml_element.tag in ("node", "way", "relation"):
+                element = Element(xml_element.tag, int(xml_element.get("id")), tags={})
+                if "lat" in xml_element.attrib:
+                    element.lat = float(xml_element.get("lat"))
+                    element.lon = float(xml_element.get("lon"))
+            continue
+        depth -= 1
+        if element is not None and depth == 2:
+            if xml_element.tag == "tag":
+                key = xml_element.get("k")
+                if keys is None or key in keys:
+                    element.tags[sys.intern(key)] = sys.intern(xml_element.get("v"))
+            elif xml_element.tag == "center":
+                element.lat = float(xml_element.get("lat"))
+                element.lon = float(xml_element.get("lon"))
+        elif depth == 1:
+            if element is not None:
+                yield element
+                element = None
+            elif xml_element.tag == "remark":
+                _handle_remark(xml_element.text or "")
+            # free the elements parsed so far
+            root.clear()
+
+def parse_json_stream(stream, keys=None, chunk_size=65536):
+    """Yields an Element for every node, way and relation of an Overpass
+    JSON response read from stream"""
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = None
+    eof = False
+    while True:
+        if not eof:
+            data = stream.read(chunk_size)
+            eof = not data
+            buffer += decode.decode(data, final=eof)
+        if position is None:
+            # skip the header up to the elements array
+            match = re.search(r'"elements"\s*:\s*\[', buffer)
+            if match is None:
+                if eof:
+                    break
+                continue
+            position = match.end()
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                remainder = buffer[position + 1:]
+                while not eof:
+                    data = stream.read(chunk_size)
+                    eof = not data
+                    remainder += decode.decode(data, final=eof)
+                remark = re.search(r'"remark"\s*:\s*("(?:\\.|[^"\\])*")', remainder)
+                if remark is not None:
+                    _handle_remark(json.loads(remark.group(1)))
+                return
+            try:
+                data, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+                break
+            position = end
+            element = Element(data["type"], data["id"], data.get("lat"), data.get("lon"), _get_tags(data.get("tags", {}).items(), keys))
+            if "center" in data:
+                element.lat = data["center"]["lat"]
+                element.lon = data["center"]["lon"]
+            yield element
+        buffer = buffer[position:]
+        position = 0
+        if eof and not buffer:
+            break
+
+class QueryStats():
+    """Statistics of the calls of one query function: number and duration
+    of calls (with a histogram over LATENCY_BUCKETS) and the Overpass
+    responses received, either sent or taken from the cache"""
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.requests = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.elements = 0
+
+    def as_dict(self):
+        histogram = dict(zip(["<%s" % bucket for bucket in LATENCY_BUCKETS] + [">=%s" % LATENCY_BUCKETS[-1]], self.histogram))
+        return {"calls": self.calls, "time": self.time, "latency_histogram": histogram, "requests": self.requests,
+            "cache_hits": self.cache_hits, "bytes": self.bytes, "elements": self.elements}
+
+def _get_stats(query_type):
+    if query_type not in _stats:
+        _stats[query_type] = QueryStats()
+    return _stats[query_type]
+
+def _instrumented(function):
+    """Records the calls of function and the responses received meanwhile in
+    the statistics of its query type (the qualified function name)"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_query_type, "name", None)
+        _query_type.name = function.__qualname__
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            _query_type.name = previous
+            with _stats_lock:
+                stats = _get_stats(function.__qualname__)
+                stats.calls += 1
+                stats.time += duration
+                stats.histogram[sum(1 for bucket in LATENCY_BUCKETS if duration >= bucket)] += 1
+    return wrapper
+
+def _record_response(size, elements, cached=False):
+    with _stats_lock:
+        stats = _get_stats(getattr(_query_type, "name", None) or "other")
+        if cached:
+            stats.cache_hits += 1
+        else:
+            stats.requests += 1
+        stats.bytes += size
+        stats.elements += elements
+
+def _count_elements(result):
+    return len(result.nodes) + len(result.ways) + len(result.relations)
+
+def get_stats():
+    """Returns the statistics per query type as dict"""
+    with _stats_lock:
+        return {query_type: stats.as_dict() for query_type, stats in _stats.items()}
+
+def report_stats(filename=None):
+    """Prints the statistics per query type (the time of a query function
+    includes the query functions it calls) and writes them to filename
+    as JSON, if given"""
+    stats = get_stats()
+    if not stats:
+        return
+    buckets = ["<%s" % bucket for bucket in LATENCY_BUCKETS] + [">=%s" % LATENCY_BUCKETS[-1]]
+    print("\n%-36s %7s %9s %8s %10s %9s %9s  %s" % ("query type", "calls", "time [s]", "requests", "cache hits", "MB", "elements",
+        " ".join("%6s" % bucket for bucket in buckets)))
+    for query_type, s in sorted(stats.items(), key=lambda item: -item[1]["time"]):
+        print("%-36s %7d %9.1f %8d %10d %9.1f %9d  %s" % (query_type, s["calls"], s["time"], s["requests"], s["cache_hits"],
+            s["bytes"] / 1e6, s["elements"], " ".join("%6d" % s["latency_histogram"][bucket] for bucket in buckets)))
+    if filename:
+        with open(filename, "w") as stats_file:
+            json.dump(stats, stats_file, indent=2)
+
+def get_client():
+    global _client
+    if _client is None:
+        cache = None
+        if USE_CACHE:
+            cache = OverpassCache(max_age=CACHE_MAX_AGE)
+        _client = OverpassClient(OVERPASS_URL, MAX_CONCURRENT_QUERIES, cache=cache)
+    return _client
+
+def stream_query(query, use_cache=True, keys=None):
+    """Runs the query with the shared client and yields its elements as
+    Element records while the response is read"""
+    return get_client().stream(query, use_cache, keys)
+
+def execute_query(query, use_cache=True):
+    """Runs the query with the shared client, use_cache=False bypasses the
+    response cache for this query (the response is still stored)"""
+    return get_client().query(query, use_cache)
+
+def set_use_cache(use_cache, max_age=CACHE_TTL):
+    """Enables the response cache, only responses younger than max_age
+    seconds are taken from it"""
+    global USE_CACHE, CACHE_MAX_AGE, _client
+    USE_CACHE = use_cache
+    CACHE_MAX_AGE = max_age
+    _client = None
+
+def get_cache_stats():
+    """Returns (hits, misses) of the response cache"""
+    if _client is None or _client.cache is None:
+        return 0, 0
+    return _client.cache.hits, _client.cache.misses
 
 def set_overpass_url(url):
-    global OVERPASS_URL
+    global OVERPASS_URL, _client
     OVERPASS_URL = url
+    _client = None
+
+def set_max_concurrent_queries(max_concurrent_queries):
+    global MAX_CONCURRENT_QUERIES, _client
+    MAX_CONCURRENT_QUERIES = max_concurrent_queries
+    _client = None
 
 def use_local_overpass(local):
     if local:
         set_overpass_url(LOCAL_OVERPASS_URL)
 
 def _get_existing_addresses(query):
-    api = overpy.Overpass(url=OVERPASS_URL)
-    result = api.query(query)
-
-    address_points = []
-    address_points.extend(result.ways)
-    address_points.extend(result.relations)
-    for polygon in address_points:
-        polygon.lat = polygon.center_lat
-        polygon.lon = polygon.center_lon
-    address_points.extend(result.nodes)
+    return _collect_addresses(stream_query(query, keys=ADDRESS_KEYS))
 
+def _collect_addresses(elements):
+    """Returns the addresses of the elements (with lat/lon) as
+    {normalized street: {housenumber: [address, ...]}}"""
     addresses = defaultdict(lambda: defaultdict(list))
-    for addr in address_points:
+    # nodes are added after ways and relations
+    node_addresses = []
+    for addr in elements:
         if "addr:street" in addr.tags:
             street = addr.tags["addr:street"]
         elif "addr:place" in addr.tags:
@@ -38,7 +525,7 @@ def _get_existing_addresses(query):
             street = normalize_streetname(street)
         except ValueError:
             error_file = open("invalid_characters.txt", "a+")
-            error_file.write("%s %s %s %s\n\n" % (street, addr.id, addr.__class__, str(addr.tags)))
+            error_file.write("%s %s %s %s\n\n" % (street, addr.id, addr.type, str(addr.tags)))
             error_file.close()
         housenumber = addr.tags["addr:housenumber"].lower()
 
@@ -49,87 +536,92 @@ def _get_existing_addresses(query):
             address["unit"] = addr.tags["addr:unit"]
         elif "/" in housenumber:
             housenumber, address["unit"] = housenumber.split("/", 1)
-        addresses[street][housenumber].append(address)
+        if addr.type == "node":
+            node_addresses.append((street, housenumber, address))
+        else:
+            _add_address(addresses, street, housenumber, address)
+    for street, housenumber, address in node_addresses:
+        _add_address(addresses, street, housenumber, address)
+    return addresses
 
-        # add single addresses for (simple) address ranges to existing addresses
-        # i.e. for the existing address "49-51" add "49-51", "49" and "51"
-        if "-" in housenumber:
-            try:
-                lower_bound, upper_bound = [int(n) for n in housenumber.split("-", 1)]
-                for n in range(lower_bound, upper_bound+1, 2):
-                    addresses[street][n].append(address)
-            except ValueError:
-                pass
+def _add_address(addresses, street, housenumber, address):
+    addresses[street][housenumber].append(address)
 
-    return addresses
+    # add single addresses for (simple) address ranges to existing addresses
+    # i.e. for the existing address "49-51" add "49-51", "49" and "51"
+    if "-" in housenumber:
+        try:
+            lower_bound, upper_bound = [int(n) for n in housenumber.split("-", 1)]
+            for n in range(lower_bound, upper_bound+1, 2):
+                addresses[street][n].append(address)
+        except ValueError:
+            pass
 
+@_instrumented
 def get_existing_addresses_around(lat, lon, distance=6.0):
     query = 'nwr["addr:housenumber"](around: %s,%s,%s);out center;' % (distance, lat, lon)
     return _get_existing_addresses(query)
 
+@_instrumented
 def is_building_nearby(lat, lon, distance=3.0):
     query = 'nwr[building](around: %s,%s,%s);out center;' % (distance, lat, lon)
-    api = overpy.Overpass(url=OVERPASS_URL)
-    result = api.query(query)
+    result = execute_query(query)
     return (len(result.ways) + len(result.relations) > 0)
 
+@_instrumented
 def get_existing_addresses(minlat, minlon, maxlat, maxlon):
     query = 'nwr["addr:housenumber"](%s,%s,%s,%s);out center;' % (minlat, minlon, maxlat, maxlon)
     return _get_existing_addresses(query)
 
+@_instrumented
 def get_alternative_streetnames(minlat, minlon, maxlat, maxlon, normalize_streetnames = True, add_inverse = False):
     if normalize_streetnames:
         normalize = normalize_streetname
     else:
         normalize = lambda x : x
     alt_names = defaultdict(set)
-    api = overpy.Overpass(url=OVERPASS_URL)
-    result = api.query('way[highway][alt_name][name](%s,%s,%s,%s);out;' % (minlat, minlon, maxlat, maxlon))
-    for way in result.ways:
+    result = execute_query('way[highway][alt_name][name](%s,%s,%s,%s);out;' % (minlat, minlon, maxlat, maxlon))
+    _add_alternative_streetnames(alt_names, result.ways, "alt_name", normalize, add_inverse)
+    result = execute_query('way[highway][official_name](%s,%s,%s,%s);out;' % (minlat, minlon, maxlat, maxlon))
+    _add_alternative_streetnames(alt_names, result.ways, "official_name", normalize, add_inverse)
+    return alt_names
+
+def _add_alternative_streetnames(alt_names, ways, tag, normalize, add_inverse):
+    for way in ways:
         try:
             name = normalize(way.tags["name"])
-            alt_name = normalize(way.tags["alt_name"])
+            alt_name = normalize(way.tags[tag])
             alt_names[name].add(alt_name)
             if add_inverse:
                 alt_names[alt_name].add(name)
         except ValueError:
             error_file = open("invalid_characters.txt", "a+")
-            error_file.write("%s %s (alt_name)\n\n" % (way.tags["alt_name"], way.tags["name"]))
-            error_file.close()
-    result = api.query('way[highway][official_name](%s,%s,%s,%s);out;' % (minlat, minlon, maxlat, maxlon))
-    for way in result.ways:
-        try:
-            name = normalize(way.tags["name"])
-            official_name = normalize(way.tags["official_name"])
-            alt_names[name].add(official_name)
-            if add_inverse:
-                alt_names[official_name].add(name)
-        except ValueError:
-            error_file = open("invalid_characters.txt", "a+")
-            error_file.write("%s %s (official_name)\n\n" % (way.tags["official_name"], way.tags["name"]))
+            error_file.write("%s %s (%s)\n\n" % (way.tags[tag], way.tags["name"], tag))
             error_file.close()
-    return alt_names
 
+@_instrumented
 def get_nearby_streets(lat, lon, distance=100):
-    api = overpy.Overpass(url=OVERPASS_URL)
-    result = api.query("way[highway~'residential|unclassified|primary|secondary|tertiary|service'](around: %s,%s,%s);out;" % (distance, lat, lon))
+    result = execute_query("way[highway~'residential|unclassified|primary|secondary|tertiary|service'](around: %s,%s,%s);out;" % (distance, lat, lon))
     return result.ways
 
+@_instrumented
 def get_housenumbers_without_streetname(minlat, minlon, maxlat, maxlon):
-    api = overpy.Overpass(url=OVERPASS_URL)
-    result = api.query("nwr['addr:housenumber'][!'addr:street'][!'addr:place'](%s,%s,%s,%s);out;" % (minlat, minlon, maxlat, maxlon))
+    result = execute_query("nwr['addr:housenumber'][!'addr:street'][!'addr:place'](%s,%s,%s,%s);out;" % (minlat, minlon, maxlat, maxlon))
     housenumbers = []
     housenumbers.extend(result.nodes)
     housenumbers.extend(result.ways)
     housenumbers.extend(result.relations)
     return housenumbers
 
+@_instrumented
 def admin_boundary_exists(minlat, minlon, maxlat, maxlon, name):
-    api = overpy.Overpass(url=OVERPASS_URL)
     bounds = "%s,%s,%s,%s" % (minlat, minlon, maxlat, maxlon)
     query = """relation[boundary=administrative](%s);out;""" % bounds
-    result = api.query(query)
-    for boundary in result.relations:
+    result = execute_query(query)
+    return _match_admin_boundary(result.relations, name)
+
+def _match_admin_boundary(boundaries, name):
+    for boundary in boundaries:
         for tag in ("name", "name:de", "alt_name", "official_name", "short_name"):
             try:
                 if tag in boundary.tags:
@@ -143,29 +635,24 @@ def admin_boundary_exists(minlat, minlon, maxlat, maxlon, name):
                 # ignore boundaries with unsupported characters
                 pass
     return False
-    
 
+@_instrumented
 def place_exists(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_postfix=False):
-    api = overpy.Overpass(url=OVERPASS_URL)
     bounds = "%s,%s,%s,%s" % (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
     query = """nwr[place](%s);out;""" % bounds
-    result = api.query(query)
-    places = []
-    places.extend(result.nodes)
-    places.extend(result.ways)
-    places.extend(result.relations)
+    result, index = _get_indexed_result(query, lambda result: result.nodes + result.ways + result.relations)
+    return len(index.find_places(name, ignore_postfix)) > 0
+
+def _match_place(places, name, ignore_postfix=False):
     for place in places:
-        for tag in ("name", "name:de", "alt_name", "official_name", "short_name", "full_name"):
+        for tag in PLACE_NAME_TAGS:
             try:
                 if tag in place.tags:
                     search_name = name
                     found_name = place.tags[tag]
                     if ignore_postfix:
-                        for postfix in ["im", "in", "am", "bei", "an der"]:
-                            if " %s " % postfix in search_name:
-                                search_name = search_name[:search_name.index(postfix)-1]
-                            if " %s " % postfix in found_name:
-                                found_name = found_name[:found_name.index(postfix)-1]
+                        search_name = _strip_place_postfix(search_name)
+                        found_name = _strip_place_postfix(found_name)
                     if normalize_streetname(search_name) == normalize_streetname(found_name):
                         return True
             except ValueError:
@@ -173,31 +660,28 @@ def place_exists(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_postf
                 pass
     return False
 
+def _strip_place_postfix(name):
+    """Removes postfixes like "im ...", "an der ..." from place names"""
+    for postfix in ["im", "in", "am", "bei", "an der"]:
+        if " %s " % postfix in name:
+            name = name[:name.index(postfix)-1]
+    return name
+
+@_instrumented
 def streets_exist(minlat, minlon, maxlat, maxlon):
-    api = overpy.Overpass(url=OVERPASS_URL)
     bounds = "%s,%s,%s,%s" % (minlat, minlon, maxlat, maxlon)
-    result = api.query("way[highway](%s);out;" % bounds)
+    result = execute_query("way[highway](%s);out;" % bounds)
     return (len(result.ways) > 0)
 
+@_instrumented
 def get_streets_by_name(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_street_postfix=False, include_nodes=True):
-    api = overpy.Overpass(url=OVERPASS_URL)
     bounds = "%s,%s,%s,%s" % (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
     if include_nodes:
         query = """way[highway](%s);(._;>;);out;""" % bounds
     else:
         query = """way[highway](%s);out;""" % bounds
-    print(query)
-    result = api.query(query)
-    ways = []
-    normalized_streetname = normalize_streetname(name, ignore_street_postfix=ignore_street_postfix)
-    for way in result.ways:
-        for tag in ("name", "name:de", "alt_name", "official_name", "short_name", "name:left", "name:right"):
-            try:
-                if tag in way.tags and normalize_streetname(way.tags[tag], ignore_street_postfix=ignore_street_postfix) == normalized_streetname:
-                    ways.append(way)
-            except ValueError:
-                # ignore ways with unsupported characters
-                pass
+    result, index = _get_indexed_result(query, lambda result: result.ways)
+    ways = index.find_streets(name, ignore_street_postfix)
     if include_nodes:
         nodes = {}
         for node in result.nodes:
@@ -206,8 +690,263 @@ def get_streets_by_name(minlat, minlon, maxlat, maxlon, name, tolerance=0, ignor
     else:
         return ways
 
+def _match_streets(ways, name, ignore_street_postfix=False):
+    return NameIndex(ways).find_streets(name, ignore_street_postfix)
+
+class NameIndex():
+    """Index from normalized name to the elements of a query result (or to
+    items containing them, get_element returns the element of an item).
+    The indexes for streets and places are built on first use for every
+    variant of the normalization, so matching a name is a dict lookup."""
+    def __init__(self, items, get_element=lambda item: item):
+        self.items = items
+        self.get_element = get_element
+        self.lock = threading.Lock()
+        self._indexes = {}
+
+    def _get_index(self, key, tags, normalize):
+        with self.lock:
+            if key not in self._indexes:
+                index = defaultdict(list)
+                for item in self.items:
+                    element = self.get_element(item)
+                    for tag in tags:
+                        try:
+                            if tag in element.tags:
+                                index[normalize(element.tags[tag])].append(item)
+                        except ValueError:
+                            # ignore elements with unsupported characters
+                            pass
+                self._indexes[key] = index
+            return self._indexes[key]
+
+    def find_streets(self, name, ignore_street_postfix=False):
+        """Returns the items with a street name tag matching name (once for
+        every matching tag)"""
+        normalize = lambda name: normalize_streetname(name, ignore_street_postfix=ignore_street_postfix)
+        index = self._get_index(("streets", ignore_street_postfix), STREET_NAME_TAGS, normalize)
+        return list(index.get(normalize(name), []))
+
+    def find_places(self, name, ignore_postfix=False):
+        """Returns the items with a place name tag matching name"""
+        if ignore_postfix:
+            normalize = lambda name: normalize_streetname(_strip_place_postfix(name))
+        else:
+            normalize = normalize_streetname
+        index = self._get_index(("places", ignore_postfix), PLACE_NAME_TAGS, normalize)
+        try:
+            return list(index.get(normalize(name), []))
+        except ValueError:
+            return []
+
+def _get_indexed_result(query, get_elements):
+    """Returns (result, NameIndex of get_elements(result)) of the query. The
+    last RESULT_MEMO_SIZE are kept in memory, so repeated queries reuse both."""
+    key = (OVERPASS_URL, query)
+    with _result_memo_lock:
+        if key in _result_memo:
+            _result_memo.move_to_end(key)
+            return _result_memo[key]
+    result = execute_query(query)
+    indexed = (result, NameIndex(get_elements(result)))
+    with _result_memo_lock:
+        _result_memo[key] = indexed
+        while len(_result_memo) > RESULT_MEMO_SIZE:
+            _result_memo.popitem(last=False)
+    return indexed
+
+@_instrumented
+def admin_boundaries_exist(checks):
+    """Batched admin_boundary_exists for a list of (minlat, minlon, maxlat,
+    maxlon, name), returns a list of bools"""
+    statements = ["relation[boundary=administrative](%s,%s,%s,%s);" % tuple(check[:4]) for check in checks]
+    return [_match_admin_boundary(relations, check[4]) for check, relations in zip(checks, _execute_batch(statements))]
+
+@_instrumented
+def places_exist(checks, tolerance=0, ignore_postfix=False):
+    """Batched place_exists for a list of (minlat, minlon, maxlat, maxlon,
+    name), returns a list of bools"""
+    statements = ["nwr[place](%s,%s,%s,%s);" % (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+        for minlat, minlon, maxlat, maxlon, name in checks]
+    return [_match_place(places, check[4], ignore_postfix) for check, places in zip(checks, _execute_batch(statements))]
+
+@_instrumented
+def get_streets_by_names(checks, tolerance=0, ignore_street_postfix=False, find_similar=False):
+    """Batched get_streets_by_name(..., include_nodes=False) for a list of
+    (minlat, minlon, maxlat, maxlon, name), returns a list of lists of ways.
+    With find_similar a list of (ways, similar) is returned, similar is True
+    if no way matches, but one of the same bounds has a similar name (see
+    streetnames.FuzzyNameIndex)."""
+    statements = ["way[highway](%s,%s,%s,%s);" % (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+        for minlat, minlon, maxlat, maxlon, name in checks]
+    return [_match_streets_and_similar(ways, check[4], ignore_street_postfix, find_similar) for check, ways in zip(checks, _execute_batch(statements))]
+
+def _match_streets_and_similar(ways, name, ignore_street_postfix=False, find_similar=False):
+    streets = _match_streets(ways, name, ignore_street_postfix)
+    if not find_similar:
+        return streets
+    return streets, len(streets) == 0 and _match_similar_streets(ways, name)
+
+def _match_similar_streets(ways, name, max_distance=None):
+    index = FuzzyNameIndex((way.tags[tag], way) for way in ways for tag in STREET_NAME_TAGS if tag in way.tags)
+    return len(index.find_similar(name, max_distance)) > 0
+
+def _execute_batch(statements):
+    """Runs the statements in queries of up to QUERY_BATCH_SIZE statements
+    and returns the elements (with tags) found by each statement. The output
+    of every statement is preceded by a derived "batch" element with its
+    index, so the response can be split again."""
+    results = []
+    for start in range(0, len(statements), QUERY_BATCH_SIZE):
+        batch = statements[start:start+QUERY_BATCH_SIZE]
+        query = "[out:json][timeout:%d];" % TIMEOUT[1]
+        query += "".join("""make batch index="%d";out;%sout tags;""" % (i, statement) for i, statement in enumerate(batch))
+        elements = [[] for statement in batch]
+        current = None
+        for element in stream_query(query):
+            if element.type == "batch":
+                current = elements[int(element.tags["index"])]
+            else:
+                current.append(element)
+        results.extend(elements)
+    return results
+
+class AreaIndex():
+    """Highway ways and place objects of an area, which are downloaded once
+    (on first use) and indexed by normalized name, so get_streets_by_name
+    and place_exists can be answered locally for any bounds within the area.
+    Ways match bounds if one of their segments intersects them, place
+    relations if one of their member nodes or ways does (as the Overpass
+    bbox filter)."""
+    def __init__(self, minlat, minlon, maxlat, maxlon):
+        self.bounds = (minlat, minlon, maxlat, maxlon)
+        self.lock = threading.Lock()
+        self.ways = None
+        self.places = None
+        self.similar_ways = None
+
+    def _load(self):
+        with self.lock:
+            if self.ways is None:
+                self._download()
+
+    @_instrumented
+    def _download(self):
+        query = """[out:json];way[highway](%s,%s,%s,%s);out tags geom;""" % self.bounds
+        ways = []
+        for way in execute_query(query).ways:
+            ways.append((way, [(float(node["lat"]), float(node["lon"])) for node in way.attributes["geometry"]]))
+        query = """[out:json];nwr[place](%s,%s,%s,%s);out tags geom;""" % self.bounds
+        result = execute_query(query)
+        places = []
+        for node in result.nodes:
+            places.append((node, [(float(node.lat), float(node.lon))]))
+        for way in result.ways:
+            places.append((way, [(float(node["lat"]), float(node["lon"])) for node in way.attributes["geometry"]]))
+        for relation in result.relations:
+            places.append((relation, [_get_member_geometry(member) for member in relation.members]))
+        self.places = NameIndex(places, lambda item: item[0])
+        # ways last, as it marks the area as loaded
+        self.ways = NameIndex(ways, lambda item: item[0])
+
+    def _contains(self, bounds):
+        return (bounds[0] >= self.bounds[0] and bounds[1] >= self.bounds[1] and
+            bounds[2] <= self.bounds[2] and bounds[3] <= self.bounds[3])
+
+    def get_streets_by_name(self, minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_street_postfix=False):
+        """Same as get_streets_by_name(..., include_nodes=False)"""
+        bounds = (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+        if not self._contains(bounds):
+            return get_streets_by_name(minlat, minlon, maxlat, maxlon, name, tolerance, ignore_street_postfix, include_nodes=False)
+        if self.ways is None:
+            self._load()
+        return [way for way, geometry in self.ways.find_streets(name, ignore_street_postfix) if _intersects(geometry, bounds)]
+
+    def place_exists(self, minlat, minlon, maxlat, maxlon, name, tolerance=0, ignore_postfix=False):
+        bounds = (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+        if not self._contains(bounds):
+            return place_exists(minlat, minlon, maxlat, maxlon, name, tolerance, ignore_postfix)
+        if self.ways is None:
+            self._load()
+        for place, geometry in self.places.find_places(name, ignore_postfix):
+            if isinstance(place, overpy.Relation):
+                if any(_intersects(member_geometry, bounds) for member_geometry in geometry):
+                    return True
+            elif _intersects(geometry, bounds):
+                return True
+        return False
+
+    def find_similar_streets(self, minlat, minlon, maxlat, maxlon, name, tolerance=0, max_distance=None):
+        """Returns [(distance, way)] of the ways within the bounds with a name
+        similar to name (see streetnames.FuzzyNameIndex), the most similar
+        first. Only the downloaded ways are searched, so there are no
+        results for bounds outside the area."""
+        bounds = (minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)
+        if not self._contains(bounds):
+            return []
+        if self.ways is None:
+            self._load()
+        with self.lock:
+            if self.similar_ways is None:
+                self.similar_ways = FuzzyNameIndex((way.tags[tag], (way, geometry))
+                    for way, geometry in self.ways.items for tag in STREET_NAME_TAGS if tag in way.tags)
+        similar = []
+        found_ids = set()
+        for distance, normalized, items in self.similar_ways.find_similar(name, max_distance):
+            for way, geometry in items:
+                if way.id not in found_ids and _intersects(geometry, bounds):
+                    found_ids.add(way.id)
+                    similar.append((distance, way))
+        return similar
+
+    def get_streets_by_names(self, checks, tolerance=0, ignore_street_postfix=False, find_similar=False):
+        results = []
+        for check in checks:
+            minlat, minlon, maxlat, maxlon, name = check
+            if find_similar and not self._contains((minlat-tolerance, minlon-tolerance, maxlat+tolerance, maxlon+tolerance)):
+                results.extend(get_streets_by_names([check], tolerance, ignore_street_postfix, find_similar))
+                continue
+            streets = self.get_streets_by_name(*check, tolerance=tolerance, ignore_street_postfix=ignore_street_postfix)
+            if find_similar:
+                streets = (streets, len(streets) == 0 and len(self.find_similar_streets(*check, tolerance=tolerance)) > 0)
+            results.append(streets)
+        return results
+
+    def places_exist(self, checks, tolerance=0, ignore_postfix=False):
+        return [self.place_exists(*check, tolerance=tolerance, ignore_postfix=ignore_postfix) for check in checks]
+
+def _get_member_geometry(member):
+    """Returns the line string of a relation member of a result with
+    geometry (empty for relations)"""
+    if isinstance(member, overpy.RelationNode):
+        return [(float(member.attributes["lat"]), float(member.attributes["lon"]))]
+    return [(float(node.lat), float(node.lon)) for node in member.geometry or [] if node.lat is not None]
+
+def _intersects(geometry, bounds):
+    """Checks if a node or line string (list of (lat, lon)) intersects the
+    bounds (minlat, minlon, maxlat, maxlon)"""
+    minlat, minlon, maxlat, maxlon = bounds
+    for lat, lon in geometry:
+        if minlat <= lat <= maxlat and minlon <= lon <= maxlon:
+            return True
+    for (lat1, lon1), (lat2, lon2) in zip(geometry, geometry[1:]):
+        # Liang-Barsky clipping of the segment against the bounds
+        t0, t1 = 0.0, 1.0
+        dlat, dlon = lat2 - lat1, lon2 - lon1
+        for p, q in ((-dlat, lat1 - minlat), (dlat, maxlat - lat1), (-dlon, lon1 - minlon), (dlon, maxlon - lon1)):
+            if p == 0:
+                if q < 0:
+                    break
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+            if t0 > t1:
+                break
+        else:
+            return True
+    return False
+
 if __name__ == '__main__':
-    api = overpy.Overpass(url=OVERPASS_URL)
     query = """[timeout:600];nwr["addr:housenumber"](area:3600052345);out;"""
-    result = api.query(query)
-    print(len(result.nodes) + len(result.ways) + len(result.relations))
+    print(sum(1 for element in stream_query(query, keys=())))
@@ -8,11 +8,13 @@ class ProgressBar():
         if message:
             print(message)
     
-    def update(self, new_percentage):
+    def update(self, new_percentage, info=None):
         new_percentage = round(new_percentage, 2)
-        if new_percentage != self.percentage:
+        if new_percentage != self.percentage or info:
             sys.stdout.write("\r{} %   ".format(str(new_percentage).ljust(6)))
             sys.stdout.write('[{}]'.format(('#' * int(new_percentage / 2)).ljust(50)))
+            if info:
+                sys.stdout.write("  {}".format(info).ljust(24))
             sys.stdout.flush()
         self.percentage = new_percentage
 
@@ -18,16 +18,18 @@ westTransform = osr.CoordinateTransformation(westRef, targetRef)
 centralTransform = osr.CoordinateTransformation(centerRef, targetRef)
 eastTransfrom = osr.CoordinateTransformation(eastRef, targetRef)
 
+TRANSFORMATIONS = {
+    '31254': westTransform,
+    '31255': centralTransform,
+    '31256': eastTransfrom
+}
+
 def reproject(sourceCRS, point):
     """This function reprojects an array of coordinates (a point) to the desired CRS
     depending on their original CRS given by the parameter sourceCRS"""
     point = ogr.CreateGeometryFromWkt("POINT ({} {})".format(point[0], point[1]))
-    if sourceCRS == '31254':
-        point.Transform(westTransform)
-    elif sourceCRS == '31255':
-        point.Transform(centralTransform)
-    elif sourceCRS == '31256':
-        point.Transform(eastTransfrom)
+    if str(sourceCRS) in TRANSFORMATIONS:
+        point.Transform(TRANSFORMATIONS[str(sourceCRS)])
     else:
         print("unkown CRS: {}".format(sourceCRS))
         return([0, 0])
@@ -37,6 +39,42 @@ def reproject(sourceCRS, point):
 
     return [round(float(p), 6) for p in transformedPoint]
 
+def reproject_many(sourceCRS, rw, hw):
+    """Reprojects all points given by the sequences rw and hw, which share the
+    same source CRS, with a single transformation call and returns the lists
+    (lon, lat) with the same order and rounding as reproject"""
+    if str(sourceCRS) not in TRANSFORMATIONS:
+        print("unkown CRS: {}".format(sourceCRS))
+        return ([0] * len(rw), [0] * len(rw))
+    if len(rw) == 0:
+        return ([], [])
+    points = TRANSFORMATIONS[str(sourceCRS)].TransformPoints([(float(x), float(y)) for x, y in zip(rw, hw)])
+    return ([round(p[0], 6) for p in points], [round(p[1], 6) for p in points])
+
+def reproject_grouped(points_by_crs):
+    """Reprojects a dict {sourceCRS: (rw, hw)} with one transformation call
+    per CRS and returns a dict {sourceCRS: (lon, lat)}"""
+    return {crs: reproject_many(crs, rw, hw) for crs, (rw, hw) in points_by_crs.items()}
+
+def reproject_batch(sourceCRSs, points):
+    """Reprojects a list of points (rw, hw) with their individual source CRS
+    given by the list sourceCRSs. The points are grouped by CRS, so there is
+    only one transformation call per CRS. The result is a list of [lon, lat]
+    in the original order of points."""
+    groups = {}
+    for i, (crs, point) in enumerate(zip(sourceCRSs, points)):
+        indices, rw, hw = groups.setdefault(str(crs), ([], [], []))
+        indices.append(i)
+        rw.append(point[0])
+        hw.append(point[1])
+    result = [None] * len(points)
+    transformed = reproject_grouped({crs: (rw, hw) for crs, (indices, rw, hw) in groups.items()})
+    for crs, (indices, rw, hw) in groups.items():
+        lon, lat = transformed[crs]
+        for i, x, y in zip(indices, lon, lat):
+            result[i] = [x, y]
+    return result
+
 def get_distance(point1, point2):
     return haversine.get_distance(point1, point2)
 
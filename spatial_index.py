@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from math import asin, cos, floor, radians, sin, pi
+from haversine import get_distances, get_segment_distances, get_points, EARTH_RADIUS
+
+# Grid indexes of points and line segments for proximity searches, which
+# are built once for many queries (e.g. all addresses of a file). The
+# cells are about CELL_SIZE meters wide, so a query only compares the
+# elements of the cells around the query point. nearest searches ring by
+# ring around the cell of the query point and stops as soon as no element
+# outside the searched cells can be nearer. The distances to the elements
+# of the searched cells are computed at once by the haversine.get_*s
+# functions.
+
+CELL_SIZE = 100
+DEGREE_LENGTH = 111320
+
+class _GridIndex():
+    def __init__(self, reference_lat, cell_size):
+        self.cell_lat = float(cell_size) / DEGREE_LENGTH
+        self.cell_lon = float(cell_size) / (DEGREE_LENGTH * max(cos(radians(reference_lat)), 0.01))
+        self.cells = defaultdict(list)
+        self.extent = None
+
+    def _get_cell(self, lat, lon):
+        return (int(floor(lat / self.cell_lat)), int(floor(lon / self.cell_lon)))
+
+    def _add(self, key, cells):
+        for cell in cells:
+            self.cells[cell].append(key)
+        min_i = min(i for i, j in cells)
+        min_j = min(j for i, j in cells)
+        max_i = max(i for i, j in cells)
+        max_j = max(j for i, j in cells)
+        if self.extent is None:
+            self.extent = [min_i, min_j, max_i, max_j]
+        else:
+            self.extent = [min(self.extent[0], min_i), min(self.extent[1], min_j), max(self.extent[2], max_i), max(self.extent[3], max_j)]
+
+    def _get_segment_cells(self, start, end):
+        """Returns the cells crossed by the segment start -> end (grid
+        traversal, so long segments don't fill their whole bounding box)"""
+        x1, y1 = start[0] / self.cell_lat, start[1] / self.cell_lon
+        x2, y2 = end[0] / self.cell_lat, end[1] / self.cell_lon
+        i, j = self._get_cell(*start)
+        end_i, end_j = self._get_cell(*end)
+        step_i = 1 if end_i > i else -1
+        step_j = 1 if end_j > j else -1
+        # parameter t of the segment at the next cell border and per cell
+        next_i = ((i + (step_i > 0)) - x1) / (x2 - x1) if x2 != x1 else float("inf")
+        next_j = ((j + (step_j > 0)) - y1) / (y2 - y1) if y2 != y1 else float("inf")
+        delta_i = abs(1 / (x2 - x1)) if x2 != x1 else float("inf")
+        delta_j = abs(1 / (y2 - y1)) if y2 != y1 else float("inf")
+        cells = [(i, j)]
+        for step in range(abs(end_i - i) + abs(end_j - j)):
+            if (next_i < next_j and i != end_i) or j == end_j:
+                i += step_i
+                next_i += delta_i
+            else:
+                j += step_j
+                next_j += delta_j
+            cells.append((i, j))
+        return cells
+
+    def _get_ring(self, center, r):
+        """Returns the occupied cells with Chebyshev distance r to the cell center"""
+        ci, cj = center
+        min_i, min_j, max_i, max_j = self.extent
+        cells = []
+        for i in (ci - r, ci + r) if r > 0 else (ci,):
+            if min_i <= i <= max_i:
+                cells.extend((i, j) for j in range(max(cj - r, min_j), min(cj + r, max_j) + 1))
+        if r > 0:
+            for j in (cj - r, cj + r):
+                if min_j <= j <= max_j:
+                    cells.extend((i, j) for i in range(max(ci - r + 1, min_i), min(ci + r - 1, max_i) + 1))
+        return [cell for cell in cells if cell in self.cells]
+
+    def _get_min_outside_distance(self, point, center, r):
+        """Returns a lower bound of the distance of point to everything
+        outside of the cells with Chebyshev distance <= r to center"""
+        lat, lon = point
+        ci, cj = center
+        distances = [radians(lat - (ci - r) * self.cell_lat), radians((ci + r + 1) * self.cell_lat - lat)]
+        for delta_lon in (lon - (cj - r) * self.cell_lon, (cj + r + 1) * self.cell_lon - lon):
+            # distance to the meridian
+            distances.append(asin(min(sin(min(radians(delta_lon), pi / 2)) * cos(radians(lat)), 1)))
+        return min(distances) * EARTH_RADIUS
+
+    def _nearest(self, point, get_distances_to):
+        if self.extent is None:
+            return None
+        point = (float(point[0]), float(point[1]))
+        center = self._get_cell(*point)
+        min_i, min_j, max_i, max_j = self.extent
+        # the rings before the first one intersecting the extent are empty
+        r = max(min_i - center[0], center[0] - max_i, min_j - center[1], center[1] - max_j, 0)
+        max_r = max(center[0] - min_i, max_i - center[0], center[1] - min_j, max_j - center[1])
+        best = None
+        compared = set()
+        while r <= max_r:
+            if 8 * r > len(self.cells):
+                # sparse grid, comparing all remaining elements is faster
+                cells = self.cells.keys()
+                r = max_r
+            else:
+                cells = self._get_ring(center, r)
+            keys = [key for cell in cells for key in self.cells[cell] if key not in compared]
+            if keys:
+                compared.update(keys)
+                distance, key = min(zip(get_distances_to(point, keys), keys))
+                if best is None or (distance, key) < best:
+                    best = (float(distance), key)
+            if best is not None and best[0] <= self._get_min_outside_distance(point, center, r):
+                break
+            r += 1
+        return best[1], best[0]
+
+    def _within(self, point, radius, get_distances_to):
+        if self.extent is None:
+            return []
+        point = (float(point[0]), float(point[1]))
+        delta_lat = radius * 1.01 / DEGREE_LENGTH
+        delta_lon = radius * 1.01 / (DEGREE_LENGTH * max(cos(radians(point[0])), 0.01))
+        min_i, min_j = self._get_cell(point[0] - delta_lat, point[1] - delta_lon)
+        max_i, max_j = self._get_cell(point[0] + delta_lat, point[1] + delta_lon)
+        keys = set()
+        for i in range(max(min_i, self.extent[0]), min(max_i, self.extent[2]) + 1):
+            for j in range(max(min_j, self.extent[1]), min(max_j, self.extent[3]) + 1):
+                keys.update(self.cells.get((i, j), ()))
+        keys = list(keys)
+        results = sorted((float(distance), key) for distance, key in zip(get_distances_to(point, keys), keys) if distance <= radius)
+        return [(key, distance) for distance, key in results]
+
+class PointIndex(_GridIndex):
+    """Index of points (lat, lon), results are (index of the point, distance)"""
+    def __init__(self, points, cell_size=CELL_SIZE):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        reference_lat = sum(lat for lat, lon in self.points) / len(self.points) if self.points else 0
+        _GridIndex.__init__(self, reference_lat, cell_size)
+        for i, point in enumerate(self.points):
+            self._add(i, [self._get_cell(*point)])
+        self._points = get_points(self.points)
+
+    def _get_distances_to(self, point, keys):
+        if isinstance(self._points, list):
+            return get_distances(point, [self._points[i] for i in keys])
+        return get_distances(point, self._points[keys])
+
+    def nearest(self, point):
+        """Returns (index, distance) of the nearest point (the first one if
+        several are equally near) or None if the index is empty"""
+        return self._nearest(point, self._get_distances_to)
+
+    def within(self, point, radius):
+        """Returns [(index, distance)] of all points within radius meters, the
+        nearest first"""
+        return self._within(point, radius, self._get_distances_to)
+
+class SegmentIndex(_GridIndex):
+    """Index of the segments of lines (lists of (lat, lon)), results are
+    ((index of the line, index of the segment start), distance), see
+    haversine.get_distance_to_segment"""
+    def __init__(self, lines, cell_size=CELL_SIZE):
+        self.lines = [[(float(lat), float(lon)) for lat, lon in line] for line in lines]
+        lats = [lat for line in self.lines for lat, lon in line]
+        _GridIndex.__init__(self, sum(lats) / len(lats) if lats else 0, cell_size)
+        for i, line in enumerate(self.lines):
+            if len(line) == 1:
+                self._add((i, 0), [self._get_cell(*line[0])])
+            for j, (start, end) in enumerate(zip(line, line[1:])):
+                self._add((i, j), self._get_segment_cells(start, end))
+
+    def _get_distances_to(self, point, keys):
+        # a line of a single point is a segment from the point to itself
+        starts = [self.lines[i][j] for i, j in keys]
+        ends = [self.lines[i][min(j + 1, len(self.lines[i]) - 1)] for i, j in keys]
+        return get_segment_distances(point, starts, ends)
+
+    def nearest(self, point):
+        """Returns ((line, segment), distance) of the nearest segment (the
+        first one if several are equally near) or None if the index is
+        empty"""
+        return self._nearest(point, self._get_distances_to)
+
+    def within(self, point, radius):
+        """Returns [((line, segment), distance)] of all segments within
+        radius meters, the nearest first"""
+        return self._within(point, radius, self._get_distances_to)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+from collections import defaultdict
+import functools
+import re
 import string
 
 # vor der Anwendung wird noch eine allgemeine Normalisierung vorgenommen, 
@@ -54,8 +57,8 @@ NAMES = ('Ad.', 'Adam', 'Adalbert', 'Adolf', 'Alexander', 'Alfons', 'Alfred', 'A
     'Xaver',
     'Zach.', 'Zacharias')
 
-''' strips whitespace/dash, ß->ss, ignore case '''
-def normalize_streetname(street, expand_abbreviations=True, ignore_street_postfix=False):
+''' original implementation of normalize_streetname, which is kept as reference '''
+def normalize_streetname_reference(street, expand_abbreviations=True, ignore_street_postfix=False):
     valid_chars = string.ascii_letters + string.digits + "üäö.,()/;+ -'\"*`"
     translation_table = str.maketrans("áčéěëèíóőřšúž*`", "aceeeeioorsuz  ")
     s = street.replace("ß", "ss").lower()
@@ -65,25 +68,10 @@ def normalize_streetname(street, expand_abbreviations=True, ignore_street_postfi
     if expand_abbreviations:
         if s.endswith("str.") or s.endswith("g."):
             s = s[:-1] + "asse"
-        if not hasattr(normalize_streetname, "abbreviations"):
+        if not hasattr(normalize_streetname_reference, "abbreviations"):
             # preprocess abbr. and init static function variable
-            normalize_streetname.abbreviations = {}
-            for key, value in ABBREVIATIONS.items():
-                new_key = normalize_streetname(key, False)
-                new_value = normalize_streetname(value, False)
-                # use shortened version for comparison as this is unambiguous
-                if len(new_key) < len(new_value):
-                    normalize_streetname.abbreviations[new_value] = new_key
-                else:
-                    normalize_streetname.abbreviations[new_key] = new_value
-            for name in NAMES:
-                name = name.lower()
-                if name.startswith("th"):
-                    normalize_streetname.abbreviations[name] = 'th.'
-                else:
-                    normalize_streetname.abbreviations[name] = name[0] + '.'
-            #print(normalize_streetname.abbreviations)
-        for key, value in normalize_streetname.abbreviations.items():
+            normalize_streetname_reference.abbreviations = _get_abbreviations()
+        for key, value in normalize_streetname_reference.abbreviations.items():
             s = s.replace(key, value)
     if not all([char in valid_chars for char in s]):
         raise ValueError("non ascii character found in street name: ", s)
@@ -95,4 +83,214 @@ def normalize_streetname(street, expand_abbreviations=True, ignore_street_postfi
             s = s[:-5]
         elif s.endswith("weg"):
             s = s[:-3]
-    return s
\ No newline at end of file
+    return s
+
+def _get_abbreviations():
+    """Returns the normalized abbreviations in the order they are replaced"""
+    abbreviations = {}
+    for key, value in ABBREVIATIONS.items():
+        new_key = normalize_streetname_reference(key, False)
+        new_value = normalize_streetname_reference(value, False)
+        # use shortened version for comparison as this is unambiguous
+        if len(new_key) < len(new_value):
+            abbreviations[new_value] = new_key
+        else:
+            abbreviations[new_key] = new_value
+    for name in NAMES:
+        name = name.lower()
+        if name.startswith("th"):
+            abbreviations[name] = 'th.'
+        else:
+            abbreviations[name] = name[0] + '.'
+    return abbreviations
+
+def _get_trie_pattern(words):
+    """Returns a regular expression for the longest of the words starting at
+    a position, with common prefixes matched only once"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    def get_pattern(node):
+        alternatives = [re.escape(char) + get_pattern(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        pattern = alternatives[0] if len(alternatives) == 1 else "(?:%s)" % "|".join(alternatives)
+        if "" in node:
+            pattern = "(?:%s)?" % pattern
+        return pattern
+    return get_pattern(trie)
+
+def _overlaps(key, value):
+    """Checks if inserting value can create an occurrence of key"""
+    return (value in key or key in value or
+        any(key.startswith(value[i:]) for i in range(1, len(value))) or
+        any(key.endswith(value[:i]) for i in range(1, len(value))))
+
+CACHE_SIZE = 100000
+VALID_CHARS = string.ascii_letters + string.digits + "üäö.,()/;+ -'\"*`"
+_ABBREVIATIONS = list(_get_abbreviations().items())
+_ABBREVIATION_INDEX = {key: i for i, (key, value) in enumerate(_ABBREVIATIONS)}
+# every position where an abbreviation starts (the longest one)
+_ABBREVIATION_PATTERN = re.compile("(?=(%s))" % _get_trie_pattern(_ABBREVIATION_INDEX))
+# shorter abbreviations starting at the same position
+_PREFIX_INDEXES = [[j for j, (other, _) in enumerate(_ABBREVIATIONS) if other != key and key.startswith(other)]
+    for key, value in _ABBREVIATIONS]
+# later abbreviations, which may occur after the replacement
+_CREATED_ABBREVIATIONS = [[(j, other) for j, (other, _) in enumerate(_ABBREVIATIONS) if j > i and _overlaps(other, value)]
+    for i, (key, value) in enumerate(_ABBREVIATIONS)]
+_INVALID_CHAR_PATTERN = re.compile("[^%s]" % re.escape(VALID_CHARS))
+# str.translate is slow, so it's only used for non ascii characters
+_TRANSLATION_TABLE = str.maketrans("áčéěëèíóőřšúž", "aceeeeioorsuz")
+NGRAM_SIZE = 3
+# default edit distance of similar names per character of the normalized name
+MAX_RELATIVE_DISTANCE = 0.15
+
+def _expand_abbreviations(s):
+    """Replaces the abbreviations one after another in the order of the
+    table like the reference, but only those found by one pass of the
+    pattern or possibly created by a replacement"""
+    pending = set()
+    for match in _ABBREVIATION_PATTERN.finditer(s):
+        i = _ABBREVIATION_INDEX[match.group(1)]
+        pending.add(i)
+        pending.update(_PREFIX_INDEXES[i])
+    while pending:
+        i = min(pending)
+        pending.remove(i)
+        key, value = _ABBREVIATIONS[i]
+        if key in s:
+            s = s.replace(key, value)
+            pending.update(j for j, other in _CREATED_ABBREVIATIONS[i] if other in s)
+    return s
+
+''' strips whitespace/dash, ß->ss, ignore case (same result as
+normalize_streetname_reference, the last CACHE_SIZE results are cached) '''
+def normalize_streetname(street, expand_abbreviations=True, ignore_street_postfix=False):
+    # always call the cached function the same way, lru_cache keys positional
+    # and keyword arguments differently
+    return _normalize_streetname(street, expand_abbreviations, ignore_street_postfix)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _normalize_streetname(street, expand_abbreviations, ignore_street_postfix):
+    s = street.replace("ß", "ss").lower().replace("\xa0", "").replace("&", "+")
+    if not s.isascii():
+        s = s.translate(_TRANSLATION_TABLE)
+    s = s.replace("*", " ").replace("`", " ")
+    if expand_abbreviations:
+        if s.endswith("str.") or s.endswith("g."):
+            s = s[:-1] + "asse"
+        s = _expand_abbreviations(s)
+    if _INVALID_CHAR_PATTERN.search(s):
+        raise ValueError("non ascii character found in street name: ", s)
+    s = s.replace(" ", "").replace("-", "").replace("'", "").replace('"', "")
+    if ignore_street_postfix:
+        if s.endswith("strasse"):
+            s = s[:-7]
+        elif s.endswith("gasse"):
+            s = s[:-5]
+        elif s.endswith("weg"):
+            s = s[:-3]
+    return s
+
+normalize_streetname.cache_info = _normalize_streetname.cache_info
+normalize_streetname.cache_clear = _normalize_streetname.cache_clear
+
+def normalize_many(streets, expand_abbreviations=True, ignore_street_postfix=False):
+    """Returns the normalized names of streets (None for names with
+    unsupported characters)"""
+    normalized = []
+    for street in streets:
+        try:
+            normalized.append(_normalize_streetname(street, expand_abbreviations, ignore_street_postfix))
+        except ValueError:
+            normalized.append(None)
+    return normalized
+
+def get_edit_distance(a, b, max_distance=None):
+    """Returns the Levenshtein distance of a and b or None if it's greater
+    than max_distance"""
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (char_a != char_b)))
+        if max_distance is not None and min(current) > max_distance:
+            return None
+        previous = current
+    if max_distance is not None and previous[-1] > max_distance:
+        return None
+    return previous[-1]
+
+def _get_ngrams(s):
+    padded = "#" * (NGRAM_SIZE - 1) + s + "#" * (NGRAM_SIZE - 1)
+    return set(padded[i:i+NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+class FuzzyNameIndex():
+    """Index of names (normalized by normalize_streetname) by their n-grams
+    to find similar names without comparing with every name. An edit
+    removes at most NGRAM_SIZE n-grams, so names within edit distance k of
+    the query share all but k * NGRAM_SIZE of their n-grams and only those
+    are compared."""
+    def __init__(self, names, ignore_street_postfix=False):
+        """names is an iterable of (name, item), the items of names with
+        unsupported characters are ignored"""
+        self.ignore_street_postfix = ignore_street_postfix
+        self.names = []
+        self.items = []
+        self.ngram_counts = []
+        self.postings = defaultdict(list)
+        self.lengths = defaultdict(list)
+        ids = {}
+        for name, item in names:
+            try:
+                normalized = normalize_streetname(name, ignore_street_postfix=ignore_street_postfix)
+            except ValueError:
+                continue
+            if normalized not in ids:
+                i = ids[normalized] = len(self.names)
+                ngrams = _get_ngrams(normalized)
+                for ngram in ngrams:
+                    self.postings[ngram].append(i)
+                self.lengths[len(normalized)].append(i)
+                self.names.append(normalized)
+                self.items.append([])
+                self.ngram_counts.append(len(ngrams))
+            items = self.items[ids[normalized]]
+            if item not in items:
+                items.append(item)
+
+    def find_similar(self, name, max_distance=None):
+        """Returns [(distance, normalized name, items)] of all names within
+        the edit distance max_distance (default MAX_RELATIVE_DISTANCE per
+        character, at least 1) of name, the most similar first"""
+        try:
+            normalized = normalize_streetname(name, ignore_street_postfix=self.ignore_street_postfix)
+        except ValueError:
+            return []
+        if max_distance is None:
+            max_distance = max(1, int(len(normalized) * MAX_RELATIVE_DISTANCE))
+        ngrams = _get_ngrams(normalized)
+        min_common = len(ngrams) - max_distance * NGRAM_SIZE
+        if min_common > 0:
+            common = defaultdict(int)
+            for ngram in ngrams:
+                for i in self.postings.get(ngram, ()):
+                    common[i] += 1
+            candidates = [i for i, count in common.items()
+                if count >= min_common and count >= self.ngram_counts[i] - max_distance * NGRAM_SIZE]
+        else:
+            # short names may be similar without a common n-gram
+            candidates = [i for length in range(len(normalized) - max_distance, len(normalized) + max_distance + 1)
+                for i in self.lengths.get(length, ())]
+        similar = []
+        for i in candidates:
+            distance = get_edit_distance(normalized, self.names[i], max_distance)
+            if distance is not None:
+                similar.append((distance, self.names[i], self.items[i]))
+        similar.sort(key=lambda entry: entry[:2])
+        return similar
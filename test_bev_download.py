@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import http.server
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest import mock
+import bev_download
+
+def create_archive(seed):
+    """Returns a zip archive with a (stored, so it's large) ADRESSE.csv of
+    the key date 01102019"""
+    rand = random.Random(seed)
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr(zipfile.ZipInfo("ADRESSE.csv", date_time=(2019, 10, 1, 0, 0, 0)), bytes(rand.getrandbits(8) for i in range(300000)))
+        archive.writestr(zipfile.ZipInfo("STRASSE.csv", date_time=(2019, 10, 1, 0, 0, 0)), b"SKZ;STRASSENNAME\n")
+    return content.getvalue()
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.archive with Range/If-Range (ETag server.etag) support.
+    Responses are cut after server.truncate bytes as long as
+    server.interruptions > 0, without server.ranges ranges are ignored."""
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content = server.archive
+        start = 0
+        range_header = self.headers.get("Range")
+        if server.ranges and range_header and self.headers.get("If-Range", server.etag) == server.etag:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        if server.interruptions > 0:
+            server.interruptions -= 1
+            self.wfile.write(content[start:start + server.truncate])
+        else:
+            self.wfile.write(content[start:])
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+        self.server.archive = create_archive(1)
+        self.server.etag = '"1"'
+        self.server.ranges = True
+        self.server.interruptions = 0
+        self.server.truncate = 100000
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.url = bev_download.get_archive_url("01102019", self.base_url)
+        self.part_filename = os.path.join(self.cache_dir, "%s.part" % self.url.split('/')[-1])
+        for patch in (mock.patch("bev_download.time.sleep"), mock.patch("bev_download.CHUNK_SIZE", 10000)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def download(self):
+        return bev_download.download_archive("01102019", self.base_url, self.cache_dir, required_files=["ADRESSE.csv"])
+
+    def assert_archive(self, archive):
+        with open(archive, 'rb') as f:
+            self.assertEqual(f.read(), self.server.archive)
+        self.assertEqual(bev_download.verify_archive(archive, ["ADRESSE.csv"]), "01102019")
+        self.assertFalse(os.path.exists(self.part_filename))
+
+    def write_part(self, content, validator):
+        with open(self.part_filename, 'wb') as f:
+            f.write(content)
+        with open("%s.validator" % self.part_filename, 'w') as f:
+            f.write(validator)
+
+    def test_resume(self):
+        self.server.interruptions = 1
+        key_date, archive = self.download()
+        self.assertEqual(key_date, "01102019")
+        self.assert_archive(archive)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]["Range"], "bytes=%d-" % self.server.truncate)
+        self.assertEqual(self.server.requests[1]["If-Range"], self.server.etag)
+
+    def test_changed_archive(self):
+        self.write_part(create_archive(2)[:self.server.truncate], '"2"')
+        key_date, archive = self.download()
+        self.assert_archive(archive)
+        self.assertEqual(self.server.requests[0]["If-Range"], '"2"')
+
+    def test_no_range_support(self):
+        self.server.ranges = False
+        self.write_part(self.server.archive[:self.server.truncate], self.server.etag)
+        key_date, archive = self.download()
+        self.assert_archive(archive)
+        self.assertIn("Range", self.server.requests[0])
+
+    def test_complete_part(self):
+        self.write_part(self.server.archive, self.server.etag)
+        key_date, archive = self.download()
+        self.assert_archive(archive)
+
+    def test_cache(self):
+        key_date, archive = self.download()
+        self.assertEqual(os.path.basename(archive), "%s.zip" % bev_download._get_sha256(archive))
+        self.assertEqual(bev_download.get_cached_archive("01102019", self.cache_dir), archive)
+        self.assertIsNone(bev_download.get_cached_archive("01042019", self.cache_dir))
+        self.assertEqual(self.download(), (key_date, archive))
+        self.assertEqual(len(self.server.requests), 1)
+        # the current archive is downloaded again, but stored only once
+        self.assertEqual(bev_download.download_archive(None, self.base_url, self.cache_dir), (key_date, archive))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted([os.path.basename(archive), "01102019.sha256"]))
+
+    @mock.patch("bev_download.MAX_RETRIES", 3)
+    def test_retries(self):
+        self.server.truncate = 50000
+        self.server.interruptions = bev_download.MAX_RETRIES
+        with self.assertRaises(bev_download.DownloadError):
+            self.download()
+        self.assertEqual(len(self.server.requests), bev_download.MAX_RETRIES)
+        # the next attempt resumes the partial file
+        self.server.interruptions = 0
+        self.assert_archive(self.download()[1])
+        self.assertEqual(self.server.requests[-1]["Range"], "bytes=%d-" % (bev_download.MAX_RETRIES * self.server.truncate))
+
+    def test_corrupt_archive(self):
+        self.server.archive = self.server.archive[:-100]
+        with self.assertRaises((zipfile.BadZipFile, bev_download.DownloadError)):
+            self.download()
+        self.assertFalse(os.path.exists(self.part_filename))
+
+if __name__ == "__main__":
+    unittest.main()
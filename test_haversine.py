@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import random
+from math import hypot
+import unittest
+from unittest import mock
+import haversine
+
+def get_random_points(rand, count, center=(48.2, 16.4), radius=0.02):
+    return [(center[0] + rand.uniform(-radius, radius), center[1] + rand.uniform(-radius, radius)) for i in range(count)]
+
+class KernelTest(unittest.TestCase):
+    """Compares the get_*s functions with the scalar functions, with and
+    without numpy and fast geometry"""
+    def setUp(self):
+        rand = random.Random(1)
+        self.point = get_random_points(rand, 1)[0]
+        self.points = get_random_points(rand, 200)
+        # segments in all directions, some of them with the point beside, behind or beyond them
+        self.starts = get_random_points(rand, 200)
+        self.ends = [(lat + rand.uniform(-0.01, 0.01), lon + rand.uniform(-0.01, 0.01)) for lat, lon in self.starts]
+        self.starts.append(self.point)
+        self.ends.append(self.ends[0])
+        self.starts.append(self.starts[0])
+        self.ends.append(self.starts[0])
+
+    def run_all(self, check):
+        for fast_geometry in (False, True):
+            for numpy in (haversine.numpy, None):
+                with self.subTest(fast_geometry=fast_geometry, numpy=numpy is not None), \
+                        mock.patch("haversine._fast_geometry", fast_geometry), mock.patch("haversine.numpy", numpy):
+                    check()
+
+    def assert_all_almost_equal(self, values, expected, delta=1e-6):
+        self.assertEqual(len(values), len(expected))
+        for value, expected_value in zip(values, expected):
+            self.assertAlmostEqual(value, expected_value, delta=delta)
+
+    def test_distances(self):
+        self.run_all(lambda: self.assert_all_almost_equal(haversine.get_distances(self.point, self.points),
+            [haversine.get_distance(self.point, other) for other in self.points]))
+
+    def test_pairwise_distances(self):
+        def check():
+            distances = haversine.get_pairwise_distances(self.points[:20], self.points[20:50])
+            self.assertEqual(len(distances), 20)
+            for point, row in zip(self.points, distances):
+                self.assert_all_almost_equal(row, [haversine.get_distance(point, other) for other in self.points[20:50]])
+        self.run_all(check)
+
+    def test_bearings(self):
+        self.run_all(lambda: self.assert_all_almost_equal(haversine.get_bearings(self.point, self.points),
+            [haversine.bearing(self.point, other) for other in self.points], delta=1e-9))
+
+    def test_cross_track_distances(self):
+        self.run_all(lambda: self.assert_all_almost_equal(haversine.get_cross_track_distances(self.starts, self.ends, self.point),
+            [haversine.get_cross_track_distance(start, end, self.point) for start, end in zip(self.starts, self.ends)]))
+
+    def test_segment_distances(self):
+        self.run_all(lambda: self.assert_all_almost_equal(haversine.get_segment_distances(self.point, self.starts, self.ends),
+            [haversine.get_distance_to_segment(start, end, self.point) for start, end in zip(self.starts, self.ends)]))
+
+    def test_distance_to_segment(self):
+        start, end = (48.0, 16.0), (48.0, 16.01)
+        for fast_geometry in (False, True):
+            with mock.patch("haversine._fast_geometry", fast_geometry):
+                # beside the segment: cross track distance, behind or beyond it: distance to the nearer end
+                self.assertAlmostEqual(haversine.get_distance_to_segment(start, end, (48.001, 16.005)),
+                    haversine.get_cross_track_distance(start, end, (48.001, 16.005)), delta=0.01)
+                self.assertAlmostEqual(haversine.get_distance_to_segment(start, end, (48.001, 15.99)),
+                    haversine.get_distance(start, (48.001, 15.99)), delta=0.01)
+                self.assertAlmostEqual(haversine.get_distance_to_segment(start, end, (47.999, 16.02)),
+                    haversine.get_distance(end, (47.999, 16.02)), delta=0.01)
+                self.assertAlmostEqual(haversine.get_distance_to_segment(start, start, end), haversine.get_distance(start, end), delta=0.01)
+
+    def test_nearest_segment(self):
+        def check():
+            expected = [haversine.get_distance_to_segment(start, end, self.point) for start, end in zip(self.starts, self.ends)]
+            i, distance = haversine.get_nearest_segment(self.point, self.starts, self.ends)
+            self.assertEqual(i, expected.index(min(expected)))
+            self.assertAlmostEqual(distance, min(expected), delta=1e-6)
+            self.assertIsNone(haversine.get_nearest_segment(self.point, [], []))
+        self.run_all(check)
+
+def get_random_points_around(rand, frame, radius, count):
+    points = []
+    while len(points) < count:
+        point = (frame.lat + rand.uniform(-1, 1) * radius / haversine.DEGREE_LENGTH, frame.lon + rand.uniform(-1, 1) * radius / frame.scale_lon)
+        if hypot(*haversine.LocalFrame((frame.lat, frame.lon), None).project(point)) <= radius:
+            points.append(point)
+    return points
+
+class FastGeometryTest(unittest.TestCase):
+    """Compares the fast geometry with the great circle calculations for
+    random points around random origins in Austria and checks the error
+    bounds given in haversine.py"""
+    samples = 20000
+    bounds = (46.3, 9.5, 49.1, 17.2)
+
+    def test_error_bounds(self):
+        rand = random.Random(0)
+        for i in range(self.samples):
+            frame = haversine.LocalFrame((rand.uniform(self.bounds[0], self.bounds[2]), rand.uniform(self.bounds[1], self.bounds[3])))
+            point1, point2 = get_random_points_around(rand, frame, haversine.LOCAL_FRAME_RADIUS, 2)
+            start, end, point = get_random_points_around(rand, frame, haversine.FAST_CROSS_TRACK_RADIUS, 3)
+            distance = haversine.get_distance(point1, point2)
+            cross_track_distance = haversine.get_cross_track_distance(start, end, point)
+            with mock.patch("haversine._fast_geometry", True):
+                if distance >= 1:
+                    self.assertLess(abs(haversine.get_distance(point1, point2) - distance) / distance, haversine.FAST_DISTANCE_ERROR)
+                    self.assertLess(abs(frame.get_distance(point1, point2) - distance) / distance, frame.max_relative_error)
+                self.assertLess(abs(haversine.get_cross_track_distance(start, end, point) - cross_track_distance), haversine.FAST_CROSS_TRACK_ERROR)
+
+    def test_example(self):
+        p1 = (48.0395233, 16.4363301)
+        p2 = (48.0404657, 16.4362577)
+        p3 = (48.0399806, 16.4363636)
+        for fast_geometry in (False, True):
+            with mock.patch("haversine._fast_geometry", fast_geometry):
+                self.assertAlmostEqual(haversine.get_distance(p1, p2), 105, delta=1)
+                self.assertAlmostEqual(haversine.get_cross_track_distance(p1, p2, p3), 5, delta=1)
+
+if __name__ == "__main__":
+    unittest.main()
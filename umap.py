@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import itertools
 import bev_db
+import bev_history
+import overpass
 import projection
 from gkz import get_bezirk, get_bundesland
 from geojson import Point, Feature, FeatureCollection, dump, Polygon
-from streetnames import normalize_streetname
 
 class Umap():
     def __init__(self):
@@ -79,11 +81,10 @@ def ignore_streetname(name):
     return False
 
 def generate_new_street_umap(number_of_snapshots=len(bev_db.SNAPSHOTS), include_found_objects=False, gkz_starts_with = ""):
-    ids = {}
     skz_found = {}
     gkz_starts_with += "%"
     con = bev_db.get_db_conn() # always use newest db to check found status
-    for skz, found in con.execute("SELECT SKZ, FOUND FROM STRASSE"):
+    for skz, found in con.execute("SELECT CAST(SKZ AS INTEGER), FOUND FROM STRASSE"):
         if found is None:
             skz_found[skz] = bev_db.SearchStatus.NOT_FOUND
         else:
@@ -91,27 +92,20 @@ def generate_new_street_umap(number_of_snapshots=len(bev_db.SNAPSHOTS), include_
     umap = Umap()
     number_of_streets = 0
     number_of_missing_streets = 0
-    for (old, new) in zip(bev_db.SNAPSHOTS[-number_of_snapshots:], bev_db.SNAPSHOTS[-number_of_snapshots+1:]):
+    key_dates = bev_db.SNAPSHOTS[-number_of_snapshots:]
+    history_con = bev_history.get_history_conn(key_dates)
+    for (old, new) in zip(key_dates, key_dates[1:]):
         print(old, new)
-        if not old in ids:
-            con = bev_db.get_db_conn(old)
-            ids[old] = set()
-            for row in con.execute("SELECT SKZ FROM STRASSE"):
-                ids[old].add(row[0])
-        con = bev_db.get_db_conn(new)
-        if not new in ids:
-            ids[new] = set()
-            for row in con.execute("SELECT SKZ FROM STRASSE"):
-                ids[new].add(row[0])
-        new_ids = ids[new] - ids[old]
-        cur = con.cursor()
-        query = """SELECT GEMEINDE.GKZ, GEMEINDE.GEMEINDENAME, STRASSE.SKZ, STRASSE.STRASSENNAME, 
-            COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-            FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = ADRESSE.GKZ 
-            WHERE STRASSE.GKZ LIKE ? AND STRASSE.SKZ IN ({}) AND ADRESSE.HAUSNRZAHL1 != ""
-            GROUP BY STRASSE.SKZ HAVING COUNT(ADRESSE.ADRCD) > 1 ORDER BY 1, 4 DESC""".format(",".join("?"*len(new_ids)))
-        parameters = [gkz_starts_with] + list(new_ids)
-        for row in cur.execute(query, parameters):
+        new_ids = bev_history.get_new_streets(history_con, old, new)
+        # names and extents of the versions valid at the new snapshot
+        query = """SELECT g.GKZ, g.GEMEINDENAME, s.SKZ, s.STRASSENNAME, 
+            SUM(e.HNR_COUNT), MIN(e.HNR_MIN_LAT), MIN(e.HNR_MIN_LON), MAX(e.HNR_MAX_LAT), MAX(e.HNR_MAX_LON) 
+            FROM STRASSE_HISTORY s JOIN STRASSE_EXTENT_HISTORY e ON e.SKZ = s.SKZ JOIN GEMEINDE_HISTORY g ON g.GKZ = e.GKZ 
+            WHERE ? BETWEEN s.VALID_FROM AND s.VALID_TO AND ? BETWEEN e.VALID_FROM AND e.VALID_TO AND ? BETWEEN g.VALID_FROM AND g.VALID_TO
+            AND s.GKZ LIKE ? AND s.SKZ IN ({}) AND e.HNR_COUNT > 0
+            GROUP BY s.SKZ HAVING SUM(e.HNR_COUNT) > 1 ORDER BY 1, 4 DESC""".format(",".join("?"*len(new_ids)))
+        parameters = [bev_history.get_snapshot_id(history_con, new)] * 3 + [gkz_starts_with] + list(new_ids)
+        for row in history_con.execute(query, parameters):
             gkz, gemeindename, skz, strassenname, count, min_lat, min_lon, max_lat, max_lon = row
             if ignore_streetname(strassenname):
                 continue
@@ -127,7 +121,7 @@ def generate_new_street_umap(number_of_snapshots=len(bev_db.SNAPSHOTS), include_
             except ZeroDivisionError:
                 adr_per_km2 = 0            
             josm_link = umap.get_josm_link(min_lon, max_lon, min_lat, max_lat, area_size=area_size)
-            properties={"name": "#%s %s (%s)" % (gkz[3:], strassenname, gemeindename),
+            properties={"name": "#%s %s (%s)" % (str(gkz)[3:], strassenname, gemeindename),
                         "description": "%s\nNeu mit Stichtag %s\n%s Adressen\nSKZ %s\nGröße: %4.2f km²\nAdr./km²: %s" % (josm_link, bev_db.format_key_date(new), count, skz, area_size, int(adr_per_km2))
             }
             feature = Feature(properties=properties, 
@@ -136,6 +130,8 @@ def generate_new_street_umap(number_of_snapshots=len(bev_db.SNAPSHOTS), include_
             if skz not in skz_found or skz_found[skz] != bev_db.SearchStatus.FOUND:
                 if skz in skz_found and skz_found[skz] == bev_db.SearchStatus.UNDER_CONSTRUCTION:
                     umap.add_feature(feature, layer, {"color": "Orange"})
+                elif skz in skz_found and skz_found[skz] == bev_db.SearchStatus.SIMILAR_NAME:
+                    umap.add_feature(feature, layer, {"color": "Yellow"})
                 else:
                     number_of_missing_streets += 1
                     umap.add_feature(feature, layer, {"color": "Red"})
@@ -149,32 +145,27 @@ def generate_new_street_umap(number_of_snapshots=len(bev_db.SNAPSHOTS), include_
     umap.dump(filename)
     print("%s/%s streets missing" % (number_of_missing_streets, number_of_streets))
 
-def generate_renamed_street_umap(number_of_snapshots=2, include_found_objects=False, ignore_minor_changes=True):
-    streets = {}
-    for snapshot in bev_db.SNAPSHOTS[-number_of_snapshots:]:
-        print(snapshot)
-        con = bev_db.get_db_conn(snapshot)
-        cur = con.cursor()
-        sql = "SELECT s.SKZ, s.STRASSENNAME, g.GEMEINDENAME, g.GKZ FROM STRASSE s JOIN GEMEINDE g ON s.GKZ = g.GKZ"
-        for row in cur.execute(sql):
-            skz, name, gemeinde, gkz = row
-            if skz in streets:
-                if ignore_minor_changes:
-                    if normalize_streetname(streets[skz][-1][0]) != normalize_streetname(name):
-                        streets[skz].append((name, snapshot, gemeinde, gkz))
-                elif streets[skz][-1][0] != name:
-                    streets[skz].append((name, snapshot, gemeinde, gkz))
-            else:
-                streets[skz] = [(name, snapshot, gemeinde, gkz)]
-    
-    renamed_skz = [skz for skz in streets if len(streets[skz]) > 1]
-    query = """SELECT GEMEINDE.GKZ, GEMEINDE.GEMEINDENAME, STRASSE.SKZ, STRASSE.STRASSENNAME, STRASSE.FOUND, 
-        COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-        FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = ADRESSE.GKZ WHERE STRASSE.SKZ IN ({}) 
-        AND ADRESSE.HAUSNRZAHL1 != ""
-        GROUP BY STRASSE.SKZ HAVING COUNT(ADRESSE.ADRCD) > 1 ORDER BY 1, 4 DESC""".format(",".join("?"*len(renamed_skz)))
+def generate_renamed_street_umap(number_of_snapshots=2, include_found_objects=False, ignore_minor_changes=True, check_old_names=False):
+    """With check_old_names the highways of every municipality are
+    downloaded once (see overpass.AreaIndex) to find streets, which are
+    still mapped with their old (or a similar) name"""
+    key_dates = bev_db.SNAPSHOTS[-number_of_snapshots:]
+    history_con = bev_history.get_history_conn(key_dates)
+    streets = bev_history.get_renamed_streets(history_con, key_dates, ignore_minor_changes)
+    renamed_skz = list(streets.keys())
+    con = bev_db.get_db_conn(bev_db.SNAPSHOTS[-1])
+    query = """SELECT GEMEINDE.GKZ, GEMEINDE.GEMEINDENAME, CAST(STRASSE.SKZ AS INTEGER), STRASSE.STRASSENNAME, STRASSE.FOUND, 
+        SUM(HNR_COUNT), MIN(HNR_MIN_LAT), MIN(HNR_MIN_LON), MAX(HNR_MAX_LAT), MAX(HNR_MAX_LON) 
+        FROM STRASSE JOIN STRASSE_EXTENT ON STRASSE_EXTENT.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = STRASSE_EXTENT.GKZ WHERE CAST(STRASSE.SKZ AS INTEGER) IN ({}) 
+        AND HNR_COUNT > 0
+        GROUP BY STRASSE.SKZ HAVING SUM(HNR_COUNT) > 1 ORDER BY 1, 4 DESC""".format(",".join("?"*len(renamed_skz)))
     umap = Umap()
-    for row in con.execute(query, tuple(renamed_skz)):
+    old_names = {}
+    rows = con.execute(query, tuple(renamed_skz)).fetchall()
+    if check_old_names:
+        overpass.use_local_overpass(True)
+        old_names = _find_old_names(rows, streets)
+    for row in rows:
         gkz, gemeindename, skz, strassenname, found, count, min_lat, min_lon, max_lat, max_lon = row
         bezirkname = get_bezirk(gkz)
         bundesland = get_bundesland(gkz)
@@ -188,6 +179,8 @@ def generate_renamed_street_umap(number_of_snapshots=2, include_found_objects=Fa
         except ZeroDivisionError:
             adr_per_km2 = 0
         changes = "\n".join(["%s: %s" % (bev_db.format_key_date(s[1]), s[0]) for s in streets[skz]])
+        if skz in old_names:
+            changes += "\nin OSM noch als '%s'" % old_names[skz]
         josm_link = umap.get_josm_link(min_lon, max_lon, min_lat, max_lat, area_size=area_size)
         properties={"name": "%s (%s)" % (strassenname, gemeindename),
                     "description": """%s\n%s\n%s Adressen\nSKZ %s\nGröße: %4.2f km²\nAdr./km²: %s""" % (josm_link, changes, count, skz, area_size, int(adr_per_km2))
@@ -198,19 +191,46 @@ def generate_renamed_street_umap(number_of_snapshots=2, include_found_objects=Fa
         if found != bev_db.SearchStatus.FOUND:
             if found == bev_db.SearchStatus.UNDER_CONSTRUCTION:
                 umap.add_feature(feature, layer, {"color": "Orange"})
+            elif skz in old_names:
+                umap.add_feature(feature, layer, {"color": "Purple"})
+            elif found == bev_db.SearchStatus.SIMILAR_NAME:
+                umap.add_feature(feature, layer, {"color": "Yellow"})
             else:
                 umap.add_feature(feature, layer, {"color": "Red"})
         elif include_found_objects:
             umap.add_feature(feature, layer)
     umap.dump('renamed_streets.umap')
 
+def _find_old_names(rows, streets, tolerance=0.01):
+    """Returns {SKZ: OSM name} of the renamed streets (rows sorted by GKZ),
+    which aren't found but have a way named like one of their old names"""
+    old_names = {}
+    for gkz, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = [row for row in group if row[4] != bev_db.SearchStatus.FOUND and row[6] is not None]
+        if not group:
+            continue
+        area = overpass.AreaIndex(min(row[6] for row in group) - tolerance, min(row[7] for row in group) - tolerance,
+            max(row[8] for row in group) + tolerance, max(row[9] for row in group) + tolerance)
+        for row in group:
+            skz, strassenname, bounds = row[2], row[3], row[6:]
+            # ways, which are more similar to the new name, are ignored
+            new_distances = {way.id: distance for distance, way in area.find_similar_streets(*bounds, strassenname, tolerance=tolerance)}
+            for name, key_date in streets[skz][:-1]:
+                for distance, way in area.find_similar_streets(*bounds, name, tolerance=tolerance):
+                    if distance < new_distances.get(way.id, distance + 1):
+                        old_names[skz] = way.tags.get("name", name)
+                        break
+                if skz in old_names:
+                    break
+    return old_names
+
 def generate_missing_street_umap(gkz_starts_with=""):
     con = bev_db.get_db_conn()
     gkz_starts_with += "%"
-    query = """SELECT GEMEINDE.GKZ, GEMEINDE.GEMEINDENAME, STRASSE.SKZ, STRASSENNAME, COUNT(ADRESSE.ADRCD), MIN(LAT), MIN(LON), MAX(LAT), MAX(LON) 
-        FROM STRASSE JOIN ADRESSE ON ADRESSE.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = ADRESSE.GKZ WHERE STRASSE.FOUND == 0 AND STRASSE.GKZ LIKE ?
-        AND ADRESSE.HAUSNRZAHL1 != ""
-        GROUP BY STRASSE.SKZ, STRASSENNAME HAVING COUNT(ADRESSE.ADRCD) == 1 ORDER BY 1, 4 DESC"""
+    query = """SELECT GEMEINDE.GKZ, GEMEINDE.GEMEINDENAME, STRASSE.SKZ, STRASSENNAME, SUM(HNR_COUNT), MIN(HNR_MIN_LAT), MIN(HNR_MIN_LON), MAX(HNR_MAX_LAT), MAX(HNR_MAX_LON) 
+        FROM STRASSE JOIN STRASSE_EXTENT ON STRASSE_EXTENT.SKZ = STRASSE.SKZ JOIN GEMEINDE ON GEMEINDE.GKZ = STRASSE_EXTENT.GKZ WHERE STRASSE.FOUND == 0 AND STRASSE.GKZ LIKE ?
+        AND HNR_COUNT > 0
+        GROUP BY STRASSE.SKZ, STRASSENNAME HAVING SUM(HNR_COUNT) == 1 ORDER BY 1, 4 DESC"""
     umap = Umap()
     for row in con.execute(query, (gkz_starts_with,)):
         gkz, gemeindename, skz, strassenname, count, min_lat, min_lon, max_lat, max_lon = row